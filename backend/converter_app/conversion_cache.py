@@ -0,0 +1,361 @@
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from converter_app.storage import task_dir
+
+# converter_version of the entries adopted by the storage janitor's reconcile walk
+ADOPTED_VERSION = "adopted"
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ConversionCache:
+    """
+    Content-addressed index of finished conversions.
+
+    Entries are keyed by (SHA-256 of the uploaded file, converter version) and point at the
+    dt_* output that was produced for it. Each entry owns its task directory under BASE_DIR;
+    when the cached directories grow past max_bytes the least recently used ones are deleted.
+    The index is a SQLite file so hit/miss counters are shared by every worker process.
+    A cache hit gets its own task directory with a link to the cached output under the new
+    upload's name; these aliases are removed together with the entry they point at.
+    """
+
+    def __init__(self, db_path, base_dir, max_bytes):
+        self.db_path = db_path
+        self.base_dir = base_dir
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        self.evict_lock = threading.Lock()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                content_hash TEXT NOT NULL,
+                converter_version TEXT NOT NULL,
+                output_path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (content_hash, converter_version)
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_entries_lru ON cache_entries (last_access)")
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_entries_output ON cache_entries (output_path)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache_aliases (
+                output_path TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                converter_version TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_aliases_entry ON cache_aliases (content_hash, converter_version)")
+        # Every task directory, registered when its task is created, so the janitor finds
+        # orphans here instead of walking BASE_DIR on the share
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS task_dirs (
+                path TEXT PRIMARY KEY,
+                task_id TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS task_dirs_created ON task_dirs (created_at)")
+        conn.execute("CREATE TABLE IF NOT EXISTS cache_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute(
+            "INSERT OR IGNORE INTO cache_stats (name, value) VALUES "
+            "('hits', 0), ('misses', 0), ('evictions', 0), ('expired', 0), ('janitor_last_run', 0), ('janitor_last_reconcile', 0)"
+        )
+        # The full walk of BASE_DIR is due one reconcile interval after the first start, not at boot
+        conn.execute("UPDATE cache_stats SET value = ? WHERE name = 'janitor_last_reconcile' AND value = 0", (int(time.time()),))
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _count(self, conn, name, amount=1):
+        conn.execute("UPDATE cache_stats SET value = value + ? WHERE name = ?", (amount, name))
+
+    def lookup(self, content_hash, converter_version):
+        """Return the cached output path for this content, or None on a miss"""
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT output_path FROM cache_entries WHERE content_hash = ? AND converter_version = ?",
+            (content_hash, converter_version),
+        ).fetchone()
+
+        output_path = row[0] if row else None
+        if output_path and not os.path.exists(output_path):
+            # Moved to the sharded layout (migrate_storage_layout) since it was indexed
+            sharded = os.path.join(task_dir(self.base_dir, os.path.basename(os.path.dirname(output_path))), os.path.basename(output_path))
+            if os.path.exists(sharded):
+                self.relocate(os.path.dirname(output_path), os.path.dirname(sharded))
+                output_path = sharded
+
+        if output_path and os.path.exists(output_path):
+            conn.execute(
+                "UPDATE cache_entries SET last_access = ?, hits = hits + 1 WHERE content_hash = ? AND converter_version = ?",
+                (time.time(), content_hash, converter_version),
+            )
+            self._count(conn, "hits")
+            return output_path
+
+        if row:
+            # Output was removed behind our back, forget about it
+            logging.warning(f"Cached output missing on disk, dropping cache entry: {row[0]}")
+            conn.execute(
+                "DELETE FROM cache_entries WHERE content_hash = ? AND converter_version = ?",
+                (content_hash, converter_version),
+            )
+        self._count(conn, "misses")
+        return None
+
+    def lookup_output(self, output_path):
+        """
+        Return (content_hash, converter_version) of the entry owning output_path, or None.
+        Counts as a use for the LRU, so outputs that keep being downloaded stay cached.
+        """
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT content_hash, converter_version FROM cache_entries WHERE output_path = ?",
+            (output_path,),
+        ).fetchone() or conn.execute(
+            "SELECT content_hash, converter_version FROM cache_aliases WHERE output_path = ?",
+            (output_path,),
+        ).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE cache_entries SET last_access = ? WHERE content_hash = ? AND converter_version = ?",
+                (time.time(), row[0], row[1]),
+            )
+        return row
+
+    def store(self, content_hash, converter_version, output_path):
+        """
+        Index output_path for this content. When an identical upload was converted at the same
+        time and got there first its entry is kept and False is returned; output_path then
+        isn't owned by the cache and is removed by the janitor after its task expired.
+        """
+        now = time.time()
+        size = directory_size(os.path.dirname(output_path))
+        cursor = self._connection().execute(
+            """
+            INSERT OR IGNORE INTO cache_entries
+            (content_hash, converter_version, output_path, size, created_at, last_access, hits)
+            VALUES (?, ?, ?, ?, ?, ?, 0)
+            """,
+            (content_hash, converter_version, output_path, size, now, now),
+        )
+        if cursor.rowcount != 1:
+            return False
+        self.evict()
+        return True
+
+    def adopt(self, output_path, created_at):
+        """
+        Index an output found on disk that no entry knows about (converted before the index
+        or the directory registry existed), so age, idle and size limits apply to it like to
+        any other. Its content hash is unknown, the entry is keyed by its task directory and
+        never matches a lookup. Returns whether it was added.
+        """
+        size = directory_size(os.path.dirname(output_path))
+        cursor = self._connection().execute(
+            """
+            INSERT OR IGNORE INTO cache_entries
+            (content_hash, converter_version, output_path, size, created_at, last_access, hits)
+            VALUES (?, ?, ?, ?, ?, ?, 0)
+            """,
+            (f"adopted-{os.path.basename(os.path.dirname(output_path))}", ADOPTED_VERSION, output_path, size, created_at, created_at),
+        )
+        return cursor.rowcount == 1
+
+    def add_alias(self, content_hash, converter_version, output_path):
+        """Register output_path, a link to the cached output of this content, to be removed with its entry"""
+        self._connection().execute(
+            "INSERT OR REPLACE INTO cache_aliases (output_path, content_hash, converter_version, created_at) VALUES (?, ?, ?, ?)",
+            (output_path, content_hash, converter_version, time.time()),
+        )
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        with self.evict_lock:
+            conn = self._connection()
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+
+            evicted = 0
+            rows = conn.execute(
+                "SELECT content_hash, converter_version, output_path, size FROM cache_entries ORDER BY last_access"
+            ).fetchall()
+            for content_hash, converter_version, output_path, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self._remove_entry(conn, content_hash, converter_version, output_path)
+                total -= size
+                evicted += 1
+
+            self._count(conn, "evictions", evicted)
+            logging.info(f"Conversion cache evicted {evicted} entries, {total} bytes remaining")
+            return evicted
+
+    def expire(self, created_before=None, accessed_before=None):
+        """
+        Delete entries created before `created_before` or not used (converted again or
+        downloaded) since `accessed_before`, both unix timestamps. Returns (entries, bytes).
+        """
+        conditions, params = [], []
+        if created_before:
+            conditions.append("created_at < ?")
+            params.append(created_before)
+        if accessed_before:
+            conditions.append("last_access < ?")
+            params.append(accessed_before)
+        if not conditions:
+            return 0, 0
+
+        with self.evict_lock:
+            conn = self._connection()
+            rows = conn.execute(
+                f"SELECT content_hash, converter_version, output_path, size FROM cache_entries WHERE {' OR '.join(conditions)}",
+                params,
+            ).fetchall()
+            for content_hash, converter_version, output_path, _ in rows:
+                self._remove_entry(conn, content_hash, converter_version, output_path)
+            self._count(conn, "expired", len(rows))
+        freed = sum(row[3] for row in rows)
+        if rows:
+            logging.info(f"Conversion cache expired {len(rows)} entries, {freed} bytes freed")
+        return len(rows), freed
+
+    def _remove_dir(self, output_path):
+        task_dir = os.path.dirname(output_path)
+        # Never delete anything outside BASE_DIR, whatever ended up in the index
+        if os.path.commonpath([os.path.abspath(task_dir), os.path.abspath(self.base_dir)]) == os.path.abspath(self.base_dir) \
+                and os.path.abspath(task_dir) != os.path.abspath(self.base_dir):
+            shutil.rmtree(task_dir, ignore_errors=True)
+
+    def _remove_entry(self, conn, content_hash, converter_version, output_path):
+        self._remove_dir(output_path)
+        aliases = conn.execute(
+            "SELECT output_path FROM cache_aliases WHERE content_hash = ? AND converter_version = ?",
+            (content_hash, converter_version),
+        ).fetchall()
+        for (alias_path,) in aliases:
+            self._remove_dir(alias_path)
+        conn.execute(
+            "DELETE FROM cache_aliases WHERE content_hash = ? AND converter_version = ?",
+            (content_hash, converter_version),
+        )
+        conn.execute(
+            "DELETE FROM cache_entries WHERE content_hash = ? AND converter_version = ?",
+            (content_hash, converter_version),
+        )
+
+    def relocate(self, old_dir, new_dir):
+        """Point the entries whose output lives in old_dir at new_dir, after the directory was moved"""
+        conn = self._connection()
+        prefix = os.path.join(old_dir, "")
+        rows = conn.execute(
+            "SELECT content_hash, converter_version, output_path FROM cache_entries WHERE substr(output_path, 1, ?) = ?",
+            (len(prefix), prefix),
+        ).fetchall()
+        moved = 0
+        for content_hash, converter_version, output_path in rows:
+            if os.path.dirname(output_path) != old_dir:
+                continue
+            conn.execute(
+                "UPDATE cache_entries SET output_path = ? WHERE content_hash = ? AND converter_version = ?",
+                (os.path.join(new_dir, os.path.basename(output_path)), content_hash, converter_version),
+            )
+            moved += 1
+        aliases = conn.execute(
+            "SELECT output_path FROM cache_aliases WHERE substr(output_path, 1, ?) = ?", (len(prefix), prefix)
+        ).fetchall()
+        for (output_path,) in aliases:
+            if os.path.dirname(output_path) == old_dir:
+                conn.execute(
+                    "UPDATE cache_aliases SET output_path = ? WHERE output_path = ?",
+                    (os.path.join(new_dir, os.path.basename(output_path)), output_path),
+                )
+                moved += 1
+        conn.execute(
+            "UPDATE task_dirs SET path = ? WHERE path = ?", (os.path.abspath(new_dir), os.path.abspath(old_dir))
+        )
+        return moved
+
+    def register_dir(self, path, task_id):
+        """Track the task directory of a new task, see StorageJanitor.remove_orphans"""
+        self._connection().execute(
+            "INSERT OR REPLACE INTO task_dirs (path, task_id, created_at) VALUES (?, ?, ?)",
+            (os.path.abspath(path), task_id, time.time()),
+        )
+
+    def registered_dirs(self, created_before=None):
+        """(path, task_id) of the tracked task directories, registered before `created_before` if given"""
+        if created_before is None:
+            return self._connection().execute("SELECT path, task_id FROM task_dirs").fetchall()
+        return self._connection().execute(
+            "SELECT path, task_id FROM task_dirs WHERE created_at < ?", (created_before,)
+        ).fetchall()
+
+    def unregister_dir(self, path):
+        self._connection().execute("DELETE FROM task_dirs WHERE path = ?", (os.path.abspath(path),))
+
+    def owned_dirs(self):
+        """Task directories that hold a cached output or a link to one"""
+        rows = self._connection().execute(
+            "SELECT output_path FROM cache_entries UNION ALL SELECT output_path FROM cache_aliases"
+        ).fetchall()
+        return {os.path.abspath(os.path.dirname(row[0])) for row in rows}
+
+    def claim_run(self, name, interval):
+        """
+        True for exactly one caller (across processes) per `interval` seconds, used so only
+        one worker process runs periodic maintenance like the storage janitor.
+        """
+        now = int(time.time())
+        cursor = self._connection().execute(
+            "UPDATE cache_stats SET value = ? WHERE name = ? AND value <= ?", (now, name, now - int(interval))
+        )
+        return cursor.rowcount == 1
+
+    def stats(self):
+        conn = self._connection()
+        counters = dict(conn.execute("SELECT name, value FROM cache_stats").fetchall())
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries").fetchone()
+        lookups = counters.get("hits", 0) + counters.get("misses", 0)
+        return {
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "evictions": counters.get("evictions", 0),
+            "expired": counters.get("expired", 0),
+            "hit_ratio": round(counters.get("hits", 0) / lookups, 4) if lookups else 0.0,
+        }
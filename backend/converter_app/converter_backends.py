@@ -0,0 +1,136 @@
+import logging
+import os
+import random
+import shutil
+import subprocess
+import time
+
+
+class ConverterBackend:
+    """
+    Something that turns an old .ttmp/.ttmp2/.pmp into a Dawntrail-ready one.
+
+    convert() returns a subprocess.CompletedProcess (returncode, stdout, stderr) and raises
+    subprocess.TimeoutExpired when the conversion takes longer than `timeout` seconds, so
+    the task queue handles every backend the same way.
+    """
+
+    name = None
+    # Part of the conversion cache key, outputs of different versions are never mixed
+    version = None
+
+    def unavailable_reason(self):
+        """Return why the backend can't convert right now, or None if it can"""
+        return None
+
+    def warm(self):
+        """
+        Pay the one-time startup cost (runtime start, game index loading) up front.
+        Only called inside long-lived converter worker processes, see converter_pool.
+        """
+
+    def convert(self, input_path, output_path, work_dir, timeout):
+        raise NotImplementedError
+
+
+class ConsoleToolsBackend(ConverterBackend):
+    """TexTools' ConsoleTools.exe /upgrade, what production runs"""
+
+    name = "consoletools"
+
+    def __init__(self, tools_path, version):
+        self.tools_path = tools_path
+        self.version = version
+
+    def unavailable_reason(self):
+        if not os.path.exists(self.tools_path):
+            logging.error(f"ConsoleTools.exe not found at: {self.tools_path}")
+            return "Conversion tool not found"
+        return None
+
+    def convert(self, input_path, output_path, work_dir, timeout):
+        logging.info(f"Running conversion tool with arguments: /upgrade {input_path} {output_path}")
+        return subprocess.run(
+            [self.tools_path, '/upgrade', input_path, output_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            cwd=os.path.dirname(self.tools_path),  # CD into ConsoleTools.exe's folder
+            env={**os.environ, 'TEMP': work_dir, 'TMP': work_dir},  # per-slot scratch space
+            timeout=timeout
+        )
+
+
+class SimulatedBackend(ConverterBackend):
+    """
+    Stand-in for ConsoleTools so the queue, cache and I/O paths can be load-tested on
+    machines without TexTools (Linux CI, dev boxes).
+
+    Conversion time is base_seconds + seconds_per_mb * input size, multiplied by a lognormal
+    jitter factor, which gives the long right tail real conversions have. The output is
+    output_ratio times the input size (also jittered) and a failure_rate fraction of the
+    tasks fail the way a non-convertible mod does. startup_seconds (0 by default, so
+    benchmarks aren't skewed) adds a per-process startup cost that warm() pays once, to
+    exercise the converter pool.
+    """
+
+    name = "simulated"
+
+    def __init__(self, base_seconds=2.0, seconds_per_mb=0.15, jitter=0.35, output_ratio=1.05,
+                 failure_rate=0.02, startup_seconds=0.0, seed=None):
+        self.startup_seconds = startup_seconds
+        self.warmed = False
+        self.base_seconds = base_seconds
+        self.seconds_per_mb = seconds_per_mb
+        self.jitter = jitter
+        self.output_ratio = output_ratio
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.version = "simulated-1"
+
+    def warm(self):
+        time.sleep(self.startup_seconds)
+        self.warmed = True
+
+    def convert(self, input_path, output_path, work_dir, timeout):
+        input_size = os.path.getsize(input_path)
+        size_mb = input_size / (1024 * 1024)
+        duration = (self.base_seconds + self.seconds_per_mb * size_mb) * self.random.lognormvariate(0, self.jitter)
+        if not self.warmed:
+            duration += self.startup_seconds
+        failed = self.random.random() < self.failure_rate
+        output_size = int(input_size * self.output_ratio * self.random.lognormvariate(0, self.jitter / 4))
+        args = ['simulated', '/upgrade', input_path, output_path]
+
+        if duration > timeout:
+            time.sleep(timeout)
+            raise subprocess.TimeoutExpired(args, timeout)
+        time.sleep(duration)
+
+        if failed:
+            return subprocess.CompletedProcess(args, 1, "", "Simulated conversion failure")
+
+        # Real bytes of realistic size, so downloads and disk accounting behave as in production
+        with open(input_path, 'rb') as source, open(output_path, 'wb') as destination:
+            shutil.copyfileobj(source, destination, 1024 * 1024)
+            destination.truncate(output_size)
+        return subprocess.CompletedProcess(args, 0, f"Simulated conversion took {duration:.2f}s", "")
+
+
+def create_converter_backend(name, tools_path, version):
+    """Build the backend selected by CONVERTER_BACKEND ("consoletools" or "simulated")"""
+    if name == "simulated":
+        backend = SimulatedBackend(
+            base_seconds=float(os.environ.get('SIMULATED_CONVERTER_BASE_SECONDS', 2.0)),
+            seconds_per_mb=float(os.environ.get('SIMULATED_CONVERTER_SECONDS_PER_MB', 0.15)),
+            jitter=float(os.environ.get('SIMULATED_CONVERTER_JITTER', 0.35)),
+            output_ratio=float(os.environ.get('SIMULATED_CONVERTER_OUTPUT_RATIO', 1.05)),
+            failure_rate=float(os.environ.get('SIMULATED_CONVERTER_FAILURE_RATE', 0.02)),
+            startup_seconds=float(os.environ.get('SIMULATED_CONVERTER_STARTUP_SECONDS', 0)),
+            seed=os.environ.get('SIMULATED_CONVERTER_SEED'),
+        )
+        logging.warning("Using the simulated converter backend, outputs are not real conversions")
+        return backend
+    if name != "consoletools":
+        logging.warning(f"Unknown converter backend '{name}', falling back to ConsoleTools")
+    return ConsoleToolsBackend(tools_path, version)
@@ -0,0 +1,367 @@
+"""
+Pool of long-lived converter worker processes.
+
+A worker process builds a converter backend once, calls its warm() and then converts one
+file per request, so runtime startup and game index loading are paid per process instead
+of per task. The parent talks to each worker over stdin/stdout, one JSON object per line:
+
+    worker -> {"ready": true, "pid": 1234}                      once warm
+    parent -> {"op": "ping"}                                    health check
+    worker <- {"ok": true}
+    parent -> {"op": "convert", "input_path": ..., "output_path": ..., "work_dir": ..., "timeout": ...}
+    worker <- {"returncode": 0, "stdout": ..., "stderr": ...}
+              {"timeout": true} | {"error": "..."}
+
+The built-in worker (python -m converter_app.converter_pool) only makes a difference for
+the simulated backend. ConsoleTools.exe has no persistent mode, so a built-in worker would
+still start ConsoleTools for every task and gain nothing; with the ConsoleTools backend the
+pool is only used when CONVERTER_WORKER_COMMAND points at a native host that keeps the
+TexTools framework loaded and speaks this protocol.
+"""
+import argparse
+import atexit
+import json
+import logging
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+from converter_app.converter_backends import ConverterBackend, create_converter_backend
+
+# Extra time the worker gets to answer after the conversion timeout before it is killed
+RESPONSE_GRACE_SECONDS = 30
+
+
+class ConverterProcess:
+    """One worker process and the thread reading its responses"""
+
+    def __init__(self, command, cwd=None):
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+            cwd=cwd,
+        )
+        self.responses = queue.Queue()
+        self.tasks_done = 0
+        self.last_check = time.monotonic()
+        self.reader = threading.Thread(target=self._read, name=f"converter-{self.process.pid}-reader", daemon=True)
+        self.reader.start()
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def _read(self):
+        for line in self.process.stdout:
+            if line.strip():
+                self.responses.put(line)
+        self.responses.put(None)
+
+    def _receive(self, timeout):
+        try:
+            line = self.responses.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"Converter worker {self.pid} did not answer within {timeout}s")
+        if line is None:
+            raise ConnectionError(f"Converter worker {self.pid} exited with code {self.process.poll()}")
+        return json.loads(line)
+
+    def wait_ready(self, timeout):
+        return self._receive(timeout).get("ready") is True
+
+    def call(self, message, timeout):
+        self.process.stdin.write(json.dumps(message) + "\n")
+        self.process.stdin.flush()
+        return self._receive(timeout)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def stop(self, timeout=5):
+        """Ask the worker to exit (EOF on stdin), kill it if it doesn't"""
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.wait(5)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+
+
+class PooledConverterBackend(ConverterBackend):
+    """
+    Runs conversions on warm worker processes, falling back to `backend` (one-shot) when
+    no worker is ready or a worker dies mid-task.
+
+    A maintenance thread keeps `size` workers alive, pings idle ones every
+    health_check_interval seconds and replaces workers that fail the check. Workers are
+    recycled after max_tasks_per_process conversions so leaks in the converter can't pile up.
+    """
+
+    def __init__(self, backend, worker_command, size, max_tasks_per_process=200,
+                 health_check_interval=30.0, startup_timeout=120.0, cwd=None):
+        self.backend = backend
+        self.name = backend.name
+        self.version = backend.version
+        self.worker_command = worker_command
+        self.size = size
+        self.max_tasks_per_process = max_tasks_per_process
+        self.health_check_interval = health_check_interval
+        self.startup_timeout = startup_timeout
+        self.cwd = cwd
+        self.lock = threading.Lock()
+        self.idle = []
+        self.busy = set()
+        self.starting = 0
+        self.closed = False
+        self.wakeup = threading.Event()
+        self.stats = {
+            "pooled_conversions": 0, "fallback_conversions": 0, "spawned": 0,
+            "recycled": 0, "failed_health_checks": 0, "failed_starts": 0, "crashed": 0,
+        }
+        self.maintainer = threading.Thread(target=self._maintain, name="converter-pool", daemon=True)
+        self.maintainer.start()
+        atexit.register(self.close)
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def unavailable_reason(self):
+        return self.backend.unavailable_reason()
+
+    # ---- worker lifecycle ----
+
+    def _maintain(self):
+        while not self.closed:
+            self._check_idle()
+            self._spawn_missing()
+            self.wakeup.wait(self.health_check_interval)
+            self.wakeup.clear()
+
+    def _check_idle(self):
+        now = time.monotonic()
+        with self.lock:
+            due = [process for process in self.idle if now - process.last_check >= self.health_check_interval]
+            for process in due:
+                self.idle.remove(process)
+                self.busy.add(process)
+
+        for process in due:
+            try:
+                healthy = process.alive() and process.call({"op": "ping"}, 10).get("ok") is True
+            except (OSError, ValueError, TimeoutError, ConnectionError):
+                healthy = False
+            process.last_check = time.monotonic()
+            if healthy:
+                self._release(process, count_task=False)
+            else:
+                logging.warning(f"Converter worker {process.pid} failed its health check, replacing it")
+                self._count("failed_health_checks")
+                self._retire(process, kill=True)
+
+    def _spawn_missing(self):
+        with self.lock:
+            missing = self.size - len(self.idle) - len(self.busy) - self.starting
+            if self.closed or missing <= 0:
+                return
+            self.starting += missing
+
+        # Start them all first so they warm up in parallel
+        started = []
+        for _ in range(missing):
+            try:
+                started.append(ConverterProcess(self.worker_command, self.cwd))
+            except OSError as e:
+                logging.error(f"Could not start converter worker {self.worker_command}: {e}")
+                self._count("failed_starts")
+                with self.lock:
+                    self.starting -= 1
+
+        for process in started:
+            try:
+                ready = process.wait_ready(self.startup_timeout)
+            except (ValueError, TimeoutError, ConnectionError) as e:
+                logging.error(f"Converter worker {process.pid} failed to start: {e}")
+                ready = False
+            with self.lock:
+                self.starting -= 1
+                keep = ready and not self.closed
+                if keep:
+                    self.idle.append(process)
+                    self.stats["spawned"] += 1
+                elif not ready:
+                    # Not retried until the next maintenance round, a broken command doesn't spin
+                    self.stats["failed_starts"] += 1
+            if not keep:
+                process.kill()
+
+        if started:
+            logging.info(f"Converter pool ready: {len(self.idle)} idle, {len(self.busy)} busy")
+
+    def _acquire(self):
+        with self.lock:
+            while self.idle:
+                process = self.idle.pop()
+                if process.alive():
+                    self.busy.add(process)
+                    return process
+                self.stats["crashed"] += 1
+        self.wakeup.set()
+        return None
+
+    def _release(self, process, count_task=True):
+        if count_task:
+            process.tasks_done += 1
+        if count_task and process.tasks_done >= self.max_tasks_per_process:
+            logging.info(f"Recycling converter worker {process.pid} after {process.tasks_done} tasks")
+            self._count("recycled")
+            self._retire(process)
+            return
+        with self.lock:
+            self.busy.discard(process)
+            if not self.closed:
+                self.idle.append(process)
+                return
+        process.stop()
+
+    def _retire(self, process, kill=False):
+        with self.lock:
+            self.busy.discard(process)
+        if kill:
+            process.kill()
+        else:
+            process.stop()
+        self.wakeup.set()
+
+    # ---- conversions ----
+
+    def convert(self, input_path, output_path, work_dir, timeout):
+        process = self._acquire()
+        if process is None:
+            logging.info("No warm converter worker available, running a one-shot conversion")
+            self._count("fallback_conversions")
+            return self.backend.convert(input_path, output_path, work_dir, timeout)
+
+        args = [f"converter-worker-{process.pid}", '/upgrade', input_path, output_path]
+        logging.info(f"Converting on warm worker {process.pid}: {input_path} -> {output_path}")
+        try:
+            response = process.call(
+                {"op": "convert", "input_path": input_path, "output_path": output_path,
+                 "work_dir": work_dir, "timeout": timeout},
+                timeout + RESPONSE_GRACE_SECONDS,
+            )
+        except TimeoutError:
+            logging.error(f"Converter worker {process.pid} hung past the timeout, killing it")
+            self._retire(process, kill=True)
+            raise subprocess.TimeoutExpired(args, timeout)
+        except (OSError, ValueError, ConnectionError) as e:
+            logging.warning(f"Converter worker {process.pid} died during a conversion ({e}), retrying one-shot")
+            self._count("crashed")
+            self._retire(process, kill=True)
+            self._count("fallback_conversions")
+            return self.backend.convert(input_path, output_path, work_dir, timeout)
+
+        self._count("pooled_conversions")
+        self._release(process)
+        if response.get("timeout"):
+            raise subprocess.TimeoutExpired(args, timeout)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return subprocess.CompletedProcess(args, response["returncode"], response.get("stdout", ""), response.get("stderr", ""))
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            processes = self.idle + list(self.busy)
+            self.idle = []
+            self.busy.clear()
+        self.wakeup.set()
+        for process in processes:
+            process.stop()
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "size": self.size,
+                "idle": len(self.idle),
+                "busy": len(self.busy),
+                "starting": self.starting,
+                "max_tasks_per_process": self.max_tasks_per_process,
+                **self.stats,
+            }
+
+
+def default_worker_command(backend_name, tools_path, version):
+    """Command line of the built-in Python worker for the given backend"""
+    return [
+        sys.executable, "-m", "converter_app.converter_pool",
+        "--backend", backend_name, "--tools-path", tools_path, "--version", version,
+    ]
+
+
+def serve(backend, requests=sys.stdin, responses=sys.stdout):
+    """Worker side of the protocol: answer requests until stdin is closed"""
+    backend.warm()
+
+    def send(message):
+        responses.write(json.dumps(message) + "\n")
+        responses.flush()
+
+    send({"ready": True, "pid": os.getpid()})
+    for line in requests:
+        if not line.strip():
+            continue
+        try:
+            message = json.loads(line)
+        except ValueError:
+            send({"error": "Malformed request"})
+            continue
+
+        if message.get("op") == "ping":
+            send({"ok": True})
+        elif message.get("op") == "convert":
+            try:
+                result = backend.convert(message["input_path"], message["output_path"], message["work_dir"], message["timeout"])
+                send({"returncode": result.returncode, "stdout": result.stdout, "stderr": result.stderr})
+            except subprocess.TimeoutExpired:
+                send({"timeout": True})
+            except Exception as e:
+                logging.exception("Conversion failed in converter worker")
+                send({"error": str(e)})
+        else:
+            send({"error": f"Unknown op {message.get('op')!r}"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-lived converter worker, see converter_app.converter_pool")
+    parser.add_argument("--backend", default="consoletools")
+    parser.add_argument("--tools-path", default="")
+    parser.add_argument("--version", default="")
+    options = parser.parse_args()
+
+    # stdout carries the protocol, anything else printed goes to stderr
+    responses = sys.stdout
+    sys.stdout = sys.stderr
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(asctime)s - converter-worker - %(levelname)s - %(message)s")
+    try:
+        serve(create_converter_backend(options.backend, options.tools_path, options.version), sys.stdin, responses)
+    except BrokenPipeError:
+        # The server went away (shutdown, pool closed mid-start)
+        pass
+
+
+if __name__ == "__main__":
+    main()
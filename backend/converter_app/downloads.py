@@ -0,0 +1,183 @@
+import os
+import re
+import time
+from urllib.parse import quote
+
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+from converter_app.metrics import DOWNLOAD_BYTES, DOWNLOAD_THROUGHPUT, observe_transfer
+
+# "" serves files from Python, "nginx" hands them to nginx with X-Accel-Redirect,
+# "sendfile" uses X-Sendfile (Apache mod_xsendfile, lighttpd, Caddy).
+#
+# nginx needs an internal location matching DOWNLOAD_OFFLOAD_PREFIX, for example:
+#     location /protected-converted/ {
+#         internal;
+#         alias /path/to/backend/converted/;
+#     }
+DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD', '')
+DOWNLOAD_OFFLOAD_PREFIX = os.environ.get('DOWNLOAD_OFFLOAD_PREFIX', '/protected-converted/')
+# Read size when streaming a byte range from Python
+DOWNLOAD_BLOCK_SIZE = int(os.environ.get('DOWNLOAD_BLOCK_SIZE', 1024 * 1024))
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range Range header into an inclusive (start, end).
+
+    Returns None when the header should be ignored (missing, malformed or multi-range,
+    which we answer with the full file) and raises ValueError when it can't be satisfied.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if first == '' and last == '':
+        return None
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+class RangeFileWrapper:
+    """Iterate over `length` bytes of a file starting at `start`"""
+
+    def __init__(self, file, start, length, block_size=DOWNLOAD_BLOCK_SIZE):
+        self.file = file
+        self.remaining = length
+        self.block_size = block_size
+        self.file.seek(start)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.remaining <= 0:
+            raise StopIteration
+        data = self.file.read(min(self.block_size, self.remaining))
+        if not data:
+            raise StopIteration
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def _metered(response, length):
+    """
+    Record the transfer when the server closes the response, i.e. after the last byte went
+    out (Django routes wsgi.file_wrapper's close() to response.close() too)
+    """
+    started = time.monotonic()
+    close = response.close
+
+    def metered_close():
+        close()
+        observe_transfer(DOWNLOAD_THROUGHPUT, DOWNLOAD_BYTES, length, time.monotonic() - started)
+
+    response.close = metered_close
+    return response
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    # Weak comparison is fine for If-None-Match
+    candidates = [tag.strip().removeprefix('W/') for tag in header.split(',')]
+    return etag.removeprefix('W/') in candidates
+
+
+def _if_range_allows(request, etag, last_modified):
+    """Only honour Range when If-Range (if any) still describes the current file"""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # Strong comparison is required here, a weak ETag never matches
+        return not etag.startswith('W/') and if_range.strip() == etag
+    if_range_date = parse_http_date_safe(if_range)
+    return if_range_date is not None and int(last_modified) <= if_range_date
+
+
+def serve_file(request, file_path, filename, base_dir, content_hash=None):
+    """
+    Build the download response for file_path.
+
+    content_hash, when known, becomes a strong ETag; otherwise a weak one is derived from
+    size and mtime. Supports If-None-Match / If-Modified-Since (304), single byte ranges
+    (206) with If-Range, and offloading the transfer to the reverse proxy.
+    """
+    stat = os.stat(file_path)
+    size = stat.st_size
+    etag = f'"{content_hash}"' if content_hash else f'W/"{size:x}-{int(stat.st_mtime):x}"'
+    last_modified = http_date(stat.st_mtime)
+
+    def with_headers(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        response['Accept-Ranges'] = 'bytes'
+        response['Cache-Control'] = 'private, max-age=0, must-revalidate'
+        return response
+
+    if_none_match = request.headers.get('If-None-Match')
+    if _etag_matches(if_none_match, etag):
+        return with_headers(HttpResponseNotModified())
+    if not if_none_match:
+        since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        if since is not None and int(stat.st_mtime) <= since:
+            return with_headers(HttpResponseNotModified())
+
+    disposition = content_disposition_header(True, filename)
+
+    if DOWNLOAD_OFFLOAD in ('nginx', 'sendfile'):
+        # The proxy does the transfer (and its own Range handling) without a Python worker
+        response = HttpResponse(content_type='application/octet-stream')
+        if DOWNLOAD_OFFLOAD == 'nginx':
+            # nginx decodes the URI, quoting keeps spaces, #, %, ? and non-Latin-1 names intact
+            relative = os.path.relpath(file_path, base_dir).replace(os.sep, '/')
+            response['X-Accel-Redirect'] = DOWNLOAD_OFFLOAD_PREFIX.rstrip('/') + '/' + quote(relative)
+        else:
+            response['X-Sendfile'] = os.path.abspath(file_path)
+        response['Content-Disposition'] = disposition
+        return with_headers(response)
+
+    byte_range = None
+    if _if_range_allows(request, etag, stat.st_mtime):
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return with_headers(response)
+
+    if byte_range is None or byte_range == (0, size - 1):
+        # Whole file: FileResponse lets the server use wsgi.file_wrapper/sendfile
+        return _metered(with_headers(FileResponse(open(file_path, 'rb'), as_attachment=True, filename=filename)), size)
+
+    start, end = byte_range
+    length = end - start + 1
+    response = StreamingHttpResponse(
+        RangeFileWrapper(open(file_path, 'rb'), start, length),
+        status=206,
+        content_type='application/octet-stream',
+    )
+    response['Content-Length'] = str(length)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Disposition'] = disposition
+    return _metered(with_headers(response), length)
@@ -0,0 +1,193 @@
+"""
+Queue wait and conversion time predictions.
+
+ConversionTimeModel learns how long a conversion takes from the size of the mod, with one
+online linear fit (seconds = base + per_mb * size) per file extension. Every completed task
+updates it in O(1), older observations fade out so the fit follows converter and hardware
+changes. forecast() plays the queue forward on the conversion slots with those durations.
+"""
+import heapq
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+MB = 1024 * 1024
+
+
+def _kind(filename):
+    """.ttmp is converted to .ttmp2 and takes as long, so they share a fit"""
+    extension = os.path.splitext(filename or "")[1].lower()
+    return ".ttmp2" if extension == ".ttmp" else extension
+
+
+def _as_datetime(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+class _Fit:
+    """Exponentially weighted least squares of seconds over size_mb"""
+
+    __slots__ = ("samples", "weight", "sum_x", "sum_y", "sum_xx", "sum_xy")
+
+    def __init__(self):
+        self.samples = 0
+        self.weight = self.sum_x = self.sum_y = self.sum_xx = self.sum_xy = 0.0
+
+    def add(self, x, y, weight, decay):
+        self.samples += 1
+        self.weight = self.weight * decay + weight
+        self.sum_x = self.sum_x * decay + weight * x
+        self.sum_y = self.sum_y * decay + weight * y
+        self.sum_xx = self.sum_xx * decay + weight * x * x
+        self.sum_xy = self.sum_xy * decay + weight * x * y
+
+    def predict(self, x):
+        mean_x = self.sum_x / self.weight
+        mean_y = self.sum_y / self.weight
+        variance = self.sum_xx / self.weight - mean_x * mean_x
+        # With every sample the same size there is no slope to learn, use the average
+        per_mb = max(0.0, (self.sum_xy / self.weight - mean_x * mean_y) / variance) if variance > 1e-6 else 0.0
+        base = max(0.0, mean_y - per_mb * mean_x)
+        return base + per_mb * x
+
+
+class ConversionTimeModel:
+    """
+    Predicts the conversion time of a task from its extension and size (the uncompressed
+    mod size from the pre-flight check, else the upload size).
+
+    Until an extension has min_samples observations the fit over every extension is used,
+    then the fits seeded from srv_conversions (see load_history), and default_seconds
+    before anything was observed at all.
+    """
+
+    def __init__(self, default_seconds=60.0, decay=0.98, min_samples=3, max_seconds=3600.0):
+        self.default_seconds = default_seconds
+        self.decay = decay
+        self.min_samples = min_samples
+        self.max_seconds = max_seconds
+        self.lock = threading.Lock()
+        self.fits = {}
+        # Seeded from srv_conversions, by output size rather than mod size, so kept apart
+        self.seed_fits = {}
+        self.observations = 0
+
+    @staticmethod
+    def task_size(task):
+        return task.mod_size or task.input_size or 0
+
+    def observe(self, filename, size, seconds, weight=1.0, fits=None):
+        if seconds is None or seconds < 0:
+            return
+        seconds = min(seconds, self.max_seconds)
+        with self.lock:
+            for kind in (_kind(filename), "*"):
+                (self.fits if fits is None else fits).setdefault(kind, _Fit()).add(size / MB, seconds, weight, self.decay)
+            self.observations += 1
+
+    def observe_task(self, task):
+        """Learn from a completed task"""
+        if task.status == "completed" and task.started_at and task.completed_at:
+            self.observe(task.original_filename, self.task_size(task), (task.completed_at - task.started_at).total_seconds())
+
+    def predict(self, filename, size, file_size=None):
+        """size as in task_size(); file_size, the size of the uploaded file, for the seeded fits"""
+        with self.lock:
+            for fits, x in ((self.fits, size), (self.seed_fits, file_size if file_size is not None else size)):
+                for kind in (_kind(filename), "*"):
+                    fit = fits.get(kind)
+                    if fit is not None and fit.samples >= self.min_samples:
+                        return min(fit.predict(x / MB), self.max_seconds)
+        return self.default_seconds
+
+    def predict_task(self, task):
+        return self.predict(task.original_filename, self.task_size(task), task.input_size or 0)
+
+    def load_history(self, get_connection, limit):
+        """
+        Seed the model with the newest completed srv_conversions rows, once at startup.
+
+        Those rows only have the output size (close to the upload's size, not the mod size
+        live tasks are fitted on) and created/completed times, so their duration includes
+        the queue wait. They go into separate fits, only used until live ones have enough
+        samples.
+        """
+        try:
+            conn = get_connection()
+            if not conn:
+                return 0
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        SELECT cnv_file, cnv_filesize, EXTRACT(EPOCH FROM cnv_completed_at - cnv_created_at)
+                        FROM srv_conversions
+                        WHERE cnv_status = 'completed' AND cnv_completed_at IS NOT NULL AND cnv_filesize IS NOT NULL
+                        ORDER BY cnv_completed_at DESC
+                        LIMIT %s
+                        """,
+                        (limit,),
+                    )
+                    rows = cur.fetchall()
+            finally:
+                conn.close()
+        except Exception as e:
+            logging.error(f"Could not load conversion history for the ETA model: {e}")
+            return 0
+
+        # Oldest first, so the newest rows carry the most weight after the decay
+        for filename, size, seconds in reversed(rows):
+            self.observe(filename, size or 0, float(seconds) if seconds is not None else None, fits=self.seed_fits)
+        logging.info(f"ETA model seeded with {len(rows)} past conversions")
+        return len(rows)
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "observations": self.observations,
+                "kinds": {
+                    kind: {"samples": fit.samples, "seconds_for_100mb": round(fit.predict(100), 1)}
+                    for kind, fit in self.fits.items()
+                },
+                "seeded_kinds": {
+                    kind: {"samples": fit.samples, "seconds_for_100mb": round(fit.predict(100), 1)}
+                    for kind, fit in self.seed_fits.items()
+                },
+            }
+
+
+def estimate_payload(start, finish):
+    return {
+        "estimated_start_at": start.isoformat(timespec="seconds"),
+        "estimated_completion_at": finish.isoformat(timespec="seconds"),
+    }
+
+
+def forecast(model, processing, queued, slots, now=None):
+    """
+    Predicted start and finish of every pending task: {task_id: (start, finish)} datetimes.
+
+    The queued tasks (in scheduling order) are handed to whichever of the `slots`
+    conversion slots frees up first. Running tasks keep their slot until started_at plus
+    their predicted duration; one that runs over is expected to end any moment now.
+    """
+    now = now or datetime.now()
+    estimates = {}
+    free_at = []
+    for task in processing:
+        started_at = _as_datetime(task.started_at) or now
+        finish = max(started_at + timedelta(seconds=model.predict_task(task)), now)
+        estimates[task.task_id] = (started_at, finish)
+        free_at.append(finish)
+
+    # Slots over the limit (tasks recovered onto a busy queue) just wait for their turn
+    free_at.sort()
+    free_at = free_at[:slots] + [now] * max(0, slots - len(free_at))
+    heapq.heapify(free_at)
+    for task in queued:
+        start = heapq.heappop(free_at)
+        finish = start + timedelta(seconds=model.predict_task(task))
+        estimates[task.task_id] = (start, finish)
+        heapq.heappush(free_at, finish)
+    return estimates
@@ -0,0 +1,163 @@
+import logging
+import os
+import shutil
+import threading
+import time
+
+from converter_app.storage import iter_task_dirs, newest_mtime
+
+
+class StorageJanitor:
+    """
+    Keeps BASE_DIR bounded without anyone cleaning it up by hand.
+
+    Every `interval` seconds one worker process (claimed through the conversion cache
+    index, so several processes don't sweep at once):
+
+    - enforces the size quota, evicting the least recently used outputs (ConversionCache.evict)
+    - expires outputs older than max_age or not downloaded for max_idle seconds
+    - deletes task directories no cache entry and no task in the task store owns (failed
+      conversions, duplicates of a cached output) once registered for orphan_age seconds
+
+    Output sizes and task directories are recorded in the cache index, so a sweep is
+    queries over the index rather than a walk of the whole tree. The walk is only done by
+    reconcile_orphans, every reconcile_interval seconds or by hand (reconcile_storage), for
+    directories that were never registered (older versions, crashes mid-upload); outputs it
+    finds are adopted into the cache index rather than deleted.
+    """
+
+    def __init__(self, cache, base_dir, task_store, interval=600, max_age=0, max_idle=0, orphan_age=2 * 86400,
+                 reconcile_interval=0):
+        self.cache = cache
+        self.base_dir = os.path.abspath(base_dir)
+        self.task_store = task_store
+        self.interval = interval
+        self.max_age = max_age
+        self.max_idle = max_idle
+        self.orphan_age = orphan_age
+        self.reconcile_interval = reconcile_interval
+        self.thread = None
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            "runs": 0, "expired_entries": 0, "expired_bytes": 0, "orphans_removed": 0, "reconciled_removed": 0, "reconciled_adopted": 0,
+            "last_run": None, "last_reconcile": None, "last_error": None,
+        }
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name="storage-janitor", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                if self.cache.claim_run("janitor_last_run", self.interval):
+                    self.run_once()
+                if self.reconcile_interval and self.cache.claim_run("janitor_last_reconcile", self.reconcile_interval):
+                    self.reconcile_orphans(time.time())
+            except Exception as e:
+                logging.error(f"Storage janitor failed: {e}", exc_info=True)
+                with self.stats_lock:
+                    self.stats["last_error"] = str(e)
+            # Wake up more often than the interval, another process may have run the last sweep
+            time.sleep(max(1, self.interval / 4))
+
+    def run_once(self):
+        started = time.time()
+        self.cache.evict()
+
+        expired, freed = self.cache.expire(
+            created_before=started - self.max_age if self.max_age else None,
+            accessed_before=started - self.max_idle if self.max_idle else None,
+        )
+        orphans = self.remove_orphans(started)
+
+        with self.stats_lock:
+            self.stats["runs"] += 1
+            self.stats["expired_entries"] += expired
+            self.stats["expired_bytes"] += freed
+            self.stats["orphans_removed"] += orphans
+            self.stats["last_run"] = started
+            self.stats["last_error"] = None
+        logging.info(
+            f"Storage janitor: {expired} outputs expired ({freed} bytes), {orphans} orphaned task directories removed "
+            f"in {time.time() - started:.1f}s"
+        )
+
+    def remove_orphans(self, now):
+        """
+        Delete registered task directories whose task left the task store and that hold no
+        cached output. Directories the cache owns are unregistered, they go with their entry.
+        """
+        if not self.orphan_age:
+            return 0
+        owned = self.cache.owned_dirs()
+        removed = 0
+        for path, task_id in self.cache.registered_dirs(created_before=now - self.orphan_age):
+            if path in owned:
+                self.cache.unregister_dir(path)
+                continue
+            if self.task_store.get(task_id) is not None:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            self.cache.unregister_dir(path)
+            removed += 1
+        return removed
+
+    def _active_dirs(self):
+        snapshot = self.task_store.snapshot()
+        active = set()
+        for task_id in snapshot["processing"] + snapshot["queued"]:
+            task = self.task_store.get(task_id)
+            if task and task.file_path:
+                active.add(os.path.abspath(os.path.dirname(task.file_path)))
+        return active
+
+    def reconcile_orphans(self, now):
+        """
+        Walk all of BASE_DIR for task directories that aren't registered, owned by the cache
+        or in use. The ones holding a dt_* output (converted before the registry existed) are
+        adopted into the cache index with their mtime, so max_age and max_idle decide when
+        they go; the ones without (upload leftovers) are deleted once nothing in them changed
+        for orphan_age seconds. Expensive on the share, so rare.
+        """
+        started = time.time()
+        # Read what is in use before listing, so a task queued during the walk is too new to delete
+        keep = self.cache.owned_dirs() | self._active_dirs() | {path for path, _ in self.cache.registered_dirs()}
+        removed = adopted = 0
+        for _, path in iter_task_dirs(self.base_dir):
+            path = os.path.abspath(path)
+            if path in keep:
+                continue
+            try:
+                modified = newest_mtime(path)
+                with os.scandir(path) as entries:
+                    outputs = sorted(entry.path for entry in entries if entry.name.startswith("dt_") and entry.is_file())
+            except OSError:
+                continue
+            if outputs:
+                adopted += self.cache.adopt(outputs[0], modified)
+            elif self.orphan_age and now - modified >= self.orphan_age:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+
+        with self.stats_lock:
+            self.stats["reconciled_removed"] += removed
+            self.stats["reconciled_adopted"] += adopted
+            self.stats["last_reconcile"] = started
+        logging.info(
+            f"Storage janitor reconcile: {adopted} untracked outputs adopted, {removed} upload leftovers removed "
+            f"in {time.time() - started:.1f}s"
+        )
+        return removed, adopted
+
+    def metrics(self):
+        with self.stats_lock:
+            return {
+                "interval": self.interval,
+                "max_age": self.max_age,
+                "max_idle": self.max_idle,
+                "orphan_age": self.orphan_age,
+                "reconcile_interval": self.reconcile_interval,
+                **self.stats,
+            }
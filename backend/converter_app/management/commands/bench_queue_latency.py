@@ -0,0 +1,77 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand
+
+from converter_app.management.stats import latency_summary
+from converter_app.task_queue import TaskQueue
+from converter_app.task_store import ConversionTask, create_task_store
+
+
+class Command(BaseCommand):
+    help = "Measure TaskQueue enqueue-to-start latency with a no-op converter, prints JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tasks", type=int, default=500)
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument(
+            "--mode", choices=["idle", "burst"], default="idle",
+            help="idle: enqueue one task at a time onto idle workers; burst: enqueue everything at once",
+        )
+        parser.add_argument("--store", choices=["memory", "sqlite"], default="memory")
+        parser.add_argument("--work-ms", type=float, default=0, help="simulated conversion time per task")
+
+    def handle(self, *args, **options):
+        started = {}
+        finished = threading.Semaphore(0)
+        work_seconds = options["work_ms"] / 1000
+
+        class BenchQueue(TaskQueue):
+            def _process_task(self, task, work_dir):
+                started[task.task_id] = time.perf_counter()
+                if work_seconds:
+                    time.sleep(work_seconds)
+                task.status = "completed"
+                task.completed_at = datetime.now()
+                finished.release()
+
+        enqueued = {}
+        # The SQLite file (and its -wal/-shm) lives and dies with this directory
+        with tempfile.TemporaryDirectory(prefix="bench-queue-") as store_dir:
+            store_path = os.path.join(store_dir, "tasks.sqlite3") if options["store"] == "sqlite" else None
+            queue = BenchQueue(create_task_store(options["store"], store_path), options["workers"])
+            # Give the workers a moment to reach their idle wait
+            time.sleep(0.2)
+
+            # The per-task INFO lines would dominate the measurement
+            logging.disable(logging.INFO)
+            try:
+                for _ in range(options["tasks"]):
+                    task = ConversionTask(str(uuid4()), None, None, "bench.pmp", "127.0.0.1")
+                    enqueued[task.task_id] = time.perf_counter()
+                    queue.add_task(task)
+                    if options["mode"] == "idle":
+                        finished.acquire()
+                if options["mode"] == "burst":
+                    for _ in range(options["tasks"]):
+                        finished.acquire()
+            finally:
+                logging.disable(logging.NOTSET)
+
+        latencies = [(started[task_id] - enqueued_at) * 1000 for task_id, enqueued_at in enqueued.items()]
+        result = {
+            "benchmark": "enqueue_to_start",
+            "mode": options["mode"],
+            "store": options["store"],
+            "workers": options["workers"],
+            "tasks": options["tasks"],
+            "work_ms": options["work_ms"],
+            **latency_summary(latencies),
+        }
+        self.stdout.write(json.dumps(result, indent=2))
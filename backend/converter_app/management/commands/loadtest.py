@@ -0,0 +1,309 @@
+import http.client
+import json
+import os
+import random
+import threading
+import time
+import zipfile
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand, CommandError
+
+from converter_app.management.stats import latency_summary
+
+SIZE_UNITS = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+FILL_BLOCK = os.urandom(1024 * 1024)
+MULTIPART_BOUNDARY = "----xivdtloadtest"
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    for unit, factor in SIZE_UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+# Fixed member timestamps, so the same seed always gives the same bytes (cache hits)
+MOD_DATE_TIME = (2024, 1, 1, 0, 0, 0)
+
+
+def synthetic_file(size, seed):
+    """Yield `size` bytes whose content (and so SHA-256) is unique per seed"""
+    header = f"xiv-dt-loadtest {seed}\n".encode()[:size]
+    yield header
+    remaining = size - len(header)
+    while remaining > 0:
+        block = FILL_BLOCK[:remaining]
+        remaining -= len(block)
+        yield block
+
+
+class _ZipSink:
+    """Write-only, unseekable file for zipfile that hands the written bytes back in order"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        parts, self.parts = self.parts, []
+        return parts
+
+
+def _mod_chunks(payload_size, seed):
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as archive:
+        archive.writestr(
+            zipfile.ZipInfo("meta.json", MOD_DATE_TIME),
+            json.dumps({"FileVersion": 3, "Name": f"loadtest {seed}", "Author": "xiv-dt-loadtest"}),
+        )
+        archive.writestr(
+            zipfile.ZipInfo("default_mod.json", MOD_DATE_TIME),
+            json.dumps({"Name": "", "Files": {"chara/loadtest.bin": "files/loadtest.bin"}}),
+        )
+        yield from sink.drain()
+        with archive.open(zipfile.ZipInfo("files/loadtest.bin", MOD_DATE_TIME), "w") as payload:
+            for block in synthetic_file(payload_size, seed):
+                payload.write(block)
+                yield from sink.drain()
+    yield from sink.drain()
+
+
+def synthetic_mod(size, seed):
+    """
+    A minimal Penumbra mod pack (meta.json, default_mod.json and one stored payload file)
+    of about `size` bytes, unique per seed, that passes the pre-flight check.
+    Returns (length, chunks); the archive is streamed, never held in memory.
+    """
+    overhead = sum(len(chunk) for chunk in _mod_chunks(0, seed))
+    payload_size = max(0, size - overhead)
+    return overhead + payload_size, _mod_chunks(payload_size, seed)
+
+
+class Recorder:
+    """Thread-safe latency/error bookkeeping per endpoint"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.bytes = {}
+        self.transfer_seconds = {}
+
+    def add(self, endpoint, seconds, ok=True, transferred=0):
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(seconds * 1000)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            if transferred:
+                self.bytes[endpoint] = self.bytes.get(endpoint, 0) + transferred
+                self.transfer_seconds[endpoint] = self.transfer_seconds.get(endpoint, 0) + seconds
+
+    def summary(self, elapsed):
+        result = {}
+        with self.lock:
+            for endpoint, samples in sorted(self.latencies.items()):
+                entry = {
+                    "requests": len(samples),
+                    "errors": self.errors.get(endpoint, 0),
+                    "requests_per_second": round(len(samples) / elapsed, 3) if elapsed else None,
+                    **latency_summary(samples),
+                }
+                if self.bytes.get(endpoint):
+                    entry["bytes"] = self.bytes[endpoint]
+                    entry["mb_per_second"] = round(
+                        self.bytes[endpoint] / (1024 * 1024) / self.transfer_seconds[endpoint], 3
+                    )
+                result[endpoint] = entry
+        return result
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive /convert, /task/<id>/, /queue-status/ and /download/ with concurrent synthetic "
+        "clients and print throughput and latency percentiles as JSON. Run the server with "
+        "CONVERTER_BACKEND=simulated to benchmark without ConsoleTools."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--clients", type=int, default=8, help="concurrent upload clients")
+        parser.add_argument("--uploads", type=int, default=40, help="total uploads across all clients")
+        parser.add_argument("--sizes", default="1MB,10MB,50MB,500MB", help="comma separated upload sizes")
+        parser.add_argument("--weights", default="50,30,15,5", help="relative frequency of each size")
+        parser.add_argument("--duplicate-ratio", type=float, default=0.0,
+                            help="fraction of uploads re-sending an earlier file (exercises the cache)")
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+        parser.add_argument("--queue-pollers", type=int, default=2,
+                            help="extra clients polling /queue-status/ for the whole run")
+        parser.add_argument("--skip-download", action="store_true")
+        parser.add_argument("--timeout", type=float, default=3600, help="per-task completion timeout")
+        parser.add_argument("--seed", type=int, default=None)
+        parser.add_argument("--output", help="also write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        base = urlsplit(options["base_url"])
+        if base.scheme not in ("http", "https"):
+            raise CommandError("--base-url must be http:// or https://")
+        sizes = [parse_size(size) for size in options["sizes"].split(",")]
+        weights = [float(weight) for weight in options["weights"].split(",")]
+        if len(sizes) != len(weights):
+            raise CommandError("--sizes and --weights need the same number of entries")
+
+        self.base = base
+        self.options = options
+        self.recorder = Recorder()
+        self.rng = random.Random(options["seed"])
+        self.rng_lock = threading.Lock()
+        self.sent_files = []
+        self.end_to_end = []
+        self.outcomes = {}
+        self.pending_uploads = list(range(options["uploads"]))
+        self.work_lock = threading.Lock()
+        self.done = threading.Event()
+
+        started = time.perf_counter()
+        pollers = [threading.Thread(target=self._queue_poller, daemon=True) for _ in range(options["queue_pollers"])]
+        clients = [threading.Thread(target=self._client, args=(sizes, weights)) for _ in range(options["clients"])]
+        for thread in pollers + clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        self.done.set()
+        for thread in pollers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        report = {
+            "base_url": options["base_url"],
+            "clients": options["clients"],
+            "uploads": options["uploads"],
+            "sizes": options["sizes"],
+            "weights": options["weights"],
+            "duplicate_ratio": options["duplicate_ratio"],
+            "elapsed_seconds": round(elapsed, 3),
+            "conversions_per_second": round(self.outcomes.get("completed", 0) / elapsed, 4) if elapsed else None,
+            "outcomes": self.outcomes,
+            "end_to_end": latency_summary(self.end_to_end),
+            "endpoints": self.recorder.summary(elapsed),
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as report_file:
+                report_file.write(output)
+        self.stdout.write(output)
+
+    def _connection(self):
+        connection_class = http.client.HTTPSConnection if self.base.scheme == "https" else http.client.HTTPConnection
+        return connection_class(self.base.hostname, self.base.port, timeout=600)
+
+    def _request(self, endpoint, method, path, body=None, headers=None, read_body=True, sent=0):
+        """Send one request, returns (status, body, seconds); status is None on connection errors"""
+        connection = self._connection()
+        started = time.perf_counter()
+        try:
+            connection.request(method, self.base.path.rstrip("/") + path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            transferred = 0
+            data = b""
+            if read_body:
+                data = response.read()
+                transferred = len(data)
+            else:
+                while True:
+                    chunk = response.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    transferred += len(chunk)
+            seconds = time.perf_counter() - started
+            ok = 200 <= response.status < 400
+            # Throughput is tracked for uploads (bytes sent) and downloads (bytes received)
+            self.recorder.add(endpoint, seconds, ok, sent or (transferred if endpoint == "download" else 0))
+            return response.status, data, seconds
+        except (OSError, http.client.HTTPException):
+            self.recorder.add(endpoint, time.perf_counter() - started, ok=False)
+            return None, b"", time.perf_counter() - started
+        finally:
+            connection.close()
+
+    def _queue_poller(self):
+        while not self.done.wait(self.options["poll_interval"]):
+            self._request("queue-status", "GET", "/queue-status/")
+
+    def _pick_upload(self, sizes, weights):
+        with self.rng_lock:
+            if self.sent_files and self.rng.random() < self.options["duplicate_ratio"]:
+                return self.rng.choice(self.sent_files)
+            upload = (self.rng.choices(sizes, weights)[0], uuid4().hex)
+            self.sent_files.append(upload)
+            return upload
+
+    def _client(self, sizes, weights):
+        while True:
+            with self.work_lock:
+                if not self.pending_uploads:
+                    return
+                self.pending_uploads.pop()
+            size, seed = self._pick_upload(sizes, weights)
+            outcome = self._run_upload(size, seed)
+            with self.work_lock:
+                self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def _run_upload(self, size, seed):
+        started = time.perf_counter()
+        filename = f"loadtest_{seed}.pmp"
+        head = (
+            f"--{MULTIPART_BOUNDARY}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        tail = f"\r\n--{MULTIPART_BOUNDARY}--\r\n".encode()
+        length, chunks = synthetic_mod(size, seed)
+
+        def body():
+            yield head
+            yield from chunks
+            yield tail
+
+        status_code, data, _ = self._request(
+            "convert", "POST", "/convert", body(),
+            {
+                "Content-Type": f"multipart/form-data; boundary={MULTIPART_BOUNDARY}",
+                "Content-Length": str(len(head) + length + len(tail)),
+            },
+            sent=length,
+        )
+        if status_code != 200:
+            return "upload_failed"
+
+        task = json.loads(data)
+        deadline = time.monotonic() + self.options["timeout"]
+        while task.get("status") not in ("completed", "failed"):
+            if time.monotonic() > deadline:
+                return "timed_out"
+            time.sleep(self.options["poll_interval"])
+            status_code, data, _ = self._request("task", "GET", f"/task/{task['task_id']}/")
+            if status_code == 200:
+                task = json.loads(data)
+
+        if task["status"] == "failed":
+            return "failed"
+
+        if not self.options["skip_download"] and task.get("download_url"):
+            path = urlsplit(task["download_url"]).path
+            if not path.endswith("/"):
+                path += "/"
+            status_code, _, _ = self._request("download", "GET", path, read_body=False)
+            if status_code != 200:
+                return "download_failed"
+
+        self.end_to_end.append((time.perf_counter() - started) * 1000)
+        return "completed"
@@ -0,0 +1,92 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from converter_app.conversion_cache import ConversionCache
+from converter_app.storage import iter_task_dirs, newest_mtime, task_dir
+from converter_app.task_store import create_task_store
+from converter_app.uploads import CHUNKED_UPLOAD_TTL
+
+
+class Command(BaseCommand):
+    help = (
+        "Move task directories from the flat converted/<hash> layout to converted/ab/cd/<hash>. "
+        "Safe to run (and re-run) while the server is up: old download links resolve in both layouts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-dir", default=os.path.join(settings.BASE_DIR, "converted"))
+        parser.add_argument(
+            "--cache", default=os.environ.get('CONVERSION_CACHE_PATH', os.path.join(settings.BASE_DIR, "conversion_cache.sqlite3")),
+            help="conversion cache index whose output paths are updated",
+        )
+        parser.add_argument(
+            "--task-store", default=os.environ.get('TASK_STORE_PATH', os.path.join(settings.BASE_DIR, "tasks.sqlite3")),
+            help="SQLite task store, directories of queued/processing tasks are left alone",
+        )
+        parser.add_argument(
+            "--min-idle", type=float, default=CHUNKED_UPLOAD_TTL,
+            help="skip directories modified in the last N seconds (uploads still in progress)",
+        )
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument("--pause", type=float, default=1.0, help="seconds to sleep between batches, spares the share")
+        parser.add_argument("--limit", type=int, default=0, help="stop after moving N directories (0: all)")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def _active_dirs(self, store_path):
+        if not os.path.exists(store_path):
+            return set()
+        store = create_task_store("sqlite", store_path)
+        snapshot = store.snapshot()
+        active = set()
+        for task_id in snapshot["processing"] + snapshot["queued"]:
+            task = store.get(task_id)
+            if task and task.file_path:
+                active.add(os.path.abspath(os.path.dirname(task.file_path)))
+        return active
+
+    def handle(self, *args, **options):
+        base_dir = options["base_dir"]
+        cache = ConversionCache(options["cache"], base_dir, 0) if os.path.exists(options["cache"]) else None
+        active = self._active_dirs(options["task_store"])
+        now = time.time()
+        counts = {"moved": 0, "skipped_active": 0, "skipped_recent": 0, "conflicts": 0, "cache_entries": 0}
+
+        # Listed up front, the loop below adds shard directories to base_dir
+        legacy_dirs = list(iter_task_dirs(base_dir, sharded=False))
+        self.stdout.write(f"{len(legacy_dirs)} task directories in the flat layout under {base_dir}")
+
+        for name, old_dir in legacy_dirs:
+            if options["limit"] and counts["moved"] >= options["limit"]:
+                break
+            if os.path.abspath(old_dir) in active:
+                counts["skipped_active"] += 1
+                continue
+            try:
+                if now - newest_mtime(old_dir) < options["min_idle"]:
+                    counts["skipped_recent"] += 1
+                    continue
+            except OSError:
+                continue
+
+            new_dir = task_dir(base_dir, name)
+            if os.path.exists(new_dir):
+                self.stderr.write(f"{new_dir} already exists, leaving {old_dir} in place")
+                counts["conflicts"] += 1
+                continue
+
+            if not options["dry_run"]:
+                os.makedirs(os.path.dirname(new_dir), exist_ok=True)
+                os.rename(old_dir, new_dir)
+                if cache:
+                    counts["cache_entries"] += cache.relocate(old_dir, new_dir)
+            counts["moved"] += 1
+
+            if counts["moved"] % options["batch_size"] == 0:
+                self.stdout.write(f"{counts['moved']} moved")
+                time.sleep(options["pause"])
+
+        prefix = "[dry run] " if options["dry_run"] else ""
+        self.stdout.write(prefix + ", ".join(f"{key}: {value}" for key, value in counts.items()))
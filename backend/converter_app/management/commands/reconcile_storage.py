@@ -0,0 +1,41 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from converter_app.conversion_cache import ConversionCache
+from converter_app.janitor import StorageJanitor
+from converter_app.task_store import create_task_store
+
+
+class Command(BaseCommand):
+    help = (
+        "Walk all of BASE_DIR for task directories that neither the conversion cache index nor a "
+        "queued/processing task knows about: outputs are adopted into the index (and expire with "
+        "STORAGE_MAX_AGE/STORAGE_MAX_IDLE), upload leftovers are deleted. The storage janitor does this "
+        "every STORAGE_RECONCILE_INTERVAL; run it by hand after a crash or an upgrade."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-dir", default=os.path.join(settings.BASE_DIR, "converted"))
+        parser.add_argument(
+            "--cache", default=os.environ.get('CONVERSION_CACHE_PATH', os.path.join(settings.BASE_DIR, "conversion_cache.sqlite3")),
+            help="conversion cache index, its outputs and registered task directories are left alone",
+        )
+        parser.add_argument(
+            "--task-store", default=os.environ.get('TASK_STORE_PATH', os.path.join(settings.BASE_DIR, "tasks.sqlite3")),
+            help="SQLite task store, directories of queued/processing tasks are left alone",
+        )
+        parser.add_argument(
+            "--orphan-age", type=float, default=float(os.environ.get('STORAGE_ORPHAN_AGE', 2 * 86400)),
+            help="keep upload leftovers modified in the last N seconds",
+        )
+
+    def handle(self, *args, **options):
+        cache = ConversionCache(options["cache"], options["base_dir"], 0)
+        janitor = StorageJanitor(
+            cache, options["base_dir"], create_task_store("sqlite", options["task_store"]), orphan_age=options["orphan_age"]
+        )
+        removed, adopted = janitor.reconcile_orphans(time.time())
+        self.stdout.write(f"{adopted} untracked outputs adopted, {removed} upload leftovers removed from {options['base_dir']}")
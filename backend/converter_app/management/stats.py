@@ -0,0 +1,18 @@
+import statistics
+
+
+def latency_summary(samples_ms):
+    """mean/p50/p90/p99/max of a list of latencies in milliseconds"""
+    if not samples_ms:
+        return {"mean_ms": None, "p50_ms": None, "p90_ms": None, "p99_ms": None, "max_ms": None}
+    if len(samples_ms) == 1:
+        quantiles = samples_ms * 99
+    else:
+        quantiles = statistics.quantiles(samples_ms, n=100, method="inclusive")
+    return {
+        "mean_ms": round(statistics.fmean(samples_ms), 3),
+        "p50_ms": round(quantiles[49], 3),
+        "p90_ms": round(quantiles[89], 3),
+        "p99_ms": round(quantiles[98], 3),
+        "max_ms": round(max(samples_ms), 3),
+    }
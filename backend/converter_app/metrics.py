@@ -0,0 +1,259 @@
+"""
+In-process metrics with Prometheus text exposition.
+
+Counters and histograms are kept per process and published as a JSON snapshot into a
+SQLite file shared by the worker processes (MetricsPublisher). Whichever process answers
+/metrics merges every snapshot, so the numbers cover all gunicorn/uvicorn workers. Snapshots
+of processes that stopped publishing are folded into one "retired" row, so totals don't go
+backwards when gunicorn recycles a worker.
+
+Gauges (queue depth, disk usage) describe shared state and are read at scrape time instead.
+"""
+import atexit
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+MB = 1024 * 1024
+RETIRED = "retired"
+
+
+def _label_key(labelnames, labels):
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Expected labels {labelnames}, got {sorted(labels)}")
+    return ",".join(f'{name}="{labels[name]}"' for name in labelnames)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return {"type": self.type, "help": self.description, "samples": dict(self.values)}
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, description, buckets, labelnames=()):
+        self.name = name
+        self.description = description
+        self.buckets = sorted(buckets)
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}  # label key -> [count per bucket..., count above the last bucket, sum]
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            counts = self.values.setdefault(key, [0] * (len(self.buckets) + 2))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "type": self.type, "help": self.description, "buckets": self.buckets,
+                "samples": {key: list(counts) for key, counts in self.values.items()},
+            }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, description, labelnames=()):
+        return self._register(Counter(name, description, labelnames))
+
+    def histogram(self, name, description, buckets, labelnames=()):
+        return self._register(Histogram(name, description, buckets, labelnames))
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+
+def merge_snapshots(snapshots):
+    """Sum snapshots of the same metrics taken in different processes"""
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, "samples": {}})
+            for key, value in metric["samples"].items():
+                if metric["type"] == "histogram":
+                    if metric["buckets"] != target["buckets"]:
+                        continue  # bucket layout changed between releases, can't be summed
+                    current = target["samples"].get(key, [0] * len(value))
+                    target["samples"][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target["samples"][key] = target["samples"].get(key, 0) + value
+    return merged
+
+
+def render(snapshot, gauges=()):
+    """
+    Prometheus text format (version 0.0.4) of a (merged) snapshot plus gauges, given as
+    (name, description, value) or (name, description, {label key: value}).
+    """
+    lines = []
+    for name, metric in sorted(snapshot.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key, value in sorted(metric["samples"].items()):
+            if metric["type"] == "counter":
+                lines.append(f"{name}{{{key}}} {_format_value(value)}" if key else f"{name} {_format_value(value)}")
+                continue
+            prefix = f"{key}," if key else ""
+            cumulative = 0
+            for bound, count in zip(metric["buckets"] + [float("inf")], value[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{prefix}le="{_format_value(bound)}"}} {cumulative}')
+            labels = f"{{{key}}}" if key else ""
+            lines.append(f"{name}_sum{labels} {_format_value(value[-1])}")
+            lines.append(f"{name}_count{labels} {cumulative}")
+
+    for name, description, value in gauges:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        samples = value if isinstance(value, dict) else {"": value}
+        for key, sample in sorted(samples.items()):
+            lines.append(f"{name}{{{key}}} {_format_value(sample)}" if key else f"{name} {_format_value(sample)}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsPublisher:
+    """
+    Publishes this process' registry snapshot to the shared SQLite file every `interval`
+    seconds and at exit, and merges every process' snapshot for /metrics.
+    """
+
+    def __init__(self, registry, db_path, interval=10.0, stale_after=300.0):
+        self.registry = registry
+        self.db_path = db_path
+        self.interval = interval
+        self.stale_after = stale_after
+        self.process_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.local = threading.local()
+        self.thread = None
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS metric_snapshots (process_id TEXT PRIMARY KEY, updated_at REAL NOT NULL, data TEXT NOT NULL)"
+        )
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name="metrics-publisher", daemon=True)
+            self.thread.start()
+            atexit.register(self.publish)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.publish()
+            except Exception as e:
+                logging.error(f"Could not publish metrics: {e}")
+
+    def publish(self):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO metric_snapshots (process_id, updated_at, data) VALUES (?, ?, ?)",
+            (self.process_id, time.time(), json.dumps(self.registry.snapshot())),
+        )
+
+    def collect(self):
+        """Merged snapshot of every process, after retiring the ones that stopped publishing"""
+        self.publish()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute("SELECT process_id, updated_at, data FROM metric_snapshots").fetchall()
+            # A process silent this long is gone (stale_after is far above the publish interval)
+            cutoff = time.time() - self.stale_after
+            stale = [row for row in rows if row[0] != RETIRED and row[1] < cutoff]
+            if stale:
+                retired = [json.loads(row[2]) for row in rows if row[0] == RETIRED]
+                merged = merge_snapshots(retired + [json.loads(row[2]) for row in stale])
+                conn.executemany("DELETE FROM metric_snapshots WHERE process_id = ?", [(row[0],) for row in stale])
+                conn.execute(
+                    "INSERT OR REPLACE INTO metric_snapshots (process_id, updated_at, data) VALUES (?, ?, ?)",
+                    (RETIRED, time.time(), json.dumps(merged)),
+                )
+                rows = conn.execute("SELECT process_id, updated_at, data FROM metric_snapshots").fetchall()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return merge_snapshots(json.loads(row[2]) for row in rows)
+
+
+registry = MetricsRegistry()
+
+UPLOAD_THROUGHPUT = registry.histogram(
+    "xivdt_upload_throughput_bytes_per_second", "Upload receive speed per request",
+    [x * MB for x in (0.1, 0.5, 1, 2, 5, 10, 25, 50, 100, 250)], ["path"],
+)
+UPLOAD_BYTES = registry.counter("xivdt_upload_bytes_total", "Bytes received in uploads", ["path"])
+QUEUE_WAIT = registry.histogram(
+    "xivdt_queue_wait_seconds", "Time from upload to the start of the conversion",
+    [1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600],
+)
+CONVERSION_DURATION = registry.histogram(
+    "xivdt_conversion_duration_seconds", "Conversion run time by outcome",
+    [1, 5, 10, 30, 60, 120, 300, 600, 1200, 3600], ["status"],
+)
+DB_INSERT_LATENCY = registry.histogram(
+    "xivdt_db_insert_seconds", "srv_conversions batch insert latency by outcome",
+    [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5], ["outcome"],
+)
+DOWNLOAD_THROUGHPUT = registry.histogram(
+    "xivdt_download_throughput_bytes_per_second", "Download send speed per request, served from Python",
+    [x * MB for x in (0.1, 0.5, 1, 2, 5, 10, 25, 50, 100, 250)],
+)
+DOWNLOAD_BYTES = registry.counter("xivdt_download_bytes_total", "Bytes sent in downloads served from Python")
+
+
+def observe_transfer(throughput, total, size, seconds, **labels):
+    """Record one upload/download of `size` bytes that took `seconds`"""
+    total.inc(size, **labels)
+    if seconds > 0:
+        throughput.observe(size / seconds, **labels)
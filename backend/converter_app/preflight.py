@@ -0,0 +1,131 @@
+"""
+Pre-flight check of uploaded mod archives, before they take a conversion slot.
+
+.ttmp/.ttmp2 (TexTools) and .pmp (Penumbra) are zip files. Opening one with zipfile only
+reads the central directory at the end of the file, so a truncated or non-zip upload is
+rejected without decompressing anything; the only member that is read is the manifest
+(TTMPL.mpl or meta.json), which is small next to the payload.
+"""
+import json
+import os
+import zipfile
+from collections import namedtuple
+
+# Manifests are a few MB even for large packs, anything bigger is not a real manifest
+MAX_MANIFEST_SIZE = int(os.environ.get('PREFLIGHT_MAX_MANIFEST_SIZE', 64 * 1024 * 1024))
+
+TTMP_MANIFEST = "TTMPL.mpl"
+TTMP_DATA = "TTMPD.mpd"
+PMP_META = "meta.json"
+
+# file_count: game files the mod replaces; uncompressed_size: bytes of all archive members.
+# Both are cost hints for the scheduler, conversion time grows with them.
+ModArchiveInfo = namedtuple("ModArchiveInfo", "format file_count uncompressed_size")
+
+
+class InvalidModArchive(Exception):
+    """The upload can't be a convertible mod, the message says why"""
+
+
+def _read_text(archive, member):
+    if member.file_size > MAX_MANIFEST_SIZE:
+        raise InvalidModArchive(f"{member.filename} is too large ({member.file_size} bytes)")
+    try:
+        return archive.read(member).decode("utf-8-sig")
+    except UnicodeDecodeError as e:
+        raise InvalidModArchive(f"{member.filename} is not text: {e}")
+    except (zipfile.BadZipFile, EOFError, OSError, NotImplementedError) as e:
+        raise InvalidModArchive(f"{member.filename} can't be read: {e}")
+
+
+def _parse_json(member, text, lines=False):
+    """lines: the TTMPL.mpl of the first .ttmp format, one mod entry per line"""
+    try:
+        if lines:
+            return [json.loads(line) for line in text.splitlines() if line.strip()]
+        return json.loads(text)
+    except ValueError as e:
+        raise InvalidModArchive(f"{member.filename} is not valid JSON: {e}")
+
+
+def _ttmp_mods(manifest):
+    """Every mod entry of a TTMPL manifest, simple or wizard (ModPackPages) mod pack"""
+    if isinstance(manifest, list):
+        return manifest
+    if not isinstance(manifest, dict):
+        raise InvalidModArchive(f"{TTMP_MANIFEST} is not a mod pack manifest")
+    mods = list(manifest.get("SimpleModsList") or [])
+    for page in manifest.get("ModPackPages") or []:
+        for group in page.get("ModGroups") or []:
+            for option in group.get("OptionList") or []:
+                mods.extend(option.get("ModsJsons") or [])
+    return mods
+
+
+def _inspect_ttmp(archive, members):
+    manifest_member = members.get(TTMP_MANIFEST.lower())
+    data_member = members.get(TTMP_DATA.lower())
+    if manifest_member is None or data_member is None:
+        raise InvalidModArchive(f"Not a TexTools mod pack, {TTMP_MANIFEST} or {TTMP_DATA} is missing")
+
+    text = _read_text(archive, manifest_member)
+    try:
+        manifest = json.loads(text)
+    except ValueError:
+        manifest = _parse_json(manifest_member, text, lines=True)
+    mods = _ttmp_mods(manifest)
+    if not mods:
+        raise InvalidModArchive("The mod pack contains no files")
+
+    # Every entry points into TTMPD.mpd, check the ranges against its size
+    for mod in mods:
+        if not isinstance(mod, dict):
+            raise InvalidModArchive(f"{TTMP_MANIFEST} has a malformed mod entry")
+        offset, size = mod.get("ModOffset"), mod.get("ModSize")
+        if not isinstance(offset, int) or not isinstance(size, int) or offset < 0 or size < 0 \
+                or offset + size > data_member.file_size:
+            raise InvalidModArchive(f"{mod.get('FullPath', 'A mod entry')} points outside of {TTMP_DATA}")
+
+    file_format = "ttmp2" if isinstance(manifest, dict) and str(manifest.get("TTMPVersion", "")).startswith("2") else "ttmp"
+    return file_format, len(mods)
+
+
+def _inspect_pmp(archive, members):
+    meta_member = members.get(PMP_META)
+    if meta_member is None:
+        raise InvalidModArchive(f"Not a Penumbra mod pack, {PMP_META} is missing")
+    meta = _parse_json(meta_member, _read_text(archive, meta_member))
+    if not isinstance(meta, dict) or "FileVersion" not in meta:
+        raise InvalidModArchive(f"{PMP_META} is not a Penumbra mod manifest")
+
+    # Penumbra mods can be metadata manipulations only, so no payload files is fine here
+    return "pmp", sum(1 for name in members if not name.endswith(".json"))
+
+
+def inspect_mod_archive(path):
+    """
+    Check that `path` is a well-formed mod pack and return its ModArchiveInfo.
+    Raises InvalidModArchive for anything ConsoleTools would fail on anyway.
+    """
+    archive_size = os.path.getsize(path)
+    try:
+        archive = zipfile.ZipFile(path)
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, OSError, ValueError) as e:
+        raise InvalidModArchive(f"The file is not a mod pack or is damaged ({e})")
+
+    with archive:
+        infos = [info for info in archive.infolist() if not info.is_dir()]
+        for info in infos:
+            # A central directory that points past the end means the upload was cut short
+            if info.header_offset + info.compress_size > archive_size:
+                raise InvalidModArchive(f"The file is truncated, {info.filename} is incomplete")
+        members = {info.filename.replace("\\", "/").lower(): info for info in infos}
+
+        if TTMP_MANIFEST.lower() in members:
+            file_format, file_count = _inspect_ttmp(archive, members)
+        elif PMP_META in members:
+            file_format, file_count = _inspect_pmp(archive, members)
+        else:
+            raise InvalidModArchive(f"Not a mod pack, it has neither {TTMP_MANIFEST} nor {PMP_META}")
+
+    return ModArchiveInfo(file_format, file_count, sum(info.file_size for info in infos))
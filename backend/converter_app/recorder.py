@@ -0,0 +1,284 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from converter_app.metrics import DB_INSERT_LATENCY
+
+CONVERSION_COLUMNS = (
+    "cnv_file", "cnv_status", "cnv_created_at", "cnv_completed_at", "cnv_task_id",
+    "usr_id", "cnv_filesize", "cnv_download_link",
+)
+DATETIME_COLUMNS = ("cnv_created_at", "cnv_completed_at")
+# The database can't be reached right now, worth retrying the same rows later. Any other
+# error is blamed on the rows themselves.
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+# A .replay file nobody touched for this long belongs to a process that died replaying it
+STALE_REPLAY_SECONDS = 600
+
+
+def _encode_row(row):
+    return {
+        column: value.isoformat() if column in DATETIME_COLUMNS and value else value
+        for column, value in row.items()
+    }
+
+
+def _decode_row(row):
+    return {
+        column: datetime.fromisoformat(value) if column in DATETIME_COLUMNS and value else value
+        for column, value in row.items()
+    }
+
+
+class ConversionRecorder:
+    """
+    Write-behind recorder for srv_conversions.
+
+    record() only puts the row on an in-memory queue, so the conversion workers never wait
+    on the database. A background thread inserts rows in multi-row batches whenever
+    batch_size rows are pending or flush_interval seconds have passed. Batches that can't be
+    written (database down, connection pool exhausted) are appended to a spool file in
+    spool_dir and replayed every retry_interval seconds until they go through.
+
+    A batch the database rejects (IntegrityError, DataError...) is retried one row at a
+    time, and the rows that still fail go to dead-letter.jsonl in spool_dir instead of
+    being retried forever and holding up the rows after them.
+
+    on_written, when given, is called with every batch of rows once it is committed, and
+    on_dead_lettered with every row given up on.
+    """
+
+    def __init__(self, get_connection, spool_dir, batch_size=100, flush_interval=2.0, retry_interval=30.0, on_written=None,
+                 on_dead_lettered=None):
+        self.get_connection = get_connection
+        self.on_written = on_written
+        self.on_dead_lettered = on_dead_lettered
+        self.spool_dir = spool_dir
+        self.spool_path = os.path.join(spool_dir, f"conversions-{os.getpid()}.jsonl")
+        self.dead_letter_path = os.path.join(spool_dir, "dead-letter.jsonl")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.pending = queue.Queue()
+        self.spool_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.stats = {"recorded": 0, "written": 0, "batches": 0, "spooled": 0, "replayed": 0, "failed_batches": 0, "dead_lettered": 0}
+        self.thread = None
+        self.thread_lock = threading.Lock()
+        os.makedirs(spool_dir, exist_ok=True)
+        atexit.register(self.close)
+
+    def record(self, row):
+        """Queue a srv_conversions row (dict keyed by CONVERSION_COLUMNS) for writing"""
+        self._ensure_thread()
+        self.pending.put(row)
+        self._count("recorded")
+
+    def _ensure_thread(self):
+        with self.thread_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="conversion-recorder", daemon=True)
+                self.thread.start()
+
+    def _count(self, name, amount=1):
+        with self.stats_lock:
+            self.stats[name] += amount
+
+    def _run(self):
+        last_replay = 0
+        while True:
+            try:
+                batch = self._next_batch()
+                if batch:
+                    self._flush(batch)
+                if time.monotonic() - last_replay >= self.retry_interval:
+                    last_replay = time.monotonic()
+                    self._replay_spool()
+            except Exception as e:
+                logging.error(f"Conversion recorder failed: {e}", exc_info=True)
+
+    def _next_batch(self):
+        """Collect rows until the batch is full or flush_interval passed since the first one"""
+        try:
+            batch = [self.pending.get(timeout=self.retry_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _insert(self, conn, rows):
+        """Insert rows in one statement and commit, rolls back and re-raises on errors"""
+        started = time.monotonic()
+        try:
+            with conn.cursor() as cur:
+                execute_values(
+                    cur,
+                    f"INSERT INTO srv_conversions ({', '.join(CONVERSION_COLUMNS)}) VALUES %s",
+                    [tuple(row.get(column) for column in CONVERSION_COLUMNS) for row in rows],
+                    page_size=self.batch_size,
+                )
+            conn.commit()
+            DB_INSERT_LATENCY.observe(time.monotonic() - started, outcome="ok")
+        except Exception:
+            DB_INSERT_LATENCY.observe(time.monotonic() - started, outcome="error")
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+
+    def _write(self, rows):
+        """
+        Write rows, returns (written, retry): the rows that are in the database and the ones
+        to spool because the database is unreachable. Rows in neither were dead-lettered.
+        """
+        conn = self.get_connection()
+        if not conn:
+            return [], rows
+        try:
+            try:
+                self._insert(conn, rows)
+                written, retry = rows, []
+            except TRANSIENT_ERRORS as db_error:
+                logging.error(f"Database error when recording {len(rows)} conversions: {str(db_error)}")
+                written, retry = [], rows
+            except Exception as db_error:
+                logging.error(f"Database rejected a batch of {len(rows)} conversions, writing them one by one: {str(db_error)}")
+                written, retry = self._write_each(conn, rows)
+        finally:
+            conn.close()
+
+        if written and self.on_written:
+            try:
+                self.on_written(written)
+            except Exception as e:
+                logging.error(f"Error after recording {len(written)} conversions: {e}")
+        return written, retry
+
+    def _write_each(self, conn, rows):
+        """Isolate the rows a batch failed on, every other row is still written"""
+        written = []
+        for index, row in enumerate(rows):
+            try:
+                self._insert(conn, [row])
+            except TRANSIENT_ERRORS as db_error:
+                logging.error(f"Database error when recording conversion {row.get('cnv_task_id')}: {str(db_error)}")
+                return written, rows[index:]
+            except Exception as db_error:
+                self._dead_letter(row, db_error)
+                continue
+            written.append(row)
+        return written, []
+
+    def _dead_letter(self, row, error):
+        logging.error(f"Conversion {row.get('cnv_task_id')} can't be recorded, moved to {self.dead_letter_path}: {error}")
+        entry = {"row": _encode_row(row), "error": str(error).strip(), "failed_at": datetime.now().isoformat()}
+        with self.spool_lock:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as dead_letter:
+                dead_letter.write(json.dumps(entry, default=str) + "\n")
+        self._count("dead_lettered")
+        if self.on_dead_lettered:
+            try:
+                self.on_dead_lettered(row)
+            except Exception as e:
+                logging.error(f"Error after dead-lettering conversion {row.get('cnv_task_id')}: {e}")
+
+    def _flush(self, rows):
+        written, retry = self._write(rows)
+        self._count("written", len(written))
+        if retry:
+            self._count("failed_batches")
+            self._spool(retry)
+        else:
+            self._count("batches")
+            logging.info(f"Recorded {len(written)} conversions in the database")
+
+    def _spool(self, rows, retry=False):
+        with self.spool_lock:
+            with open(self.spool_path, "a", encoding="utf-8") as spool:
+                for row in rows:
+                    spool.write(json.dumps(_encode_row(row)) + "\n")
+                spool.flush()
+                os.fsync(spool.fileno())
+        if not retry:
+            self._count("spooled", len(rows))
+        logging.warning(f"Spooled {len(rows)} conversion records to {self.spool_path}")
+
+    def _replay_spool(self):
+        """Retry spooled rows, including spool files left behind by dead worker processes"""
+        paths = glob.glob(os.path.join(self.spool_dir, "conversions-*.jsonl"))
+        # A process that died halfway through a replay leaves its .replay file behind
+        # (the owner touches it while replaying, so only a silent one is taken over)
+        for path in glob.glob(os.path.join(self.spool_dir, "conversions-*.replay")):
+            try:
+                if time.time() - os.path.getmtime(path) > STALE_REPLAY_SECONDS:
+                    paths.append(path)
+            except OSError:
+                pass
+        for path in paths:
+            # Take the file out of the way atomically; if another process got it first, skip it
+            replay_path = f"{path}.{os.getpid()}.replay"
+            try:
+                with self.spool_lock:
+                    os.replace(path, replay_path)
+            except OSError:
+                continue
+
+            try:
+                # os.replace keeps the spool's mtime, which may be long past STALE_REPLAY_SECONDS
+                os.utime(replay_path)
+                with open(replay_path, encoding="utf-8") as spool:
+                    rows = [_decode_row(json.loads(line)) for line in spool if line.strip()]
+            except FileNotFoundError:
+                continue
+
+            for start in range(0, len(rows), self.batch_size):
+                written, retry = self._write(rows[start:start + self.batch_size])
+                self._count("replayed", len(written))
+                if retry:
+                    # Database still unavailable, keep the rest for the next round
+                    self._spool(retry + rows[start + self.batch_size:], retry=True)
+                    break
+                try:
+                    os.utime(replay_path)
+                except FileNotFoundError:
+                    pass
+            try:
+                os.remove(replay_path)
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """Spool whatever is still queued so it survives the process exiting"""
+        rows = []
+        while True:
+            try:
+                rows.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        if rows:
+            self._spool(rows)
+
+    def metrics(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats["pending"] = self.pending.qsize()
+        stats["spool_files"] = len(glob.glob(os.path.join(self.spool_dir, "conversions-*.jsonl")))
+        return stats
@@ -0,0 +1,181 @@
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+# Task directories live in BASE_DIR/ab/cd/<name>, so no directory on the share ever
+# holds more than a few hundred entries
+SHARD_WIDTH = 2
+SHARD_DEPTH = 2
+
+
+def is_task_name(name):
+    """Task directories are named by a hex digest (md5 or uuid4), anything else isn't one"""
+    return len(name) > SHARD_WIDTH * SHARD_DEPTH and name.isascii() and name.isalnum()
+
+
+def task_dir(base_dir, name):
+    """Sharded location of the task directory `name`: BASE_DIR/ab/cd/abcd..."""
+    shards = [name[level * SHARD_WIDTH:(level + 1) * SHARD_WIDTH] for level in range(SHARD_DEPTH)]
+    return os.path.join(base_dir, *shards, name)
+
+
+def legacy_task_dir(base_dir, name):
+    """Location from before the sharded layout, directly in BASE_DIR"""
+    return os.path.join(base_dir, name)
+
+
+def resolve_task_dir(base_dir, name):
+    """Existing directory of task `name` in either layout, None when there is none"""
+    if not is_task_name(name):
+        return None
+    for path in (task_dir(base_dir, name), legacy_task_dir(base_dir, name)):
+        if os.path.isdir(path):
+            return path
+    return None
+
+
+def _subdirs(path):
+    with os.scandir(path) as entries:
+        return [entry for entry in entries if entry.is_dir(follow_symlinks=False)]
+
+
+def iter_task_dirs(base_dir, legacy=True, sharded=True):
+    """Yield (name, path) of every task directory under base_dir, in both layouts"""
+    for entry in _subdirs(base_dir):
+        if is_task_name(entry.name):
+            if legacy:
+                yield entry.name, entry.path
+        elif sharded and len(entry.name) == SHARD_WIDTH:
+            shards = [entry]
+            for _ in range(SHARD_DEPTH - 1):
+                shards = [child for shard in shards for child in _subdirs(shard.path) if len(child.name) == SHARD_WIDTH]
+            for shard in shards:
+                for child in _subdirs(shard.path):
+                    if is_task_name(child.name):
+                        yield child.name, child.path
+
+
+def link_or_copy(source, destination):
+    """Hardlink destination to source, copy it where the share doesn't support links"""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def newest_mtime(path):
+    """mtime of a task directory or of anything directly in it, whichever is newest"""
+    newest = os.path.getmtime(path)
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                newest = max(newest, entry.stat(follow_symlinks=False).st_mtime)
+            except OSError:
+                pass
+    return newest
+
+
+class NetworkDriveMonitor:
+    """
+    Keeps the SMB share mapped as a drive letter, without ever making a request wait.
+
+    The drive is checked once at startup and then by a background thread every
+    check_interval seconds. When it is missing the thread runs New-PSDrive; failed mounts
+    back off exponentially up to max_backoff seconds so a dead file server isn't hammered
+    with PowerShell processes. Callers only read the cached state (is_mounted, status).
+    """
+
+    def __init__(self, share_name, share_path, check_interval=60.0, max_backoff=900.0, mount_timeout=60.0):
+        self.share_name = share_name
+        self.share_path = share_path
+        self.check_interval = check_interval
+        self.max_backoff = max_backoff
+        self.mount_timeout = mount_timeout
+        self.lock = threading.Lock()
+        self.thread = None
+        self.state = {
+            "mounted": None,  # unknown until the first check
+            "last_check": None,
+            "last_mounted": None,
+            "last_error": None,
+            "consecutive_failures": 0,
+            "mount_attempts": 0,
+            "next_check_in": None,
+        }
+
+    @property
+    def drive(self):
+        return f"{self.share_name}:\\"
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self._run, name="network-drive-monitor", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.check())
+
+    def check(self):
+        """Check (and if needed mount) the drive now; returns the seconds until the next check"""
+        error = None
+        mounted = os.path.exists(self.drive)
+        if not mounted:
+            with self.lock:
+                self.state["mount_attempts"] += 1
+            try:
+                result = subprocess.run(
+                    ["powershell", "-NoProfile", "-Command",
+                     f"New-PSDrive -Name '{self.share_name}' -PSProvider FileSystem -Root '{self.share_path}' -Persist"],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    text=True,
+                    timeout=self.mount_timeout,
+                )
+                mounted = os.path.exists(self.drive)
+                if not mounted:
+                    error = result.stderr.strip() or f"New-PSDrive exited with code {result.returncode}"
+            except (OSError, subprocess.TimeoutExpired) as e:
+                error = str(e)
+
+        with self.lock:
+            now = datetime.now().isoformat()
+            was_mounted = self.state["mounted"]
+            self.state["mounted"] = mounted
+            self.state["last_check"] = now
+            if mounted:
+                self.state["last_mounted"] = now
+                self.state["consecutive_failures"] = 0
+                self.state["last_error"] = None
+                delay = self.check_interval
+            else:
+                self.state["consecutive_failures"] += 1
+                self.state["last_error"] = error
+                delay = min(self.check_interval * 2 ** (self.state["consecutive_failures"] - 1), self.max_backoff)
+            self.state["next_check_in"] = delay
+
+        if mounted and was_mounted is not True:
+            logging.info(f"Network drive {self.drive} is mounted ({self.share_path})")
+        elif not mounted:
+            logging.error(f"Drive mount failed: {error}, retrying in {delay:.0f}s")
+        return delay
+
+    def is_mounted(self):
+        with self.lock:
+            return self.state["mounted"] is True
+
+    def status(self):
+        with self.lock:
+            return {
+                "drive": self.drive,
+                "share_path": self.share_path,
+                "check_interval": self.check_interval,
+                "monitoring": self.thread is not None and self.thread.is_alive(),
+                **self.state,
+            }
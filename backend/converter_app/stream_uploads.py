@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+from urllib.parse import parse_qs
+from uuid import uuid4
+
+import aiofiles
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from converter_app import views
+from converter_app.metrics import UPLOAD_BYTES, UPLOAD_THROUGHPUT, observe_transfer
+from converter_app.preflight import InvalidModArchive
+from converter_app.storage import task_dir
+from converter_app.uploads import UPLOAD_MAX_SIZE, UPLOAD_WRITE_BUFFER, UploadDigest
+
+STREAM_UPLOAD_PATH = os.environ.get('STREAM_UPLOAD_PATH', '/convert/stream')
+
+
+class UploadRejected(Exception):
+    def __init__(self, status_code, error):
+        super().__init__(error)
+        self.status_code = status_code
+        self.error = error
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class StreamUploadApplication:
+    """
+    ASGI wrapper that serves POST STREAM_UPLOAD_PATH itself and hands every other request
+    to Django.
+
+    Django's ASGI handler reads the whole request body into a temporary file before any
+    view runs, so not even an async view can stream an upload. Here the body (the raw file,
+    its name in ?filename= or an X-Filename header) is written to BASE_DIR as it arrives
+    with aiofiles, and hashed in a worker thread, so the event loop only ever waits and one
+    uvicorn process can take many large uploads at once. The response is the same as /convert.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].rstrip("/") != STREAM_UPLOAD_PATH.rstrip("/"):
+            await self.app(scope, receive, send)
+            return
+
+        headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+        cors = self._cors_headers(headers.get("origin"))
+        if scope["method"] == "OPTIONS":
+            await self._respond(send, 204, None, cors + [
+                (b"access-control-allow-methods", b"POST, OPTIONS"),
+                (b"access-control-allow-headers", b"authorization, content-type, x-filename"),
+                (b"access-control-max-age", b"86400"),
+            ])
+            return
+        if scope["method"] != "POST":
+            await self._respond(send, 405, {"error": "Method not allowed"}, cors + [(b"allow", b"POST, OPTIONS")])
+            return
+
+        try:
+            payload = await self._upload(scope, headers, receive)
+            await self._respond(send, 200, payload, cors)
+        except UploadRejected as e:
+            logging.error(e.error)
+            await self._respond(send, e.status_code, {"error": e.error}, cors)
+        except ClientDisconnected:
+            logging.warning("Client disconnected during a streamed upload, discarding it")
+        except Exception as e:
+            logging.error(f"Unhandled exception in streamed upload: {str(e)}", exc_info=True)
+            await self._respond(send, 500, {"error": f"Server error: {str(e)}"}, cors)
+
+    async def _upload(self, scope, headers, receive):
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        original_filename = query.get("filename", [headers.get("x-filename", "")])[0]
+        original_filename = os.path.basename(original_filename.replace("\\", "/"))
+
+        suffix = os.path.splitext(original_filename)[1].lower()
+        if suffix == '' or suffix not in views.VALID_EXTENSIONS:
+            raise UploadRejected(400, f"The extention {suffix} is not a valid extention")
+        expected_size = int(headers["content-length"]) if headers.get("content-length", "").isdigit() else None
+        if expected_size is not None and expected_size > UPLOAD_MAX_SIZE:
+            raise UploadRejected(413, f"File is larger than {UPLOAD_MAX_SIZE} bytes")
+
+        views.ensure_network_drive()
+
+        hash_dir = task_dir(views.BASE_DIR, uuid4().hex)
+        input_path = os.path.join(hash_dir, original_filename)
+        await asyncio.to_thread(os.makedirs, hash_dir, exist_ok=True)
+        logging.info(f"Streaming upload of {original_filename}, size: {expected_size} bytes")
+
+        received_at = time.time()
+        try:
+            digest = await self._receive_file(receive, input_path, expected_size)
+        except BaseException:
+            await asyncio.to_thread(shutil.rmtree, hash_dir, True)
+            raise
+
+        if digest.size == 0:
+            await asyncio.to_thread(shutil.rmtree, hash_dir, True)
+            raise UploadRejected(400, "No file uploaded")
+        logging.info(f"File saved successfully, size on disk: {digest.size} bytes, sha256: {digest.sha256}")
+
+        client_ip = headers.get("x-forwarded-for", "").split(",")[0].strip() or (scope.get("client") or ("",))[0]
+        user_id = views.user_id_from_authorization(headers.get("authorization"))
+        try:
+            return await sync_to_async(views.enqueue_conversion, thread_sensitive=False)(
+                hash_dir, input_path, original_filename, digest, client_ip, user_id, received_at
+            )
+        except InvalidModArchive as e:
+            raise UploadRejected(400, f"This mod can't be converted: {e}")
+
+    async def _receive_file(self, receive, input_path, expected_size):
+        digest = UploadDigest()
+        buffer = bytearray()
+        received = 0
+        next_progress = 10 * 1024 * 1024
+        start_time = time.time()
+
+        async with aiofiles.open(input_path, 'wb') as destination:
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    raise ClientDisconnected()
+                body = message.get("body", b"")
+                received += len(body)
+                if received > UPLOAD_MAX_SIZE:
+                    raise UploadRejected(413, f"File is larger than {UPLOAD_MAX_SIZE} bytes")
+                buffer += body
+                more_body = message.get("more_body", False)
+
+                if len(buffer) >= UPLOAD_WRITE_BUFFER or (buffer and not more_body):
+                    block = bytes(buffer)
+                    buffer.clear()
+                    # Write and hash the block in parallel, hashlib releases the GIL
+                    await asyncio.gather(destination.write(block), asyncio.to_thread(digest.update, block))
+
+                if expected_size and expected_size > 50 * 1024 * 1024 and received >= next_progress:
+                    next_progress += 10 * 1024 * 1024
+                    elapsed = time.time() - start_time
+                    speed = received / (elapsed * 1024 * 1024) if elapsed > 0 else 0
+                    logging.info(
+                        f"Upload progress: {received * 100 / expected_size:.1f}% ({received}/{expected_size} bytes), speed: {speed:.2f} MB/s",
+                        extra={"sample_key": f"upload:{input_path}"},
+                    )
+
+                if not more_body:
+                    observe_transfer(UPLOAD_THROUGHPUT, UPLOAD_BYTES, received, time.time() - start_time, path="stream")
+                    return digest
+
+    def _cors_headers(self, origin):
+        """Same answer django-cors-headers gives for the Django routes"""
+        if not origin:
+            return []
+        if not getattr(settings, 'CORS_ALLOW_ALL_ORIGINS', False) and origin not in getattr(settings, 'CORS_ALLOWED_ORIGINS', []):
+            return []
+        cors = [(b"access-control-allow-origin", origin.encode("latin-1")), (b"vary", b"Origin")]
+        if getattr(settings, 'CORS_ALLOW_CREDENTIALS', False):
+            cors.append((b"access-control-allow-credentials", b"true"))
+        return cors
+
+    async def _respond(self, send, status_code, payload, extra_headers=()):
+        body = json.dumps(payload).encode() if payload is not None else b""
+        headers = [(b"content-length", str(len(body)).encode())] + list(extra_headers)
+        if payload is not None:
+            headers.append((b"content-type", b"application/json"))
+        await send({"type": "http.response.start", "status": status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
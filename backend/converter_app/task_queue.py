@@ -0,0 +1,196 @@
+import asyncio
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+
+from converter_app.eta import ConversionTimeModel, estimate_payload, forecast
+from converter_app.metrics import QUEUE_WAIT
+from converter_app.task_store import InMemoryTaskStore
+
+
+class TaskQueue:
+    """
+    Conversion slots working through a TaskStore.
+
+    num_workers threads claim tasks from the store (with a shared store num_workers is the
+    limit for all processes together) and hand them to _process_task, which subclasses
+    implement. Idle workers sleep until add_task wakes one up; tasks added by other
+    processes can't wake us, so with a shared store they also re-check the store every
+    poll_interval seconds. With a shared store the queue heartbeats every
+    heartbeat_interval seconds and re-queues the tasks of processes silent for
+    orphan_timeout seconds, at most max_recoveries times.
+    """
+
+    def __init__(self, store=None, num_workers=1, work_dir=None, eta_model=None, poll_interval=1.0,
+                 heartbeat_interval=10.0, orphan_timeout=60.0, max_recoveries=3):
+        self.store = store or InMemoryTaskStore()
+        self.num_workers = max(1, num_workers)
+        self.work_dir = work_dir
+        self.eta_model = eta_model or ConversionTimeModel()
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.orphan_timeout = orphan_timeout
+        self.max_recoveries = max_recoveries
+        # asyncio.Event -> event loop, for the streaming endpoints waiting on queue changes
+        self.listeners = {}
+        self.listeners_lock = threading.Lock()
+        # Idle workers sleep on this condition; add_task bumps the generation and wakes one up
+        self.work_available = threading.Condition()
+        self.generation = 0
+        self.idle_timeout = poll_interval if self.store.shared else None
+        self.process_id = f"{socket.gethostname()}:{os.getpid()}"
+        if self.store.shared:
+            # First heartbeat before any claim, so other processes never mistake our tasks for orphans
+            self.store.heartbeat(self.process_id)
+            threading.Thread(target=self._heartbeat, name="task-heartbeat", daemon=True).start()
+            atexit.register(self.store.forget_process, self.process_id)
+        self.worker_threads = []
+        for slot in range(self.num_workers):
+            worker_thread = threading.Thread(target=self._worker, args=(slot,), name=f"conversion-slot-{slot}", daemon=True)
+            worker_thread.start()
+            self.worker_threads.append(worker_thread)
+
+    def add_task(self, task):
+        queue_size = self.store.add(task)
+        logging.info(f"Task {task.task_id} added to queue. Queue size: {queue_size}")
+        if task.status == "queued":
+            self._wake_worker()
+        self._notify()
+        return task.task_id
+
+    def get_task(self, task_id):
+        return self.store.get(task_id)
+
+    def _forecast(self, pending):
+        return forecast(self.eta_model, pending["processing"], pending["queued"], self.num_workers)
+
+    def get_queue_status(self):
+        pending = self.store.pending()
+        processing = [task.task_id for task in pending["processing"]]
+        queued = [task.task_id for task in pending["queued"]]
+        estimates = self._forecast(pending)
+        return {
+            "queue_size": len(queued) + len(processing),
+            "current_task": processing[0] if processing else None,  # kept for older clients
+            "processing_tasks": processing,
+            "queued_tasks": queued,
+            "workers": self.num_workers,
+            "idle_workers": max(0, self.num_workers - len(processing)),
+            "estimates": {task_id: estimate_payload(*times) for task_id, times in estimates.items()},
+            "estimated_idle_at": max(finish for _, finish in estimates.values()).isoformat(timespec="seconds") if estimates else None,
+        }
+
+    def get_task_estimate(self, task_id):
+        """
+        (1-based queue position, (start, finish)) of a pending task from one store read;
+        None for the position once it left the queue, None for the times once it finished
+        """
+        pending = self.store.pending()
+        queued = [task.task_id for task in pending["queued"]]
+        position = queued.index(task_id) + 1 if task_id in queued else None
+        return position, self._forecast(pending).get(task_id)
+
+    def add_listener(self):
+        """Return an asyncio.Event that gets set on every queue change (call from the event loop)"""
+        event = asyncio.Event()
+        with self.listeners_lock:
+            self.listeners[event] = asyncio.get_running_loop()
+        return event
+
+    def remove_listener(self, event):
+        with self.listeners_lock:
+            self.listeners.pop(event, None)
+
+    def _notify(self):
+        with self.listeners_lock:
+            listeners = list(self.listeners.items())
+        for event, loop in listeners:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Loop already closed, the stream is gone
+                self.remove_listener(event)
+
+    def _wake_worker(self):
+        with self.work_available:
+            self.generation += 1
+            self.work_available.notify()
+
+    def _wait_for_work(self, generation, timeout):
+        """Block until add_task is called after `generation` was read, or until timeout"""
+        with self.work_available:
+            while self.generation == generation:
+                if not self.work_available.wait(timeout):
+                    return
+
+    def _heartbeat(self):
+        """Keep our heartbeat fresh and pick up tasks left behind by dead worker processes"""
+        while True:
+            try:
+                self.store.heartbeat(self.process_id)
+                requeued, failed = self.store.recover_orphans(self.orphan_timeout, self.max_recoveries)
+            except Exception as e:
+                logging.error(f"Task store error during heartbeat: {e}")
+                requeued, failed = [], []
+
+            for task in requeued:
+                logging.warning(f"Re-queued task {task.task_id} after its worker process died (recovery {task.recoveries})")
+                self._wake_worker()
+            for task in failed:
+                logging.error(f"Task {task.task_id} could not be recovered: {task.error}")
+                self._recovery_failed(task)
+            if requeued or failed:
+                self._notify()
+            time.sleep(self.heartbeat_interval)
+
+    def _worker(self, slot):
+        # Every slot gets its own scratch directory so parallel ConsoleTools runs don't share temp files
+        worker_id = f"{self.process_id}:{slot}"
+        work_dir = None
+        if self.work_dir:
+            work_dir = os.path.join(self.work_dir, f"{os.getpid()}-slot-{slot}")
+            os.makedirs(work_dir, exist_ok=True)
+
+        while True:
+            # Read the generation before claiming so an add_task racing with the claim isn't missed
+            with self.work_available:
+                generation = self.generation
+
+            task = None
+            timeout = self.idle_timeout
+            try:
+                task = self.store.claim(self.num_workers, worker_id)
+            except Exception as e:
+                logging.error(f"Task store error while claiming a task: {e}")
+                timeout = self.poll_interval
+
+            if not task:
+                self._wait_for_work(generation, timeout)
+                continue
+
+            logging.info(f"Task {task.task_id} acquired by {worker_id}...")
+            if task.started_at and task.created_at:
+                QUEUE_WAIT.observe(max(0.0, (task.started_at - task.created_at).total_seconds()))
+            self._notify()
+            try:
+                self._process_task(task, work_dir)
+            finally:
+                if task.status == "processing":
+                    task.status = "failed"
+                    task.error = task.error or "Conversion was interrupted"
+                    task.completed_at = datetime.now()
+                self.store.update(task)
+                self._notify()
+                # A slot was freed, let a worker blocked on the global limit try again
+                self._wake_worker()
+
+    def _process_task(self, task, work_dir):
+        """Convert a claimed task, setting its status; the store is updated afterwards"""
+        raise NotImplementedError
+
+    def _recovery_failed(self, task):
+        """A task of a dead process was given up on (see TaskStore.recover_orphans)"""
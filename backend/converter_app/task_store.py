@@ -0,0 +1,464 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from datetime import datetime, timedelta
+
+from converter_app.scheduler import FifoScheduler
+
+FINISHED_STATUSES = ("completed", "failed")
+
+# The task fields the schedulers and the ETA forecast look at, read without decoding the whole task
+ScheduledTask = namedtuple(
+    "ScheduledTask", "task_id user_id client_ip input_size mod_size original_filename created_at started_at"
+)
+
+
+class ConversionTask:
+    # Thousands of these live in the task history, so skip the per-instance __dict__
+    __slots__ = (
+        "task_id", "file_path", "output_path", "original_filename", "client_ip", "user_id",
+        "content_hash", "fingerprint", "input_size", "mod_files", "mod_size", "status", "result", "error",
+        "created_at", "started_at", "completed_at", "recoveries", "timeline",
+    )
+
+    def __init__(self, task_id, file_path, output_path, original_filename, client_ip, user_id=None):
+        self.task_id = task_id
+        self.file_path = file_path
+        self.output_path = output_path
+        self.original_filename = original_filename
+        self.client_ip = client_ip
+        self.user_id = user_id  # New field to track user_id (if authenticated)
+        self.content_hash = None  # SHA-256 of the uploaded file, computed while it was written
+        self.fingerprint = None  # fast xxh3-64 of the upload, when xxhash is installed
+        self.input_size = None  # bytes written for the upload
+        self.mod_files = None  # game files in the mod pack, from the pre-flight check
+        self.mod_size = None  # uncompressed size of the mod pack
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = datetime.now()
+        self.started_at = None  # claimed by a worker
+        self.completed_at = None
+        self.recoveries = 0  # times the task was re-queued after its worker process died
+        self.timeline = []  # [stage, unix time] marks from upload to the recorded row, see mark()
+
+    def mark(self, stage, at=None):
+        """Note that the task reached `stage` (received, saved, enqueued, started, ...)"""
+        self.timeline.append([stage, at if at is not None else time.time()])
+
+    def to_dict(self):
+        """Serialize the task so it can be shared between processes"""
+        return {
+            "task_id": self.task_id,
+            "file_path": self.file_path,
+            "output_path": self.output_path,
+            "original_filename": self.original_filename,
+            "client_ip": self.client_ip,
+            "user_id": self.user_id,
+            "content_hash": self.content_hash,
+            "fingerprint": self.fingerprint,
+            "input_size": self.input_size,
+            "mod_files": self.mod_files,
+            "mod_size": self.mod_size,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "completed_at": self.completed_at.isoformat() if self.completed_at else None,
+            "recoveries": self.recoveries,
+            "timeline": self.timeline,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        task = cls(
+            data["task_id"],
+            data["file_path"],
+            data["output_path"],
+            data["original_filename"],
+            data["client_ip"],
+            data.get("user_id"),
+        )
+        task.content_hash = data.get("content_hash")
+        task.fingerprint = data.get("fingerprint")
+        task.input_size = data.get("input_size")
+        task.mod_files = data.get("mod_files")
+        task.mod_size = data.get("mod_size")
+        task.status = data.get("status", "queued")
+        task.result = data.get("result")
+        task.error = data.get("error")
+        task.created_at = datetime.fromisoformat(data["created_at"]) if data.get("created_at") else None
+        task.started_at = datetime.fromisoformat(data["started_at"]) if data.get("started_at") else None
+        task.completed_at = datetime.fromisoformat(data["completed_at"]) if data.get("completed_at") else None
+        task.recoveries = data.get("recoveries", 0)
+        task.timeline = data.get("timeline") or []
+        return task
+
+
+class TaskStore:
+    """
+    Interface for the task state backends used by TaskQueue.
+
+    A store owns both the pending queue and the task history. claim() must be atomic
+    across every process sharing the store, since it is what enforces the global
+    concurrency limit. Which queued task is claimed next is up to the store's scheduler.
+    """
+
+    # True when other processes can change the store behind our back
+    shared = False
+
+    def add(self, task):
+        """Record a task; only tasks with status "queued" are scheduled for conversion"""
+        raise NotImplementedError
+
+    def get(self, task_id):
+        raise NotImplementedError
+
+    def update(self, task):
+        raise NotImplementedError
+
+    def claim(self, max_active, worker_id):
+        """Move the first task in scheduling order to "processing" unless max_active tasks already are"""
+        raise NotImplementedError
+
+    def pending(self):
+        """
+        Return {"processing": [...], "queued": [...]} tasks in scheduling order. Only the
+        ScheduledTask fields are guaranteed to be there.
+        """
+        raise NotImplementedError
+
+    def snapshot(self):
+        """Return {"processing": [...], "queued": [...]} task ids in scheduling order"""
+        pending = self.pending()
+        return {
+            "processing": [task.task_id for task in pending["processing"]],
+            "queued": [task.task_id for task in pending["queued"]],
+        }
+
+    def mark_recorded(self, task_ids):
+        """
+        The srv_conversions rows of these finished tasks are written (or were given up on),
+        so they may be evicted from the history. Unrecorded tasks are kept.
+        """
+
+    def heartbeat(self, process_id):
+        """Tell the other processes sharing the store that process_id is still alive"""
+
+    def forget_process(self, process_id):
+        """process_id is exiting, its tasks can be recovered right away"""
+
+    def recover_orphans(self, stale_after, max_recoveries):
+        """
+        Re-queue "processing" tasks whose process stopped sending heartbeats for stale_after
+        seconds. Returns (requeued, failed) lists of tasks; tasks that were already recovered
+        max_recoveries times, or whose upload is gone, fail instead.
+        """
+        return [], []
+
+
+class InMemoryTaskStore(TaskStore):
+    """
+    Per-process store, fine for a single worker process (manage.py runserver, one uvicorn worker).
+    Nothing is persisted: queued and in-flight tasks are lost when the process exits.
+
+    Finished tasks are dropped from the history once they are older than history_ttl seconds
+    or when more than max_history tasks are kept, but only after their srv_conversions row
+    was recorded (mark_recorded), so the status API always finds them in one or the other.
+    max_history is still a hard limit; past it unrecorded tasks go too, oldest first.
+    """
+
+    def __init__(self, max_history=10000, history_ttl=6 * 3600, scheduler=None):
+        self.scheduler = scheduler or FifoScheduler()
+        self.queue = deque()
+        self.active = {}
+        self.task_history = {}
+        self.finished = OrderedDict()  # task_id -> monotonic finish time, oldest first
+        self.recorded = set()
+        self.max_history = max_history
+        self.history_ttl = history_ttl
+        self.lock = threading.Lock()
+
+    def add(self, task):
+        with self.lock:
+            if task.status == "queued":
+                self.queue.append(task)
+            self.task_history[task.task_id] = task
+            if task.status in FINISHED_STATUSES:
+                self.finished[task.task_id] = time.monotonic()
+            self._prune()
+            return len(self.queue)
+
+    def get(self, task_id):
+        return self.task_history.get(task_id)
+
+    def update(self, task):
+        with self.lock:
+            self.task_history[task.task_id] = task
+            if task.status not in ("queued", "processing"):
+                self.active.pop(task.task_id, None)
+            if task.status in FINISHED_STATUSES:
+                self.finished[task.task_id] = time.monotonic()
+                self._prune()
+
+    def mark_recorded(self, task_ids):
+        with self.lock:
+            self.recorded.update(task_id for task_id in task_ids if task_id in self.task_history)
+            self._prune()
+
+    def _prune(self):
+        expires_before = time.monotonic() - self.history_ttl
+        evict = []
+        over = len(self.task_history) - self.max_history
+        for task_id, finished_at in self.finished.items():
+            if finished_at >= expires_before and over <= len(evict):
+                break
+            if task_id in self.recorded:
+                evict.append(task_id)
+        for task_id in self.finished:
+            if over <= len(evict):
+                break
+            if task_id not in self.recorded:
+                evict.append(task_id)
+        for task_id in evict:
+            del self.finished[task_id]
+            self.task_history.pop(task_id, None)
+            self.recorded.discard(task_id)
+
+    def claim(self, max_active, worker_id):
+        with self.lock:
+            if not self.queue or len(self.active) >= max_active:
+                return None
+            task = self.scheduler.order(self.queue, self.active.values())[0]
+            self.queue.remove(task)
+            task.status = "processing"
+            task.started_at = datetime.now()
+            task.mark("started", task.started_at.timestamp())
+            self.active[task.task_id] = task
+            return task
+
+    def pending(self):
+        with self.lock:
+            return {
+                "processing": list(self.active.values()),
+                "queued": self.scheduler.order(self.queue, self.active.values()),
+            }
+
+
+class SQLiteTaskStore(TaskStore):
+    """
+    Store backed by a SQLite file so every gunicorn/uvicorn worker on the host sees the
+    same queue, the same task status and the same global concurrency limit.
+
+    The queue survives restarts and worker recycling. Every process writes a heartbeat to
+    task_workers; tasks claimed by a process whose heartbeat went stale are re-queued with
+    the upload that is already on disk. The history is pruned like InMemoryTaskStore's.
+    """
+
+    shared = True
+
+    def __init__(self, db_path, max_history=10000, history_ttl=6 * 3600, scheduler=None):
+        self.scheduler = scheduler or FifoScheduler()
+        self.db_path = db_path
+        self.max_history = max_history
+        self.history_ttl = history_ttl
+        self.last_prune = 0
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS conversion_tasks (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id TEXT NOT NULL UNIQUE,
+                status TEXT NOT NULL,
+                claimed_by TEXT,
+                data TEXT NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS conversion_tasks_status ON conversion_tasks (status, seq)")
+        # Set once the srv_conversions row is written, finished tasks are only pruned after that
+        if "recorded" not in {row[1] for row in conn.execute("PRAGMA table_info(conversion_tasks)")}:
+            conn.execute("ALTER TABLE conversion_tasks ADD COLUMN recorded INTEGER NOT NULL DEFAULT 0")
+        conn.execute("CREATE TABLE IF NOT EXISTS task_workers (process_id TEXT PRIMARY KEY, last_seen REAL NOT NULL)")
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads, so keep one per thread
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def add(self, task):
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO conversion_tasks (task_id, status, data) VALUES (?, ?, ?)",
+            (task.task_id, task.status, json.dumps(task.to_dict())),
+        )
+        return conn.execute("SELECT COUNT(*) FROM conversion_tasks WHERE status = 'queued'").fetchone()[0]
+
+    def get(self, task_id):
+        row = self._connection().execute(
+            "SELECT data FROM conversion_tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        return ConversionTask.from_dict(json.loads(row[0])) if row else None
+
+    def update(self, task):
+        self._connection().execute(
+            "UPDATE conversion_tasks SET status = ?, data = ? WHERE task_id = ?",
+            (task.status, json.dumps(task.to_dict()), task.task_id),
+        )
+        if task.status in FINISHED_STATUSES and time.monotonic() - self.last_prune > 60:
+            self.last_prune = time.monotonic()
+            self._prune()
+
+    def mark_recorded(self, task_ids):
+        task_ids = list(task_ids)
+        if task_ids:
+            self._connection().execute(
+                f"UPDATE conversion_tasks SET recorded = 1 WHERE task_id IN ({', '.join('?' * len(task_ids))})",
+                task_ids,
+            )
+
+    def _prune(self):
+        conn = self._connection()
+        cutoff = (datetime.now() - timedelta(seconds=self.history_ttl)).isoformat()
+        conn.execute(
+            """
+            DELETE FROM conversion_tasks
+            WHERE status IN ('completed', 'failed') AND recorded = 1 AND json_extract(data, '$.completed_at') < ?
+            """,
+            (cutoff,),
+        )
+        # Over max_history, recorded tasks go first
+        conn.execute(
+            """
+            DELETE FROM conversion_tasks
+            WHERE status IN ('completed', 'failed')
+            AND seq NOT IN (SELECT seq FROM conversion_tasks ORDER BY recorded, seq DESC LIMIT ?)
+            """,
+            (self.max_history,),
+        )
+
+    def _scheduled(self, conn, task_status):
+        rows = conn.execute(
+            """
+            SELECT task_id, json_extract(data, '$.user_id'), json_extract(data, '$.client_ip'),
+                   json_extract(data, '$.input_size'), json_extract(data, '$.mod_size'),
+                   json_extract(data, '$.original_filename'), json_extract(data, '$.created_at'),
+                   json_extract(data, '$.started_at')
+            FROM conversion_tasks WHERE status = ? ORDER BY seq
+            """,
+            (task_status,),
+        ).fetchall()
+        return [ScheduledTask(*row) for row in rows]
+
+    def claim(self, max_active, worker_id):
+        conn = self._connection()
+        # Cheap read first so idle workers don't take the write lock on every poll
+        if conn.execute("SELECT 1 FROM conversion_tasks WHERE status = 'queued' LIMIT 1").fetchone() is None:
+            return None
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            processing = self._scheduled(conn, "processing")
+            row = None
+            if len(processing) < max_active:
+                ordered = self.scheduler.order(self._scheduled(conn, "queued"), processing)
+                if ordered:
+                    row = conn.execute(
+                        "SELECT data FROM conversion_tasks WHERE task_id = ?", (ordered[0].task_id,)
+                    ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            task = ConversionTask.from_dict(json.loads(row[0]))
+            task.status = "processing"
+            task.started_at = datetime.now()
+            task.mark("started", task.started_at.timestamp())
+            conn.execute(
+                "UPDATE conversion_tasks SET status = ?, claimed_by = ?, data = ? WHERE task_id = ?",
+                (task.status, worker_id, json.dumps(task.to_dict()), task.task_id),
+            )
+            conn.execute("COMMIT")
+            return task
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def pending(self):
+        conn = self._connection()
+        processing = self._scheduled(conn, "processing")
+        return {
+            "processing": processing,
+            "queued": self.scheduler.order(self._scheduled(conn, "queued"), processing),
+        }
+
+
+    def heartbeat(self, process_id):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO task_workers (process_id, last_seen) VALUES (?, ?)", (process_id, time.time())
+        )
+
+    def forget_process(self, process_id):
+        self._connection().execute("DELETE FROM task_workers WHERE process_id = ?", (process_id,))
+
+    def recover_orphans(self, stale_after, max_recoveries):
+        conn = self._connection()
+        cutoff = time.time() - stale_after
+        requeued, failed = [], []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            alive = {row[0] for row in conn.execute("SELECT process_id FROM task_workers WHERE last_seen >= ?", (cutoff,))}
+            rows = conn.execute("SELECT claimed_by, data FROM conversion_tasks WHERE status = 'processing'").fetchall()
+            for claimed_by, data in rows:
+                # claimed_by is "host:pid:slot", heartbeats are per "host:pid"
+                if claimed_by and claimed_by.rsplit(":", 1)[0] in alive:
+                    continue
+
+                task = ConversionTask.from_dict(json.loads(data))
+                task.recoveries += 1
+                if task.recoveries > max_recoveries:
+                    task.status = "failed"
+                    task.error = f"Conversion was interrupted {task.recoveries} times, giving up"
+                elif not task.file_path or not os.path.exists(task.file_path):
+                    task.status = "failed"
+                    task.error = "The uploaded file was lost, please upload it again"
+                else:
+                    task.status = "queued"
+
+                if task.status == "failed":
+                    task.completed_at = datetime.now()
+                    failed.append(task)
+                else:
+                    requeued.append(task)
+                conn.execute(
+                    "UPDATE conversion_tasks SET status = ?, claimed_by = NULL, data = ? WHERE task_id = ?",
+                    (task.status, json.dumps(task.to_dict()), task.task_id),
+                )
+            conn.execute("DELETE FROM task_workers WHERE last_seen < ?", (cutoff,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return requeued, failed
+
+
+def create_task_store(backend, db_path=None, max_history=10000, history_ttl=6 * 3600, scheduler=None):
+    """Build the task store selected by TASK_STORE_BACKEND ("memory" or "sqlite")"""
+    if backend == "sqlite":
+        logging.info(f"Using shared SQLite task store at {db_path}")
+        return SQLiteTaskStore(db_path, max_history, history_ttl, scheduler)
+    if backend != "memory":
+        logging.warning(f"Unknown task store backend '{backend}', falling back to in-memory store")
+    return InMemoryTaskStore(max_history, history_ttl, scheduler)
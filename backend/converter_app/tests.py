@@ -1,3 +1,694 @@
-from django.test import TestCase
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+import psycopg2
+from django.test import RequestFactory, SimpleTestCase
+
+from converter_app.conversion_cache import ConversionCache
+from converter_app.downloads import parse_range, serve_file
+from converter_app.eta import MB, ConversionTimeModel
+from converter_app.preflight import InvalidModArchive, inspect_mod_archive
+from converter_app.janitor import StorageJanitor
+from converter_app.recorder import ConversionRecorder
+from converter_app.scheduler import FairShareScheduler
+from converter_app.storage import task_dir
+from converter_app.task_store import ConversionTask, InMemoryTaskStore, SQLiteTaskStore
+from converter_app.uploads import UPLOAD_MAX_SIZE, ChunkedUpload, UploadFinalizing, UploadTooLarge, upload_client
+
+
+class FakeConnection:
+    """Stands in for a pooled psycopg2 connection, the INSERT itself is patched out"""
+
+    def __init__(self):
+        self.commits = 0
+
+    def cursor(self):
+        return mock.MagicMock()
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class ConversionRecorderTests(SimpleTestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir, True)
+        self.inserted = []
+        self.error = None
+        self.recorder = ConversionRecorder(FakeConnection, self.spool_dir, batch_size=10)
+
+        def execute_values(cur, sql, values, page_size):
+            if self.error:
+                raise self.error
+            if any(value[0] == "bad" for value in values):
+                raise psycopg2.IntegrityError("duplicate key value violates unique constraint")
+            self.inserted.extend(values)
+
+        patcher = mock.patch("converter_app.recorder.execute_values", execute_values)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def rows(self, *files):
+        return [
+            {"cnv_file": name, "cnv_status": "completed", "cnv_task_id": f"task-{index}", "cnv_completed_at": datetime.now()}
+            for index, name in enumerate(files)
+        ]
+
+    def spooled_rows(self):
+        return sum(1 for path in glob.glob(os.path.join(self.spool_dir, "conversions-*.jsonl")) for _ in open(path))
+
+    def test_rejected_row_is_dead_lettered_and_the_rest_written(self):
+        self.recorder._flush(self.rows("a", "b", "bad", "c", "d"))
+
+        self.assertEqual([value[0] for value in self.inserted], ["a", "b", "c", "d"])
+        self.assertEqual(self.spooled_rows(), 0)
+        stats = self.recorder.metrics()
+        self.assertEqual((stats["written"], stats["spooled"], stats["dead_lettered"]), (4, 0, 1))
+        with open(self.recorder.dead_letter_path, encoding="utf-8") as dead_letter:
+            entries = [json.loads(line) for line in dead_letter]
+        self.assertEqual([entry["row"]["cnv_file"] for entry in entries], ["bad"])
+        self.assertIn("duplicate key", entries[0]["error"])
+
+    def test_unreachable_database_spools_and_replay_drains(self):
+        self.error = psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.recorder._flush(self.rows("a", "b", "bad"))
+        self.assertEqual(self.spooled_rows(), 3)
+        self.assertEqual(self.inserted, [])
+
+        self.error = None
+        self.recorder._replay_spool()
+        self.assertEqual(self.spooled_rows(), 0)
+        self.assertEqual([value[0] for value in self.inserted], ["a", "b"])
+        self.assertEqual(self.recorder.metrics()["dead_lettered"], 1)
+
+    def test_replay_in_progress_is_not_taken_over(self):
+        self.error = psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.recorder._flush(self.rows("a", "b"))
+        self.error = None
+        # Spooled during an outage longer than STALE_REPLAY_SECONDS
+        long_ago = time.time() - 3600
+        os.utime(self.recorder.spool_path, (long_ago, long_ago))
+        other = ConversionRecorder(FakeConnection, self.spool_dir, batch_size=10)
+        calls = []
+
+        def execute_values(cur, sql, values, page_size):
+            calls.append(values)
+            if len(calls) == 1:
+                # Another process looks for stale replays while this one is writing
+                other._replay_spool()
+            self.inserted.extend(values)
+
+        with mock.patch("converter_app.recorder.execute_values", execute_values):
+            self.recorder._replay_spool()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([value[0] for value in self.inserted], ["a", "b"])
+        self.assertEqual(glob.glob(os.path.join(self.spool_dir, "conversions-*")), [])
+
+    def test_recorder_thread_survives_errors(self):
+        batches = [self.rows("a"), self.rows("b"), SystemExit()]
+        with mock.patch.object(self.recorder, "_next_batch", side_effect=batches), \
+                mock.patch.object(self.recorder, "_flush", side_effect=[FileNotFoundError("gone"), None]) as flush, \
+                mock.patch.object(self.recorder, "_replay_spool"):
+            with self.assertRaises(SystemExit):
+                self.recorder._run()
+        self.assertEqual(flush.call_count, 2)
+
+    def test_connection_lost_while_isolating_rows_spools_the_rest(self):
+        calls = []
+
+        def execute_values(cur, sql, values, page_size):
+            calls.append(values)
+            if len(calls) == 1:
+                raise psycopg2.DataError("value too long")
+            if len(calls) == 3:
+                raise psycopg2.InterfaceError("connection already closed")
+            self.inserted.extend(values)
+
+        with mock.patch("converter_app.recorder.execute_values", execute_values):
+            self.recorder._flush(self.rows("a", "b", "c"))
+
+        self.assertEqual([value[0] for value in self.inserted], ["a"])
+        self.assertEqual(self.spooled_rows(), 2)
+        self.assertEqual(self.recorder.metrics()["dead_lettered"], 0)
+
+
+class InspectModArchiveTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+
+    def archive(self, name, members):
+        path = os.path.join(self.dir, name)
+        with zipfile.ZipFile(path, "w") as archive:
+            for member, data in members.items():
+                archive.writestr(member, data)
+        return path
+
+    def ttmp2(self, mods, data=b"\0" * 100):
+        manifest = {"TTMPVersion": "2.0", "Name": "test", "SimpleModsList": mods}
+        return self.archive("test.ttmp2", {"TTMPL.mpl": json.dumps(manifest), "TTMPD.mpd": data})
+
+    def test_valid_pmp(self):
+        path = self.archive("test.pmp", {
+            "meta.json": json.dumps({"FileVersion": 3, "Name": "test"}),
+            "default_mod.json": json.dumps({"Files": {}}),
+            "files/body.mdl": b"\1" * 50,
+        })
+        info = inspect_mod_archive(path)
+        self.assertEqual((info.format, info.file_count), ("pmp", 1))
+        self.assertGreater(info.uncompressed_size, 50)
+
+    def test_valid_ttmp2(self):
+        path = self.ttmp2([
+            {"FullPath": "chara/a.mdl", "ModOffset": 0, "ModSize": 60},
+            {"FullPath": "chara/b.tex", "ModOffset": 60, "ModSize": 40},
+        ])
+        info = inspect_mod_archive(path)
+        self.assertEqual((info.format, info.file_count), ("ttmp2", 2))
+
+    def test_offsets_outside_the_data_file(self):
+        path = self.ttmp2([{"FullPath": "chara/a.mdl", "ModOffset": 80, "ModSize": 40}])
+        with self.assertRaisesMessage(InvalidModArchive, "chara/a.mdl points outside of TTMPD.mpd"):
+            inspect_mod_archive(path)
+
+    def test_truncated(self):
+        path = self.ttmp2([{"FullPath": "chara/a.mdl", "ModOffset": 0, "ModSize": 100}])
+        with open(path, "rb") as archive:
+            data = archive.read()
+        with open(path, "wb") as archive:
+            archive.write(data[:len(data) // 2])
+        with self.assertRaises(InvalidModArchive):
+            inspect_mod_archive(path)
+
+    def test_member_past_the_end(self):
+        # Central directory intact, but it says TTMPD.mpd is longer than the file is
+        path = self.ttmp2([{"FullPath": "chara/a.mdl", "ModOffset": 0, "ModSize": 100}])
+        with zipfile.ZipFile(path) as archive:
+            directory_offset = archive.start_dir
+        with open(path, "r+b") as archive:
+            data = archive.read()
+            entry = data.index(b"PK\x01\x02", directory_offset)
+            entry = data.index(b"PK\x01\x02", entry + 4)  # TTMPD.mpd, the second member
+            archive.seek(entry + 20)  # compressed size
+            archive.write((1024 * 1024).to_bytes(4, "little"))
+        with self.assertRaisesMessage(InvalidModArchive, "The file is truncated, TTMPD.mpd is incomplete"):
+            inspect_mod_archive(path)
+
+    def test_not_a_zip(self):
+        path = os.path.join(self.dir, "random.pmp")
+        with open(path, "wb") as upload:
+            upload.write(os.urandom(4096))
+        with self.assertRaisesMessage(InvalidModArchive, "not a mod pack"):
+            inspect_mod_archive(path)
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_ignored_headers(self):
+        for header in (None, "", "bytes=-", "items=0-10", "bytes=0-10,20-30", "bytes=a-b"):
+            self.assertIsNone(parse_range(header, 100), header)
+
+    def test_ranges(self):
+        self.assertEqual(parse_range("bytes=0-9", 100), (0, 9))
+        self.assertEqual(parse_range("bytes=90-", 100), (90, 99))
+        self.assertEqual(parse_range("bytes=90-500", 100), (90, 99))
+        self.assertEqual(parse_range(" bytes=0-0 ", 100), (0, 0))
+
+    def test_suffix_ranges(self):
+        self.assertEqual(parse_range("bytes=-10", 100), (90, 99))
+        self.assertEqual(parse_range("bytes=-500", 100), (0, 99))
+
+    def test_unsatisfiable(self):
+        for header in ("bytes=100-", "bytes=100-200", "bytes=50-10", "bytes=-0"):
+            with self.assertRaises(ValueError, msg=header):
+                parse_range(header, 100)
+
+
+class ServeFileTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+        self.path = os.path.join(self.dir, "dt_test.pmp")
+        with open(self.path, "wb") as output:
+            output.write(bytes(range(100)))
+        self.factory = RequestFactory()
+
+    def serve(self, content_hash=None, path=None, **headers):
+        path = path or self.path
+        response = serve_file(self.factory.get("/download", headers=headers), path, os.path.basename(path), self.dir, content_hash)
+        self.addCleanup(response.close)
+        return response
+
+    def body(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_range(self):
+        response = self.serve(Range="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 10-19/100")
+        self.assertEqual(self.body(response), bytes(range(10, 20)))
+
+    def test_unsatisfiable_range(self):
+        response = self.serve(Range="bytes=100-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */100")
+
+    def test_if_range_with_current_etag(self):
+        response = self.serve("abc", Range="bytes=0-9", If_Range='"abc"')
+        self.assertEqual(response.status_code, 206)
+
+    def test_if_range_with_stale_etag_sends_the_whole_file(self):
+        response = self.serve("abc", Range="bytes=0-9", If_Range='"old"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), bytes(range(100)))
+
+    def test_if_range_never_matches_a_weak_etag(self):
+        etag = self.serve()["ETag"]
+        self.assertTrue(etag.startswith("W/"))
+        self.assertEqual(self.serve(Range="bytes=0-9", If_Range=etag).status_code, 200)
+
+    def test_if_range_with_date(self):
+        modified = self.serve()["Last-Modified"]
+        self.assertEqual(self.serve(Range="bytes=0-9", If_Range=modified).status_code, 206)
+        self.assertEqual(self.serve(Range="bytes=0-9", If_Range="Mon, 01 Jan 2001 00:00:00 GMT").status_code, 200)
+
+    def test_not_modified(self):
+        self.assertEqual(self.serve("abc", If_None_Match='"abc"').status_code, 304)
+
+    def test_nginx_redirect_is_quoted(self):
+        path = os.path.join(self.dir, "dt_ミコッテ #1 100%?.pmp")
+        shutil.copyfile(self.path, path)
+        with mock.patch("converter_app.downloads.DOWNLOAD_OFFLOAD", "nginx"):
+            response = self.serve(path=path)
+        self.assertEqual(
+            response["X-Accel-Redirect"],
+            "/protected-converted/dt_%E3%83%9F%E3%82%B3%E3%83%83%E3%83%86%20%231%20100%25%3F.pmp",
+        )
+
+
+class ChunkedUploadTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+        self.sessions_dir = os.path.join(self.dir, "uploads")
+        self.data = bytes(range(10))
+
+    def create(self, size=10, client="10.0.0.1"):
+        data_path = os.path.join(self.dir, "task", "test.pmp.part")
+        return ChunkedUpload.create(self.sessions_dir, "abc", data_path, "test.pmp", size, client, chunk_size=4)
+
+    def write(self, upload, index, data=None, expected_sha256=None):
+        data = self.data if data is None else data
+        return upload.write_chunk(index, [data[index * 4:index * 4 + 4]], expected_sha256)
+
+    def test_chunks_out_of_order(self):
+        upload = self.create()
+        self.assertEqual(upload.chunk_count, 3)
+        for index in (2, 0):
+            self.write(upload, index)
+        self.assertEqual(upload.missing(), [1])
+        self.write(upload, 1)
+        self.assertEqual(upload.missing(), [])
+        self.assertEqual(upload.digest().sha256, hashlib.sha256(self.data).hexdigest())
+        status = ChunkedUpload.load(self.sessions_dir, "abc").status()
+        self.assertEqual(status["received_chunks"], [0, 1, 2])
+        self.assertEqual(status["bytes_received"], 10)
+
+    def test_duplicate_chunk_overwrites(self):
+        upload = self.create()
+        self.write(upload, 1, b"\xff" * 10)
+        self.write(upload, 1)
+        self.assertEqual(upload.received(), [1])
+        for index in (0, 2):
+            self.write(upload, index)
+        self.assertEqual(upload.digest().sha256, hashlib.sha256(self.data).hexdigest())
+
+    def test_digest_mismatch(self):
+        upload = self.create()
+        with self.assertRaisesMessage(ValueError, "checksum mismatch"):
+            self.write(upload, 0, expected_sha256="0" * 64)
+        self.assertEqual(upload.received(), [])
+        chunk_sha256 = hashlib.sha256(self.data[:4]).hexdigest()
+        self.assertEqual(self.write(upload, 0, expected_sha256=chunk_sha256.upper()), chunk_sha256)
+        # A chunk that verified but isn't what the client meant to send shows in the file digest
+        self.write(upload, 1, b"\x00" * 10)
+        self.write(upload, 2)
+        self.assertNotEqual(upload.digest().sha256, hashlib.sha256(self.data).hexdigest())
+
+    def test_size_cap(self):
+        self.assertEqual(UPLOAD_MAX_SIZE, 500 * 1024 * 1024)
+        with self.assertRaises(UploadTooLarge):
+            self.create(size=UPLOAD_MAX_SIZE + 1)
+        self.assertFalse(os.path.exists(self.sessions_dir))
+        upload = self.create(size=UPLOAD_MAX_SIZE)
+        # Nothing is preallocated, and no chunk can grow the file past the declared size
+        self.assertEqual(os.path.getsize(upload.data_path), 0)
+        with self.assertRaisesMessage(ValueError, "out of range"):
+            upload.write_chunk(upload.chunk_count, [b"x"])
+        last = upload.chunk_count - 1
+        with self.assertRaisesMessage(ValueError, "is larger than"):
+            upload.write_chunk(last, [b"x" * (upload.chunk_length(last) + 1)])
+
+    def test_no_chunks_once_finalize_started(self):
+        upload = self.create()
+        upload.begin_finalize()
+        with self.assertRaises(UploadFinalizing):
+            self.write(upload, 0)
+        with self.assertRaises(UploadFinalizing):
+            ChunkedUpload.load(self.sessions_dir, "abc").begin_finalize()
+        self.assertEqual(upload.received(), [])
+        upload.cancel_finalize()
+        self.write(upload, 0)
+        self.assertEqual(upload.received(), [0])
+
+    def test_finalize_waits_for_chunks_in_flight(self):
+        upload = self.create()
+        started, release = threading.Event(), threading.Event()
+
+        def pieces():
+            yield self.data[:2]
+            started.set()
+            release.wait(5)
+            yield self.data[2:4]
+
+        writer = threading.Thread(target=upload.write_chunk, args=(0, pieces()))
+        writer.start()
+        self.addCleanup(writer.join)
+        self.addCleanup(release.set)
+        started.wait(5)
+        with self.assertRaisesMessage(UploadFinalizing, "still being written"):
+            upload.begin_finalize(timeout=0.1)
+        self.assertFalse(upload.finalizing())
+
+        finalize = threading.Thread(target=upload.begin_finalize, args=(5,))
+        finalize.start()
+        time.sleep(0.1)
+        self.assertTrue(finalize.is_alive())
+        release.set()
+        finalize.join(5)
+        self.assertFalse(finalize.is_alive())
+        self.assertTrue(upload.finalizing())
+        self.assertEqual(upload.received(), [0])
+
+    def test_client_ignores_forwarded_for_from_untrusted_peers(self):
+        self.assertEqual(upload_client("203.0.113.5", "198.51.100.1"), "203.0.113.5")
+        self.assertEqual(upload_client("203.0.113.5", "198.51.100.1", {"10.0.0.2"}), "203.0.113.5")
+
+    def test_client_behind_trusted_proxies(self):
+        proxies = {"10.0.0.2", "10.0.0.3"}
+        self.assertEqual(upload_client("10.0.0.2", "203.0.113.5", proxies), "203.0.113.5")
+        # The client can prepend anything, only the address our proxy appended counts
+        self.assertEqual(upload_client("10.0.0.2", "198.51.100.1, 203.0.113.5, 10.0.0.3", proxies), "203.0.113.5")
+        self.assertEqual(upload_client("10.0.0.2", None, proxies), "10.0.0.2")
+
+
+class StorageJanitorTests(SimpleTestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir, True)
+        self.cache = ConversionCache(os.path.join(self.base_dir, "cache.sqlite3"), self.base_dir, 10 ** 9)
+        self.store = InMemoryTaskStore()
+        self.janitor = StorageJanitor(self.cache, self.base_dir, self.store, orphan_age=60)
+
+    def task_dir(self, name, live=False):
+        path = task_dir(self.base_dir, name * 8)
+        os.makedirs(path)
+        output_path = os.path.join(path, "dt_test.pmp")
+        with open(output_path, "wb") as output:
+            output.write(b"converted")
+        self.cache.register_dir(path, name)
+        if live:
+            task = ConversionTask(name, None, output_path, "test.pmp", "127.0.0.1")
+            task.status = "completed"
+            self.store.add(task)
+        return path, output_path
+
+    def test_removes_registered_dirs_without_task_or_cache_entry(self):
+        orphan, _ = self.task_dir("aaaa")
+        live, _ = self.task_dir("bbbb", live=True)
+        cached, cached_output = self.task_dir("cccc")
+        self.cache.store("hash", "v1", cached_output)
+
+        self.assertEqual(self.janitor.remove_orphans(time.time() + 120), 1)
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(live))
+        self.assertTrue(os.path.exists(cached))
+        # Cached directories are left to the cache, only the live task is still tracked
+        self.assertEqual([path for path, _ in self.cache.registered_dirs()], [os.path.abspath(live)])
+
+    def test_recently_registered_dirs_are_kept(self):
+        path, _ = self.task_dir("aaaa")
+        self.assertEqual(self.janitor.remove_orphans(time.time()), 0)
+        self.assertTrue(os.path.exists(path))
+
+    def test_duplicate_output_is_not_cached_and_removed_after_its_task(self):
+        first, first_output = self.task_dir("aaaa")
+        second, second_output = self.task_dir("bbbb")
+        self.assertTrue(self.cache.store("hash", "v1", first_output))
+        self.assertFalse(self.cache.store("hash", "v1", second_output))
+        self.assertEqual(self.cache.lookup("hash", "v1"), first_output)
+
+        self.janitor.remove_orphans(time.time() + 120)
+        self.assertTrue(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+
+    def test_reconcile_adopts_outputs_and_removes_upload_leftovers(self):
+        tracked, _ = self.task_dir("aaaa")
+        leftover = task_dir(self.base_dir, "dddd" * 8)
+        os.makedirs(leftover)
+        with open(os.path.join(leftover, "test.pmp"), "wb") as upload:
+            upload.write(b"partial")
+        # Converted before the registry existed, in the flat layout migrate_storage_layout moves
+        legacy = os.path.join(self.base_dir, "eeee" * 8)
+        os.makedirs(legacy)
+        legacy_output = os.path.join(legacy, "dt_old.pmp")
+        with open(legacy_output, "wb") as output:
+            output.write(b"converted")
+        converted_at = time.time() - 3 * 86400
+        os.utime(legacy_output, (converted_at, converted_at))
+        os.utime(legacy, (converted_at, converted_at))
+
+        self.assertEqual(self.janitor.reconcile_orphans(time.time() + 120), (1, 1))
+        self.assertFalse(os.path.exists(leftover))
+        self.assertTrue(os.path.exists(tracked))
+        self.assertTrue(os.path.exists(legacy_output))
+        self.assertIn(legacy, self.cache.owned_dirs())
+
+        # From now on the age policy decides, not the walk
+        self.assertEqual(self.janitor.reconcile_orphans(time.time() + 120), (0, 0))
+        self.assertEqual(self.cache.expire(created_before=time.time() - 2 * 86400), (1, len(b"converted")))
+        self.assertFalse(os.path.exists(legacy))
+
+    def test_first_reconcile_is_one_interval_after_the_first_start(self):
+        self.assertFalse(self.cache.claim_run("janitor_last_reconcile", 7 * 86400))
+
+
+class ConversionTimeModelTests(SimpleTestCase):
+    def seeded_model(self, rows):
+        model = ConversionTimeModel(default_seconds=60)
+        cursor = mock.MagicMock()
+        cursor.__enter__.return_value.fetchall.return_value = rows
+        connection = mock.MagicMock()
+        connection.cursor.return_value = cursor
+        self.assertEqual(model.load_history(lambda: connection, 100), len(rows))
+        return model
+
+    def test_seeded_fit_predicts_from_the_file_size(self):
+        # srv_conversions rows: output file of 10MB took 20s, 20MB took 40s
+        model = self.seeded_model([("dt_a.pmp", 10 * MB, 20.0), ("dt_b.pmp", 20 * MB, 40.0), ("dt_c.pmp", 30 * MB, 60.0)])
+        self.assertAlmostEqual(model.predict("test.pmp", 500 * MB, file_size=15 * MB), 30.0)
+
+    def test_live_fit_replaces_the_seeded_one(self):
+        model = self.seeded_model([("dt_a.pmp", 10 * MB, 20.0), ("dt_b.pmp", 20 * MB, 40.0), ("dt_c.pmp", 30 * MB, 60.0)])
+        for size in (100, 200, 300):
+            model.observe("test.pmp", size * MB, size / 10)
+        # Only the live samples count, in mod size units
+        self.assertAlmostEqual(model.predict("test.pmp", 150 * MB, file_size=15 * MB), 15.0)
+        self.assertEqual(model.fits["*"].samples, 3)
+        stats = model.metrics()
+        self.assertEqual(stats["kinds"][".pmp"], {"samples": 3, "seconds_for_100mb": 10.0})
+        self.assertEqual(stats["seeded_kinds"][".pmp"]["samples"], 3)
+
+    def test_default_without_samples(self):
+        self.assertEqual(ConversionTimeModel(default_seconds=60).predict("test.pmp", MB), 60)
+
+
+class TaskHistoryTests(SimpleTestCase):
+    """Finished tasks stay in the store until their srv_conversions row is recorded"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+
+    def stores(self):
+        yield InMemoryTaskStore(max_history=3, history_ttl=0)
+        store = SQLiteTaskStore(os.path.join(self.dir, f"tasks-{len(os.listdir(self.dir))}.sqlite3"), max_history=3, history_ttl=0)
+        yield store
+
+    def finish(self, store, task_id):
+        task = ConversionTask(task_id, None, f"/out/{task_id}/dt_test.pmp", "test.pmp", "127.0.0.1")
+        store.add(task)
+        task.status = "completed"
+        task.completed_at = datetime.now()
+        store.update(task)
+        if isinstance(store, SQLiteTaskStore):
+            store._prune()
+
+    def test_expired_tasks_wait_for_their_row(self):
+        for store in self.stores():
+            self.finish(store, "a")
+            self.assertIsNotNone(store.get("a"), type(store).__name__)
+            store.mark_recorded(["a"])
+            store._prune()
+            self.assertIsNone(store.get("a"), type(store).__name__)
+
+    def test_max_history_evicts_recorded_tasks_first(self):
+        for store in self.stores():
+            store.history_ttl = 3600
+            for task_id in "abc":
+                self.finish(store, task_id)
+            store.mark_recorded(["c"])
+            self.finish(store, "d")
+            remaining = [task_id for task_id in "abcd" if store.get(task_id)]
+            self.assertEqual(remaining, ["a", "b", "d"], type(store).__name__)
+
+
+def make_task(task_id, user_id=None, client_ip="127.0.0.1", size=0, created_at=None, file_path=None):
+    task = ConversionTask(task_id, file_path, f"/out/{task_id}/dt_test.pmp", "test.pmp", client_ip, user_id)
+    task.input_size = size
+    if created_at:
+        task.created_at = created_at
+    return task
+
+
+class FairShareSchedulerTests(SimpleTestCase):
+    def order(self, scheduler, queued, processing=()):
+        return [task.task_id for task in scheduler.order(queued, list(processing))]
+
+    def test_owners_take_turns(self):
+        queued = [
+            make_task("a1", user_id=1), make_task("a2", user_id=1), make_task("a3", user_id=1),
+            make_task("b1", user_id=2), make_task("c1", client_ip="10.0.0.1"),
+        ]
+        self.assertEqual(self.order(FairShareScheduler(shortest_first=False), queued), ["a1", "b1", "c1", "a2", "a3"])
+
+    def test_running_tasks_count_as_a_turn(self):
+        queued = [make_task("a1", user_id=1), make_task("b1", user_id=2)]
+        processing = [make_task("a0", user_id=1)]
+        self.assertEqual(self.order(FairShareScheduler(shortest_first=False), queued, processing), ["b1", "a1"])
+
+    def test_smaller_mods_first_within_a_round(self):
+        queued = [
+            make_task("a-big", user_id=1, size=500), make_task("a-small", user_id=1, size=10),
+            make_task("b-mid", user_id=2, size=100),
+        ]
+        self.assertEqual(self.order(FairShareScheduler(), queued), ["a-small", "b-mid", "a-big"])
+
+    def test_authenticated_lane(self):
+        queued = [make_task("anon", client_ip="10.0.0.1"), make_task("user", user_id=1)]
+        self.assertEqual(self.order(FairShareScheduler(priority_authenticated=True), queued), ["user", "anon"])
+        self.assertEqual(self.order(FairShareScheduler(), queued), ["anon", "user"])
+
+    def test_overdue_tasks_go_first_in_arrival_order(self):
+        now = datetime.now()
+        queued = [
+            make_task("a1", user_id=1, created_at=now - timedelta(seconds=30)),
+            make_task("a2", user_id=1, created_at=now - timedelta(seconds=20)),
+            make_task("a3", user_id=1, created_at=now - timedelta(seconds=1000)),
+            make_task("b1", user_id=2, created_at=now - timedelta(seconds=10)),
+            make_task("b2", user_id=2, created_at=now - timedelta(seconds=950)),
+        ]
+        scheduler = FairShareScheduler(shortest_first=False, priority_authenticated=True, max_wait=900)
+        self.assertEqual([task.task_id for task in scheduler.order(queued, [], now)], ["a3", "b2", "a1", "b1", "a2"])
+
+    def test_serialized_created_at(self):
+        # The SQLite store hands the scheduler ISO strings
+        task = make_task("a1", user_id=1)
+        task.created_at = (datetime.now() - timedelta(seconds=1000)).isoformat()
+        self.assertEqual(self.order(FairShareScheduler(max_wait=900), [make_task("b1", user_id=2), task]), ["a1", "b1"])
+
+
+class SQLiteTaskStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+        self.db_path = os.path.join(self.dir, "tasks.sqlite3")
+        self.store = SQLiteTaskStore(self.db_path, scheduler=FairShareScheduler(shortest_first=False))
+
+    def test_claim_follows_the_scheduler(self):
+        for task in (make_task("a1", user_id=1), make_task("a2", user_id=1), make_task("b1", user_id=2)):
+            self.store.add(task)
+        claimed = [self.store.claim(3, "host:1:0").task_id for _ in range(3)]
+        self.assertEqual(claimed, ["a1", "b1", "a2"])
+        self.assertEqual(self.store.get("b1").status, "processing")
+        self.assertIsNone(self.store.claim(3, "host:1:0"))
+
+    def test_concurrent_claims_respect_the_global_limit(self):
+        for index in range(6):
+            self.store.add(make_task(f"t{index}", user_id=index))
+        # One store per "process", every thread with its own connection to the same file
+        stores = [SQLiteTaskStore(self.db_path) for _ in range(4)]
+        barrier = threading.Barrier(8)
+        claimed = []
+
+        def claim(store, slot):
+            barrier.wait()
+            task = store.claim(2, f"host:{id(store)}:{slot}")
+            if task:
+                claimed.append(task.task_id)
+
+        threads = [threading.Thread(target=claim, args=(store, slot)) for store in stores for slot in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(claimed), 2)
+        self.assertEqual(len(set(claimed)), 2)
+        self.assertEqual(len(self.store.snapshot()["processing"]), 2)
+
+    def test_recover_orphans(self):
+        upload = os.path.join(self.dir, "test.pmp")
+        open(upload, "wb").close()
+        tasks = {
+            "requeued": make_task("requeued", user_id=1, file_path=upload),
+            "lost": make_task("lost", user_id=2, file_path=os.path.join(self.dir, "missing.pmp")),
+            "gave-up": make_task("gave-up", user_id=3, file_path=upload),
+            "alive": make_task("alive", user_id=4, file_path=upload),
+        }
+        tasks["gave-up"].recoveries = 2
+        for task in tasks.values():
+            self.store.add(task)
+        for slot in range(3):
+            self.assertIsNotNone(self.store.claim(4, f"host:dead:{slot}"))
+        self.assertEqual(self.store.claim(4, "host:alive:0").task_id, "alive")
+
+        self.store.heartbeat("host:dead")
+        self.store.heartbeat("host:alive")
+        self.store._connection().execute("UPDATE task_workers SET last_seen = 0 WHERE process_id = 'host:dead'")
+
+        requeued, failed = self.store.recover_orphans(stale_after=60, max_recoveries=2)
+        self.assertEqual([task.task_id for task in requeued], ["requeued"])
+        self.assertEqual(sorted(task.task_id for task in failed), ["gave-up", "lost"])
+        self.assertEqual(self.store.get("requeued").status, "queued")
+        self.assertEqual(self.store.get("requeued").recoveries, 1)
+        self.assertIn("lost", self.store.get("lost").error)
+        self.assertIn("giving up", self.store.get("gave-up").error)
+        self.assertEqual(self.store.get("alive").status, "processing")
+        # The dead process' heartbeat is cleaned up, a second pass finds nothing to do
+        self.assertEqual(self.store.recover_orphans(stale_after=60, max_recoveries=2), ([], []))
@@ -0,0 +1,162 @@
+"""
+Trace spans of the conversion pipeline, built from ConversionTask.timeline.
+
+A task's timeline is a list of (stage, unix time) marks. Every mark after the first closes
+the span named in STAGE_SPANS, so a finished task becomes one "conversion" root span with
+a child span per stage: upload, enqueue, queue_wait, convert, output_check, finish, record.
+Spans use the Zipkin v2 JSON model (trace id = task id) and go to a JSON-lines file or to a
+collector that accepts Zipkin (Zipkin, Jaeger, the OpenTelemetry collector).
+"""
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.request
+from datetime import datetime
+
+# The span that ends at each stage mark
+STAGE_SPANS = {
+    "saved": "upload",
+    "enqueued": "enqueue",
+    "started": "queue_wait",
+    "converter_exit": "convert",
+    "output_checked": "output_check",
+    "completed": "finish",
+    "recorded": "record",
+}
+
+
+def _trace_id(task_id):
+    return task_id.replace("-", "")
+
+
+def _span_id(task_id, name):
+    # Derived from the task id rather than random, so the "record" span exported later (and
+    # maybe by another process) still finds its parent
+    if name is None:
+        return _trace_id(task_id)[:16]
+    return hashlib.sha1(f"{task_id}:{name}".encode()).hexdigest()[:16]
+
+
+def _micros(seconds):
+    return int(seconds * 1_000_000)
+
+
+def timeline_payload(timeline):
+    """Timeline for the status API: every mark with the ms since the previous one"""
+    payload = []
+    previous = None
+    for stage, at in timeline:
+        payload.append({
+            "stage": stage,
+            "at": datetime.fromtimestamp(at).isoformat(timespec="milliseconds"),
+            "ms": round((at - previous) * 1000, 1) if previous is not None else None,
+        })
+        previous = at
+    return payload
+
+
+def task_spans(task, service_name):
+    """Root span plus one span per stage of a finished task, "record" excluded (see record_span)"""
+    timeline = [(stage, at) for stage, at in task.timeline if stage != "recorded"]
+    if len(timeline) < 2:
+        return []
+    endpoint = {"serviceName": service_name}
+    trace_id = _trace_id(task.task_id)
+    root_id = _span_id(task.task_id, None)
+    spans = [{
+        "traceId": trace_id,
+        "id": root_id,
+        "name": "conversion",
+        "kind": "SERVER",
+        "timestamp": _micros(timeline[0][1]),
+        "duration": max(1, _micros(timeline[-1][1] - timeline[0][1])),
+        "localEndpoint": endpoint,
+        "tags": {
+            "task.status": task.status,
+            "task.filename": task.original_filename,
+            "task.input_size": str(task.input_size or 0),
+            "task.error": task.error or "",
+        },
+    }]
+    for (_, start), (stage, end) in zip(timeline, timeline[1:]):
+        name = STAGE_SPANS.get(stage, stage)
+        spans.append({
+            "traceId": trace_id,
+            "id": _span_id(task.task_id, name),
+            "parentId": root_id,
+            "name": name,
+            "timestamp": _micros(start),
+            "duration": max(1, _micros(end - start)),
+            "localEndpoint": endpoint,
+        })
+    return spans
+
+
+def record_span(task_id, completed_at, recorded_at, service_name):
+    """The srv_conversions insert, written by the recorder after the task already finished"""
+    return {
+        "traceId": _trace_id(task_id),
+        "id": _span_id(task_id, "record"),
+        "parentId": _span_id(task_id, None),
+        "name": "record",
+        "timestamp": _micros(completed_at),
+        "duration": max(1, _micros(recorded_at - completed_at)),
+        "localEndpoint": {"serviceName": service_name},
+    }
+
+
+class SpanExporter:
+    """
+    Sends spans in the background, in batches, so tracing never slows a conversion down.
+    mode "file" appends one span per line to `target`, "zipkin" POSTs the batch to the
+    collector URL in `target` (e.g. http://localhost:9411/api/v2/spans). Spans that can't
+    be sent are dropped.
+    """
+
+    def __init__(self, mode, target, batch_size=100, flush_interval=5.0, max_pending=10000):
+        self.mode = mode
+        self.target = target
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = queue.Queue(max_pending)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self.thread.start()
+
+    def export(self, spans):
+        for span in spans:
+            try:
+                self.pending.put_nowait(span)
+            except queue.Full:
+                self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and time.monotonic() < deadline:
+                try:
+                    batch.append(self.pending.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self._send(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                logging.error(f"Could not export {len(batch)} trace spans: {e}")
+
+    def _send(self, spans):
+        if self.mode == "file":
+            os.makedirs(os.path.dirname(self.target) or ".", exist_ok=True)
+            with open(self.target, "a", encoding="utf-8") as trace_file:
+                trace_file.write("".join(json.dumps(span) + "\n" for span in spans))
+        elif self.mode == "zipkin":
+            request = urllib.request.Request(
+                self.target, data=json.dumps(spans).encode(), headers={"Content-Type": "application/json"}, method="POST"
+            )
+            with urllib.request.urlopen(request, timeout=10):
+                pass
@@ -0,0 +1,366 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from uuid import uuid4
+
+from django.conf import settings
+
+try:
+    import xxhash  # optional, only used for the fast fingerprint
+except ImportError:
+    xxhash = None
+
+# Size of the userspace write buffer for uploads. Large buffers mean far fewer write
+# syscalls, which matters a lot when BASE_DIR lives on the SMB share.
+UPLOAD_WRITE_BUFFER = int(os.environ.get('UPLOAD_WRITE_BUFFER', 8 * 1024 * 1024))  # 8MB
+# Chunk size requested from Django's UploadedFile.chunks()
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 1024 * 1024))  # 1MB
+# Largest accepted upload, whichever way it arrives: the limit multipart uploads already had
+UPLOAD_MAX_SIZE = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+
+
+class UploadDigest:
+    """
+    Incremental digests of an upload, fed with every chunk as it is written so the
+    file never has to be read back.
+
+    sha256 is the content hash used by the conversion cache, download ETags and integrity
+    checks. fingerprint is a cheap xxh3-64 of the same bytes, only available when the
+    xxhash package is installed.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self._fingerprint = xxhash.xxh3_64() if xxhash else None
+
+    def update(self, chunk):
+        self.size += len(chunk)
+        self._sha256.update(chunk)
+        if self._fingerprint is not None:
+            self._fingerprint.update(chunk)
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+    @property
+    def fingerprint(self):
+        return self._fingerprint.hexdigest() if self._fingerprint is not None else None
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadFinalizing(Exception):
+    """The chunked upload is being finalized, it takes no more chunks"""
+    pass
+
+
+def write_upload(chunks, destination_path, on_progress=None, max_size=None):
+    """
+    Write an iterable of byte chunks to destination_path, hashing them on the way.
+
+    on_progress(bytes_written, chunk_size) is called after every chunk.
+    Returns the UploadDigest, whose size is the number of bytes written. Raises
+    UploadTooLarge as soon as more than max_size bytes arrived.
+    """
+    digest = UploadDigest()
+    with open(destination_path, 'wb', buffering=UPLOAD_WRITE_BUFFER) as destination:
+        for chunk in chunks:
+            if max_size is not None and digest.size + len(chunk) > max_size:
+                raise UploadTooLarge(f"File is larger than {max_size} bytes")
+            destination.write(chunk)
+            digest.update(chunk)
+            if on_progress:
+                on_progress(digest.size, len(chunk))
+    return digest
+
+
+# ------------------- Chunked uploads -------------------
+
+CHUNKED_UPLOAD_CHUNK_SIZE = int(os.environ.get('CHUNKED_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))  # 8MB
+# Unfinished uploads are deleted after this many seconds
+CHUNKED_UPLOAD_TTL = int(os.environ.get('CHUNKED_UPLOAD_TTL', 6 * 3600))
+# Unfinished uploads one client can have open at once
+CHUNKED_UPLOAD_MAX_SESSIONS = int(os.environ.get('CHUNKED_UPLOAD_MAX_SESSIONS', 3))
+# How long finalize waits for chunks that are still being written before answering 409
+CHUNKED_UPLOAD_FINALIZE_WAIT = float(os.environ.get('CHUNKED_UPLOAD_FINALIZE_WAIT', 30))
+# A chunk write refreshes its in-flight marker this often, one untouched for
+# CHUNK_WRITE_STALE_SECONDS belongs to a worker that died mid-chunk
+CHUNK_WRITE_HEARTBEAT = 5
+CHUNK_WRITE_STALE_SECONDS = 60
+# Proxies (comma separated addresses) whose X-Forwarded-For is believed when counting a
+# client's sessions. Empty means the header is ignored and the peer address is the client.
+TRUSTED_PROXIES = {address.strip() for address in os.environ.get('TRUSTED_PROXIES', '').split(',') if address.strip()}
+
+
+def upload_client(peer_addr, forwarded_for=None, trusted_proxies=TRUSTED_PROXIES):
+    """
+    The address the per-client session limit is keyed on. X-Forwarded-For is only read when
+    the request came through a trusted proxy, and then from the right: the first address
+    that isn't one of our proxies is the client, anything left of it is client-supplied.
+    """
+    client = peer_addr
+    if forwarded_for and peer_addr in trusted_proxies:
+        for address in reversed([address.strip() for address in forwarded_for.split(',')]):
+            if not address:
+                continue
+            client = address
+            if address not in trusted_proxies:
+                break
+    return client
+
+
+class ChunkedUpload:
+    """
+    A resumable upload received in fixed-size chunks, in any order and by any worker process.
+
+    Each chunk is written straight to its final offset of data_path. Nothing is preallocated,
+    the declared size only costs disk space as chunks actually arrive.
+    The session lives in sessions_dir/<upload_id>/: meta.json plus one marker file per
+    verified chunk, named after the chunk index and holding its SHA-256, so status is
+    simply the list of markers and no process has to own the session.
+
+    Finalizing is guarded the same way: every chunk write holds a marker in writing/ for as
+    long as it runs, and finalize creates the `finalizing` flag and then waits for those
+    markers to go. A write checks the flag only after its marker exists, so either the write
+    sees the flag and refuses, or finalize sees the write and waits for it.
+    """
+
+    def __init__(self, session_dir, meta):
+        self.session_dir = session_dir
+        self.meta = meta
+
+    @classmethod
+    def create(cls, sessions_dir, upload_id, data_path, filename, size, client=None, chunk_size=CHUNKED_UPLOAD_CHUNK_SIZE):
+        if size > UPLOAD_MAX_SIZE:
+            raise UploadTooLarge(f"File is larger than {UPLOAD_MAX_SIZE} bytes")
+        session_dir = os.path.join(sessions_dir, upload_id)
+        os.makedirs(os.path.join(session_dir, "chunks"))
+        os.makedirs(os.path.join(session_dir, "writing"))
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        open(data_path, 'wb').close()
+        meta = {
+            "upload_id": upload_id,
+            "filename": filename,
+            "size": size,
+            "chunk_size": chunk_size,
+            "data_path": data_path,
+            "client": client,
+            "created_at": time.time(),
+        }
+        with open(os.path.join(session_dir, "meta.json"), 'w', encoding='utf-8') as meta_file:
+            json.dump(meta, meta_file)
+        return cls(session_dir, meta)
+
+    @classmethod
+    def load(cls, sessions_dir, upload_id):
+        """Return the session, or None if it doesn't exist (never created, finalized or expired)"""
+        if not upload_id.isalnum():
+            return None
+        session_dir = os.path.join(sessions_dir, upload_id)
+        try:
+            with open(os.path.join(session_dir, "meta.json"), encoding='utf-8') as meta_file:
+                return cls(session_dir, json.load(meta_file))
+        except (OSError, ValueError):
+            return None
+
+    @property
+    def upload_id(self):
+        return self.meta["upload_id"]
+
+    @property
+    def size(self):
+        return self.meta["size"]
+
+    @property
+    def chunk_size(self):
+        return self.meta["chunk_size"]
+
+    @property
+    def data_path(self):
+        return self.meta["data_path"]
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_length(self, index):
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def received(self):
+        try:
+            return sorted(int(name) for name in os.listdir(os.path.join(self.session_dir, "chunks")) if name.isdigit())
+        except FileNotFoundError:
+            return []
+
+    def missing(self):
+        received = set(self.received())
+        return [index for index in range(self.chunk_count) if index not in received]
+
+    def write_chunk(self, index, pieces, expected_sha256=None):
+        """
+        Write chunk `index` from an iterable of byte strings at its offset in data_path.
+        Raises ValueError (and records nothing) if the length or checksum doesn't match,
+        the client just sends the chunk again. Raises UploadFinalizing once finalize started.
+        """
+        if not 0 <= index < self.chunk_count:
+            raise ValueError(f"Chunk {index} is out of range (0-{self.chunk_count - 1})")
+        writing_path = os.path.join(self.session_dir, "writing", f"{index}.{uuid4().hex}")
+        # FileNotFoundError here means the session is gone (finalized or expired)
+        open(writing_path, 'w').close()
+        try:
+            if self.finalizing():
+                raise UploadFinalizing(f"Upload {self.upload_id} is being finalized")
+            return self._write_chunk(index, pieces, expected_sha256, writing_path)
+        finally:
+            try:
+                os.remove(writing_path)
+            except FileNotFoundError:
+                pass
+
+    def _write_chunk(self, index, pieces, expected_sha256, writing_path):
+        expected_length = self.chunk_length(index)
+        marker_path = os.path.join(self.session_dir, "chunks", str(index))
+        # A re-sent chunk overwrites the old bytes, it only counts again once it verifies
+        try:
+            os.remove(marker_path)
+        except FileNotFoundError:
+            pass
+
+        sha256 = hashlib.sha256()
+        written = 0
+        touched = time.monotonic()
+        with open(self.data_path, 'r+b', buffering=UPLOAD_WRITE_BUFFER) as data:
+            data.seek(index * self.chunk_size)
+            for piece in pieces:
+                written += len(piece)
+                if written > expected_length:
+                    raise ValueError(f"Chunk {index} is larger than {expected_length} bytes")
+                data.write(piece)
+                sha256.update(piece)
+                if time.monotonic() - touched > CHUNK_WRITE_HEARTBEAT:
+                    os.utime(writing_path)
+                    touched = time.monotonic()
+        if written != expected_length:
+            raise ValueError(f"Chunk {index} has {written} bytes, expected {expected_length}")
+        if expected_sha256 and sha256.hexdigest() != expected_sha256.lower():
+            raise ValueError(f"Chunk {index} checksum mismatch")
+
+        with open(f"{marker_path}.{os.getpid()}.tmp", 'w', encoding='utf-8') as marker:
+            marker.write(sha256.hexdigest())
+        os.replace(f"{marker_path}.{os.getpid()}.tmp", marker_path)
+        return sha256.hexdigest()
+
+    def finalizing(self):
+        return os.path.exists(os.path.join(self.session_dir, "finalizing"))
+
+    def writes_in_flight(self):
+        """Chunk writes still running, markers of dead workers are ignored"""
+        writing_dir = os.path.join(self.session_dir, "writing")
+        try:
+            names = os.listdir(writing_dir)
+        except FileNotFoundError:
+            return 0
+        count = 0
+        for name in names:
+            try:
+                if time.time() - os.path.getmtime(os.path.join(writing_dir, name)) < CHUNK_WRITE_STALE_SECONDS:
+                    count += 1
+            except FileNotFoundError:
+                pass
+        return count
+
+    def begin_finalize(self, timeout=CHUNKED_UPLOAD_FINALIZE_WAIT):
+        """
+        Stop taking chunks and wait for the ones being written. Raises UploadFinalizing if
+        another finalize already started or the writes didn't finish within timeout, in which
+        case the upload keeps taking chunks.
+        """
+        try:
+            os.close(os.open(os.path.join(self.session_dir, "finalizing"), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            raise UploadFinalizing(f"Upload {self.upload_id} is already being finalized")
+        deadline = time.monotonic() + timeout
+        while self.writes_in_flight():
+            if time.monotonic() > deadline:
+                self.cancel_finalize()
+                raise UploadFinalizing(f"Chunks of upload {self.upload_id} are still being written")
+            time.sleep(0.05)
+
+    def cancel_finalize(self):
+        try:
+            os.remove(os.path.join(self.session_dir, "finalizing"))
+        except FileNotFoundError:
+            pass
+
+    def digest(self, path=None):
+        """
+        Hash the assembled file (at path once it was moved). Chunks can arrive in any order,
+        so unlike write_upload the digest needs one sequential read of the file.
+        """
+        digest = UploadDigest()
+        with open(path or self.data_path, 'rb') as data:
+            while True:
+                block = data.read(UPLOAD_WRITE_BUFFER)
+                if not block:
+                    break
+                digest.update(block)
+        return digest
+
+    def status(self):
+        received = self.received()
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.meta["filename"],
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "chunk_count": self.chunk_count,
+            "received_chunks": received,
+            "missing_chunks": self.missing(),
+            "bytes_received": sum(self.chunk_length(index) for index in received),
+            "finalizing": self.finalizing(),
+        }
+
+    def discard_session(self):
+        shutil.rmtree(self.session_dir, ignore_errors=True)
+
+
+def count_chunked_uploads(sessions_dir, client):
+    """Unfinished uploads started by `client`"""
+    try:
+        upload_ids = os.listdir(sessions_dir)
+    except FileNotFoundError:
+        return 0
+    count = 0
+    for upload_id in upload_ids:
+        upload = ChunkedUpload.load(sessions_dir, upload_id)
+        if upload is not None and upload.meta.get("client") == client:
+            count += 1
+    return count
+
+
+def prune_chunked_uploads(sessions_dir, ttl=CHUNKED_UPLOAD_TTL):
+    """Delete sessions (and their partial files) older than ttl seconds, returns how many"""
+    pruned = 0
+    try:
+        upload_ids = os.listdir(sessions_dir)
+    except FileNotFoundError:
+        return 0
+    for upload_id in upload_ids:
+        upload = ChunkedUpload.load(sessions_dir, upload_id)
+        if upload is None:
+            session_dir = os.path.join(sessions_dir, upload_id)
+            # Half-created session, give create() a moment before removing it
+            if os.path.isdir(session_dir) and time.time() - os.path.getmtime(session_dir) > ttl:
+                shutil.rmtree(session_dir, ignore_errors=True)
+            continue
+        if time.time() - upload.meta["created_at"] > ttl:
+            shutil.rmtree(os.path.dirname(upload.data_path), ignore_errors=True)
+            upload.discard_session()
+            pruned += 1
+    return pruned
@@ -1,9 +1,21 @@
 from django.urls import path
-from converter_app.views import ConvertFileView, TaskStatusView, QueueStatusView, DownloadFileView
+from converter_app.views import ConvertFileView, TaskStatusView, QueueStatusView, CacheStatusView, StorageStatusView, DatabasePoolStatusView, EtaStatusView, DownloadFileView, task_events, queue_events, metrics
+from converter_app.views import StreamUploadView, ChunkedUploadView, ChunkedUploadChunkView, ChunkedUploadFinalizeView
 
 urlpatterns = [
     path('convert', ConvertFileView.as_view(), name='convert'),
+    path('convert/stream', StreamUploadView.as_view(), name='convert_stream'),
+    path('upload/', ChunkedUploadView.as_view(), name='chunked_upload'),
+    path('upload/<str:upload_id>/', ChunkedUploadChunkView.as_view(), name='chunked_upload_chunk'),
+    path('upload/<str:upload_id>/finalize/', ChunkedUploadFinalizeView.as_view(), name='chunked_upload_finalize'),
     path('task/<str:task_id>/', TaskStatusView.as_view(), name='task_status'),
+    path('task/<str:task_id>/events/', task_events, name='task_events'),
     path('queue-status/', QueueStatusView.as_view(), name='queue_status'),
+    path('queue-status/events/', queue_events, name='queue_events'),
+    path('cache-status/', CacheStatusView.as_view(), name='cache_status'),
+    path('storage-status/', StorageStatusView.as_view(), name='storage_status'),
+    path('eta-status/', EtaStatusView.as_view(), name='eta_status'),
+    path('db-pool-status/', DatabasePoolStatusView.as_view(), name='db_pool_status'),
+    path('metrics', metrics, name='metrics'),
     path('download/<str:file_hash>/<str:filename>/', DownloadFileView.as_view(), name='download_file'),
 ]
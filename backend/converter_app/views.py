@@ -2,84 +2,65 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework import status
-from django.http import FileResponse, JsonResponse,StreamingHttpResponse
+from django.http import HttpResponse, JsonResponse,StreamingHttpResponse
+from asgiref.sync import sync_to_async
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+from django.core.handlers.asgi import ASGIRequest
 from django.conf import settings
 from django.shortcuts import get_object_or_404
 import aiofiles
-import psycopg2
 from functools import wraps
 import jwt
 from datetime import datetime,timedelta
 
 import os
+import asyncio
+import json
 import shutil
 import subprocess
+import shlex
 import hashlib
 import threading
 import logging
-import socket
-from collections import deque
 from uuid import uuid4
 from datetime import datetime
 import time
-import sys
 from pathlib import Path
 
-# ------------------- Logging -------------------
-LOG_FILE = "conversion.log"
-
-# File handler with UTF-8 encoding
-file_handler = logging.FileHandler(LOG_FILE, encoding='utf-8')
-
-# Stream handler (console)
-stream_handler = logging.StreamHandler(sys.stdout)
-# Optional: ensure the stream uses UTF-8 if supported (Python 3.7+)
-if hasattr(stream_handler.stream, 'reconfigure'):
-    stream_handler.stream.reconfigure(encoding='utf-8')
-
-# Define formatter
-formatter = logging.Formatter('[%(asctime)s] %(levelname)s - %(message)s')
-
-# Apply formatter
-file_handler.setFormatter(formatter)
-stream_handler.setFormatter(formatter)
-
-logging.basicConfig(
-    level=logging.INFO,
-    handlers=[file_handler, stream_handler],
-    force=True
+from storefront.db import db_pool, get_db_connection
+from converter_app.conversion_cache import ConversionCache
+from converter_app.converter_backends import create_converter_backend
+from converter_app.converter_pool import PooledConverterBackend, default_worker_command
+from converter_app.downloads import serve_file
+from converter_app.eta import ConversionTimeModel, estimate_payload
+from converter_app.metrics import (
+    CONVERSION_DURATION, UPLOAD_BYTES, UPLOAD_THROUGHPUT,
+    MetricsPublisher, registry, observe_transfer, render,
+)
+from converter_app.preflight import InvalidModArchive, inspect_mod_archive
+from converter_app.janitor import StorageJanitor
+from converter_app.recorder import ConversionRecorder
+from converter_app.scheduler import create_scheduler
+from converter_app.storage import NetworkDriveMonitor, link_or_copy, resolve_task_dir, task_dir
+from converter_app.task_queue import TaskQueue
+from converter_app.task_store import ConversionTask, create_task_store
+from converter_app.tracing import SpanExporter, record_span, task_spans, timeline_payload
+from converter_app.uploads import (
+    CHUNKED_UPLOAD_MAX_SESSIONS, UPLOAD_CHUNK_SIZE, UPLOAD_MAX_SIZE, ChunkedUpload, UploadFinalizing, UploadTooLarge,
+    count_chunked_uploads, prune_chunked_uploads, upload_client, write_upload,
 )
 
+# Logging is set up by settings.LOGGING (storefront/log_pipeline.py), never blocks on the log file
 
-#-------------------- Authentiaction ----------------
 
-# Database connection settings
-DB_HOST = '192.168.15.168'
-DB_NAME = 'xiv-dt-updater'
-DB_USER = 'postgres'
-DB_PASSWORD = 'postgres'
+#-------------------- Authentiaction ----------------
 
 # JWT settings
 JWT_SECRET = os.environ.get('JWT_SECRET', 'lmao1234')  # Better to use environment variable
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_DELTA = timedelta(days=90)  # Token valid for 1 day
 
-def get_db_connection():
-    """Establish a connection to the PostgreSQL database"""
-    try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        return conn
-    except psycopg2.Error as e:
-        print(f"Database connection error: {e}")
-        return None
-
 def token_required(f):
     """Decorator for views that require token authentication"""
     @wraps(f)
@@ -112,20 +93,120 @@ def token_required(f):
 BASE_DIR = os.path.join(settings.BASE_DIR, "converted")
 os.makedirs(BASE_DIR, exist_ok=True)
 
+# Number of ConsoleTools conversions allowed to run at the same time
+CONVERSION_WORKERS = int(os.environ.get('CONVERSION_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+# Scratch directories for the conversion slots (one sub-folder per slot)
+WORK_DIR = os.path.join(settings.BASE_DIR, "work")
+
+# Where task state lives: "sqlite" (shared by all worker processes on the host, survives restarts)
+# or "memory" (per process, lost on restart)
+TASK_STORE_BACKEND = os.environ.get('TASK_STORE_BACKEND', 'sqlite')
+TASK_STORE_PATH = os.environ.get('TASK_STORE_PATH', os.path.join(settings.BASE_DIR, "tasks.sqlite3"))
+# How often idle workers re-check a shared store for tasks queued by other processes
+SHARED_STORE_POLL_INTERVAL = float(os.environ.get('SHARED_STORE_POLL_INTERVAL', 1))
+# Finished tasks are kept in the store for this long / up to this many, then only srv_conversions has them
+TASK_HISTORY_TTL = int(os.environ.get('TASK_HISTORY_TTL', 6 * 3600))
+TASK_HISTORY_MAX_ENTRIES = int(os.environ.get('TASK_HISTORY_MAX_ENTRIES', 10000))
+# Worker processes heartbeat into the shared store; tasks of a process silent for TASK_ORPHAN_TIMEOUT
+# seconds (killed, recycled by max_requests) are re-queued, at most TASK_MAX_RECOVERIES times
+TASK_HEARTBEAT_INTERVAL = float(os.environ.get('TASK_HEARTBEAT_INTERVAL', 10))
+TASK_ORPHAN_TIMEOUT = float(os.environ.get('TASK_ORPHAN_TIMEOUT', 60))
+TASK_MAX_RECOVERIES = int(os.environ.get('TASK_MAX_RECOVERIES', 3))
+# Order queued tasks are converted in: "fair" (round-robin per user/IP, small files first) or "fifo"
+TASK_SCHEDULER = os.environ.get('TASK_SCHEDULER', 'fair')
+SCHEDULER_SHORTEST_FIRST = os.environ.get('SCHEDULER_SHORTEST_FIRST', 'true').lower() == 'true'
+# Logged-in users' tasks go before anonymous ones
+SCHEDULER_PRIORITY_AUTHENTICATED = os.environ.get('SCHEDULER_PRIORITY_AUTHENTICATED', 'false').lower() == 'true'
+# Tasks waiting longer than this jump the fair-share order, so nothing starves
+SCHEDULER_MAX_WAIT = int(os.environ.get('SCHEDULER_MAX_WAIT', 15 * 60))
+# Queue ETAs: conversion time is learned per extension from finished tasks; until there is
+# data, a conversion is assumed to take ETA_DEFAULT_SECONDS
+ETA_DEFAULT_SECONDS = float(os.environ.get('ETA_DEFAULT_SECONDS', 60))
+# Weight kept by older observations at every new one, lower adapts faster
+ETA_DECAY = float(os.environ.get('ETA_DECAY', 0.98))
+# srv_conversions rows the model is seeded with at startup (0 starts from scratch)
+ETA_HISTORY_ROWS = int(os.environ.get('ETA_HISTORY_ROWS', 2000))
+
+# "consoletools" runs TexTools' ConsoleTools.exe, "simulated" fakes conversions for load tests
+CONVERTER_BACKEND = os.environ.get('CONVERTER_BACKEND', 'consoletools')
+#CONSOLETOOLS_PATH = 'C:\\Program Files\\FFXIV TexTools\\FFXIV_TexTools\\ConsoleTools.exe'
+CONSOLETOOLS_PATH = os.environ.get('CONSOLETOOLS_PATH', 'C:\\Users\\Administrator\\Downloads\\FFXIV_TexTools_v3.0.9.5\\ConsoleTools.exe')
+# Bump when ConsoleTools is upgraded so outputs of the old version aren't served from the cache
+CONVERTER_VERSION = os.environ.get('CONVERTER_VERSION', '3.0.9.5')
+CONVERSION_TIMEOUT = int(os.environ.get('CONVERSION_TIMEOUT', 3600))  # 1 hour
+# Warm converter worker processes kept alive between tasks (0 spawns the converter for every task).
+# Simulated backend only: ConsoleTools has no persistent mode, so with it the pool needs a
+# CONVERTER_WORKER_COMMAND that keeps TexTools loaded and is ignored otherwise
+CONVERTER_POOL_SIZE = int(os.environ.get('CONVERTER_POOL_SIZE', 0))
+CONVERTER_POOL_MAX_TASKS = int(os.environ.get('CONVERTER_POOL_MAX_TASKS', 200))
+CONVERTER_POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get('CONVERTER_POOL_HEALTH_CHECK_INTERVAL', 30))
+# Replacement worker program speaking the converter_pool protocol, defaults to the built-in Python worker
+CONVERTER_WORKER_COMMAND = os.environ.get('CONVERTER_WORKER_COMMAND', '')
+CONVERSION_CACHE_PATH = os.environ.get('CONVERSION_CACHE_PATH', os.path.join(settings.BASE_DIR, "conversion_cache.sqlite3"))
+CONVERSION_CACHE_MAX_BYTES = int(os.environ.get('CONVERSION_CACHE_MAX_BYTES', 100 * 1024 ** 3))  # 100GB
+
+# Background cleanup of BASE_DIR, 0 disables a policy
+STORAGE_JANITOR_INTERVAL = float(os.environ.get('STORAGE_JANITOR_INTERVAL', 600))
+STORAGE_MAX_AGE = float(os.environ.get('STORAGE_MAX_AGE', 30 * 86400))  # outputs older than 30 days
+STORAGE_MAX_IDLE = float(os.environ.get('STORAGE_MAX_IDLE', 7 * 86400))  # outputs not downloaded for 7 days
+# Task directories nothing owns (failed conversions, abandoned uploads); keep above CHUNKED_UPLOAD_TTL
+STORAGE_ORPHAN_AGE = float(os.environ.get('STORAGE_ORPHAN_AGE', 2 * 86400))
+# Full walk of BASE_DIR for directories the index doesn't know about: outputs are adopted into the
+# cache index, upload leftovers removed (also: manage.py reconcile_storage)
+STORAGE_RECONCILE_INTERVAL = float(os.environ.get('STORAGE_RECONCILE_INTERVAL', 7 * 86400))
+# Remove the uploaded mod once its conversion succeeded, only the output is ever downloaded
+DELETE_INPUTS_AFTER_CONVERSION = os.environ.get('DELETE_INPUTS_AFTER_CONVERSION', 'false').lower() == 'true'
+
+# srv_conversions rows are written in batches by a background thread; rows that can't be
+# written are spooled to disk and retried
+RECORDER_SPOOL_DIR = os.environ.get('RECORDER_SPOOL_DIR', os.path.join(settings.BASE_DIR, "spool"))
+RECORDER_BATCH_SIZE = int(os.environ.get('RECORDER_BATCH_SIZE', 100))
+RECORDER_FLUSH_INTERVAL = float(os.environ.get('RECORDER_FLUSH_INTERVAL', 2))
+RECORDER_RETRY_INTERVAL = float(os.environ.get('RECORDER_RETRY_INTERVAL', 30))
+
+# Counters and histograms of every worker process are merged through this file for /metrics
+METRICS_PATH = os.environ.get('METRICS_PATH', os.path.join(settings.BASE_DIR, "metrics.sqlite3"))
+METRICS_PUBLISH_INTERVAL = float(os.environ.get('METRICS_PUBLISH_INTERVAL', 10))
+# When set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Stage spans of every conversion (upload, queue wait, convert, record...): "" keeps them on the
+# task only, "file" appends Zipkin JSON spans to TRACE_FILE, "zipkin" posts them to TRACE_ZIPKIN_URL
+# (Zipkin, Jaeger or an OpenTelemetry collector with the zipkin receiver)
+TRACE_EXPORT = os.environ.get('TRACE_EXPORT', '')
+TRACE_FILE = os.environ.get('TRACE_FILE', os.path.join(settings.BASE_DIR, "traces", "spans.jsonl"))
+TRACE_ZIPKIN_URL = os.environ.get('TRACE_ZIPKIN_URL', 'http://localhost:9411/api/v2/spans')
+TRACE_SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'xiv-dt-converter')
+# Comma separated user ids that see the stage timeline in the task status
+ADMIN_USER_IDS = {user_id.strip() for user_id in os.environ.get('ADMIN_USER_IDS', '').split(',') if user_id.strip()}
+
+# Sessions of resumable (chunked) uploads, the data itself goes straight to BASE_DIR
+CHUNKED_UPLOAD_SESSIONS_DIR = os.environ.get('CHUNKED_UPLOAD_SESSIONS_DIR', os.path.join(settings.BASE_DIR, "uploads"))
+
+VALID_EXTENSIONS = ['.ttmp2', '.pmp', '.ttmp']
+# Read the archive's central directory and manifest before queueing, broken uploads are rejected right away
+MOD_PREFLIGHT = os.environ.get('MOD_PREFLIGHT', 'true').lower() == 'true'
+
 SHARE_NAME = "T"
 SHARE_PATH = r"\\192.168.15.88\file_share\textoolsStuff"
-
+# The share is a Windows drive mapping, elsewhere the monitor is off unless asked for
+NETWORK_DRIVE_MONITOR = os.environ.get('NETWORK_DRIVE_MONITOR', 'true' if os.name == 'nt' else 'false').lower() == 'true'
+NETWORK_DRIVE_CHECK_INTERVAL = float(os.environ.get('NETWORK_DRIVE_CHECK_INTERVAL', 60))
+NETWORK_DRIVE_MAX_BACKOFF = float(os.environ.get('NETWORK_DRIVE_MAX_BACKOFF', 900))
 
 
 def ensure_network_drive():
-    try:
-        if not os.path.exists(f"{SHARE_NAME}:\\"):
-            subprocess.run([
-                "powershell",
-                f"New-PSDrive -Name '{SHARE_NAME}' -PSProvider FileSystem -Root '{SHARE_PATH}' -Persist"
-            ], shell=True)
-    except Exception as e:
-        logging.error(f"Drive mount failed: {e}")
+    """
+    Whether the share is mounted, from the monitor's last check. Never blocks: mounting
+    happens on the monitor thread, an upload doesn't wait for it.
+    """
+    if not NETWORK_DRIVE_MONITOR:
+        return True
+    drive_status = network_drive.status()
+    if drive_status["mounted"] is False:
+        logging.warning(f"Network drive {network_drive.drive} is not mounted: {drive_status['last_error']}")
+        return False
+    return True
 
 def file_hash(file_path):
     h = hashlib.sha256()
@@ -136,205 +217,322 @@ def file_hash(file_path):
             chunk = file.read(4096)
     return h.hexdigest()
 
-class ConversionTask:
-    def __init__(self, task_id, file_path, output_path, original_filename, client_ip, user_id=None):
-        self.task_id = task_id
-        self.file_path = file_path
-        self.output_path = output_path
-        self.original_filename = original_filename
-        self.client_ip = client_ip
-        self.user_id = user_id  # New field to track user_id (if authenticated)
-        self.status = "queued"
-        self.result = None
-        self.error = None
-        self.created_at = datetime.now()
-        self.completed_at = None
-
-class TaskQueue:
-    def __init__(self):
-        self.queue = deque()
-        self.current_task = None
-        self.task_history = {}
-        self.lock = threading.Lock()
-        self.worker_thread = threading.Thread(target=self._worker, daemon=True)
-        self.worker_thread.start()
-
-    def add_task(self, task):
-        with self.lock:
-            self.queue.append(task)
-            self.task_history[task.task_id] = task
-            logging.info(f"Task {task.task_id} added to queue. Queue size: {len(self.queue)}")
-        return task.task_id
-
-    def get_task(self, task_id):
-        return self.task_history.get(task_id)
-
-    def get_queue_status(self):
-        with self.lock:
-            return {
-                "queue_size": len(self.queue)+(1 if self.current_task is not None else 0),
-                "current_task": self.current_task.task_id if self.current_task else None,
-                "queued_tasks": [t.task_id for t in self.queue]
-            }
-
-    def _worker(self):
-        while True:
-            task = None
-            with self.lock:
-                if self.queue and self.current_task is None:
-                    task = self.queue.popleft()
-                    self.current_task = task
-                    logging.info(f"Task {task.task_id} acquired...")
-
-            if task:
-                try:
-                    task.status = "processing"
-                    logging.info(f"[{task.client_ip}] Processing task {task.task_id}")
-                    
-                    # Verify input file exists and is readable
-                    if not os.path.exists(task.file_path):
-                        logging.error(f"Input file does not exist: {task.file_path}")
-                        task.status = "failed"
-                        task.error = "Input file does not exist"
-                        continue
-                    
-                    logging.info(f"Input file exists, size: {os.path.getsize(task.file_path)} bytes")
-                    
-                    # Make sure output directory exists
-                    os.makedirs(os.path.dirname(task.output_path), exist_ok=True)
-                    
-                    # Check if ConsoleTools.exe exists
-                    #tools_path = 'C:\\Program Files\\FFXIV TexTools\\FFXIV_TexTools\\ConsoleTools.exe'
-                    tools_path = 'C:\\Users\\Administrator\\Downloads\\FFXIV_TexTools_v3.0.9.5\\ConsoleTools.exe'
-
-                    if not os.path.exists(tools_path):
-                        logging.error(f"ConsoleTools.exe not found at: {tools_path}")
-                        task.status = "failed"
-                        task.error = "Conversion tool not found"
-                        continue
-                    
-                    logging.info(f"Running conversion tool with arguments: /upgrade {task.file_path} {task.output_path}")
-                    
-                    # Run the conversion process
-                    result = subprocess.run(
-                        [tools_path, '/upgrade', task.file_path, task.output_path],
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        text=True,
-                        cwd=os.path.dirname(tools_path),  # CD into ConsoleTools.exe's folder
-                        timeout=3600
-                    )
+def export_task_trace(task):
+    """Hand the stage spans of a finished task to the exporter, the "record" span follows later"""
+    if span_exporter:
+        span_exporter.export(task_spans(task, TRACE_SERVICE_NAME))
 
-                    if result.returncode != 0:
-                        logging.error(f"Conversion failed with return code {result.returncode}")
-                        logging.error(f"STDOUT: {result.stdout}")
-                        logging.error(f"STDERR: {result.stderr}")
-                        task.status = "failed"
-                        task.error = result.stderr.strip() or "This mod can't be converted."
-                    else:
-                        logging.info(f"Conversion completed successfully")
-                        
-                        # Verify output file exists
-                        if os.path.exists(task.output_path):
-                            file_size = os.path.getsize(task.output_path)
-                            logging.info(f"Output file created: {task.output_path}, size: {file_size} bytes")
-                            task.status = "completed"
-                            
-                            # Generate download link
-                            file_hash_value = os.path.dirname(task.output_path).split(os.path.sep)[-1]
-                            filename = os.path.basename(task.output_path)
-                            download_link = f"https://dl.meikoneko.space/download/{file_hash_value}/{filename}"
-                            
-                            # Record conversion in database
-                            try:
-                                conn = get_db_connection()
-                                if conn:
-                                    with conn.cursor() as cur:
-                                        cur.execute(
-                                            """
-                                            INSERT INTO srv_conversions 
-                                            (cnv_file, cnv_status, cnv_created_at, cnv_completed_at, cnv_task_id, 
-                                            usr_id, cnv_filesize, cnv_download_link) 
-                                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                                            """,
-                                            (
-                                                filename, 
-                                                task.status, 
-                                                task.created_at, 
-                                                datetime.now(), 
-                                                task.task_id,
-                                                task.user_id if hasattr(task, 'user_id') else None,  # Use user_id if available
-                                                file_size,
-                                                download_link
-                                            )
-                                        )
-                                        conn.commit()
-                                        logging.info(f"Conversion record added to database for task {task.task_id}")
-                                    conn.close()
-                                else:
-                                    logging.error("Failed to connect to database to record conversion")
-                            except Exception as db_error:
-                                logging.error(f"Database error when recording conversion: {str(db_error)}")
-                        else:
-                            logging.error(f"Output file was not created: {task.output_path}")
-                            task.status = "failed"
-                            task.error = "Conversion process did not create output file"
-
-                except subprocess.TimeoutExpired:
-                    logging.error(f"Conversion process timed out after 1 hour")
-                    task.status = "failed"
-                    task.error = "Conversion process timed out"
-                except Exception as e:
-                    logging.exception(f"Error processing task {task.task_id}: {str(e)}")
+def conversions_recorded(rows):
+    """
+    ConversionRecorder callback: the srv_conversions rows are in, close the "record" stage.
+
+    The row is written while (or after) the worker stores the finished task, so the mark is
+    best-effort: it is only saved on a task the worker is done with, and with the SQLite
+    store it can still be lost to the worker's final update. The exported span always goes out.
+    """
+    recorded_at = time.time()
+    task_queue.store.mark_recorded(row["cnv_task_id"] for row in rows if row.get("cnv_task_id"))
+    for row in rows:
+        task_id, completed_at = row.get("cnv_task_id"), row.get("cnv_completed_at")
+        if not task_id or not completed_at:
+            continue
+        if span_exporter:
+            span_exporter.export([record_span(task_id, completed_at.timestamp(), recorded_at, TRACE_SERVICE_NAME)])
+        task = task_queue.get_task(task_id)
+        if task and task.status in ("completed", "failed"):
+            task.mark("recorded", recorded_at)
+            task_queue.store.update(task)
+
+def conversion_dead_lettered(row):
+    """ConversionRecorder callback: the row will never be written, don't keep its task around for it"""
+    if row.get("cnv_task_id"):
+        task_queue.store.mark_recorded([row["cnv_task_id"]])
+
+def build_download_link(output_path):
+    file_hash_value = os.path.dirname(output_path).split(os.path.sep)[-1]
+    filename = os.path.basename(output_path)
+    return f"https://dl.meikoneko.space/download/{file_hash_value}/{filename}"
+
+def record_conversion(task):
+    """Queue a finished conversion (completed or failed) for srv_conversions, written in batches"""
+    row = {
+        "cnv_file": os.path.basename(task.output_path),
+        "cnv_status": task.status,
+        "cnv_created_at": task.created_at,
+        "cnv_completed_at": task.completed_at,
+        "cnv_task_id": task.task_id,
+        "usr_id": task.user_id,
+    }
+    if task.status == "completed":
+        row["cnv_filesize"] = os.path.getsize(task.output_path)
+        row["cnv_download_link"] = build_download_link(task.output_path)
+    conversion_recorder.record(row)
+
+class ConversionQueue(TaskQueue):
+    """TaskQueue running the conversions with the configured converter backend"""
+
+    def _recovery_failed(self, task):
+        record_conversion(task)
+
+    def _process_task(self, task, work_dir):
+        self._run_conversion(task, work_dir)
+
+        task.completed_at = datetime.now()
+        task.mark("completed", task.completed_at.timestamp())
+        logging.info(f"Task {task.task_id} completed with status: {task.status}")
+        eta_model.observe_task(task)
+        if task.started_at:
+            CONVERSION_DURATION.observe((task.completed_at - task.started_at).total_seconds(), status=task.status)
+
+        if task.status == "completed" and DELETE_INPUTS_AFTER_CONVERSION and task.file_path:
+            try:
+                os.remove(task.file_path)
+                task.file_path = None
+            except OSError as e:
+                logging.warning(f"Could not delete the input of task {task.task_id}: {e}")
+
+        if task.status == "completed" and task.content_hash:
+            try:
+                if not conversion_cache.store(task.content_hash, converter.version, task.output_path):
+                    logging.info(f"Task {task.task_id} duplicates an output that was cached meanwhile, keeping the cached one")
+            except Exception as e:
+                logging.error(f"Could not add task {task.task_id} to the conversion cache: {e}")
+
+        record_conversion(task)
+        export_task_trace(task)
+
+    def _run_conversion(self, task, work_dir):
+        try:
+            task.status = "processing"
+            logging.info(f"[{task.client_ip}] Processing task {task.task_id}")
+            
+            # Verify input file exists and is readable
+            if not os.path.exists(task.file_path):
+                logging.error(f"Input file does not exist: {task.file_path}")
+                task.status = "failed"
+                task.error = "Input file does not exist"
+                return
+            
+            logging.info(f"Input file exists, size: {os.path.getsize(task.file_path)} bytes")
+            
+            # Make sure output directory exists
+            os.makedirs(os.path.dirname(task.output_path), exist_ok=True)
+            
+            unavailable_reason = converter.unavailable_reason()
+            if unavailable_reason:
+                task.status = "failed"
+                task.error = unavailable_reason
+                return
+
+            # Run the conversion process
+            result = converter.convert(task.file_path, task.output_path, work_dir, CONVERSION_TIMEOUT)
+            task.mark("converter_exit")
+
+            if result.returncode != 0:
+                logging.error(f"Conversion failed with return code {result.returncode}")
+                logging.error(f"STDOUT: {result.stdout}")
+                logging.error(f"STDERR: {result.stderr}")
+                task.status = "failed"
+                task.error = result.stderr.strip() or "This mod can't be converted."
+            else:
+                logging.info(f"Conversion completed successfully")
+                
+                # Verify output file exists
+                if os.path.exists(task.output_path):
+                    file_size = os.path.getsize(task.output_path)
+                    logging.info(f"Output file created: {task.output_path}, size: {file_size} bytes")
+                    task.status = "completed"
+
+                else:
+                    logging.error(f"Output file was not created: {task.output_path}")
                     task.status = "failed"
-                    task.error = str(e)
-
-                task.completed_at = datetime.now()
-                logging.info(f"Task {task.task_id} completed with status: {task.status}")
-
-                # Record failed conversions in database
-                if task.status == "failed":
-                    try:
-                        conn = get_db_connection()
-                        if conn:
-                            with conn.cursor() as cur:
-                                cur.execute(
-                                    """
-                                    INSERT INTO srv_conversions 
-                                    (cnv_file, cnv_status, cnv_created_at, cnv_completed_at, cnv_task_id, usr_id) 
-                                    VALUES (%s, %s, %s, %s, %s, %s)
-                                    """,
-                                    (
-                                        os.path.basename(task.output_path), 
-                                        task.status, 
-                                        task.created_at, 
-                                        task.completed_at, 
-                                        task.task_id,
-                                        task.user_id if hasattr(task, 'user_id') else None  # Use user_id if available
-                                    )
-                                )
-                                conn.commit()
-                                logging.info(f"Failed conversion record added to database for task {task.task_id}")
-                            conn.close()
-                        else:
-                            logging.error("Failed to connect to database to record failed conversion")
-                    except Exception as db_error:
-                        logging.error(f"Database error when recording failed conversion: {str(db_error)}")
-
-                with self.lock:
-                    self.current_task = None
-
-            time.sleep(0.1)
-
-task_queue = TaskQueue()
+                    task.error = "Conversion process did not create output file"
+                task.mark("output_checked")
+
+        except subprocess.TimeoutExpired:
+            task.mark("converter_exit")
+            logging.error(f"Conversion process timed out after {CONVERSION_TIMEOUT} seconds")
+            task.status = "failed"
+            task.error = "Conversion process timed out"
+        except Exception as e:
+            logging.exception(f"Error processing task {task.task_id}: {str(e)}")
+            task.status = "failed"
+            task.error = str(e)
+
+
+converter = create_converter_backend(CONVERTER_BACKEND, CONSOLETOOLS_PATH, CONVERTER_VERSION)
+if CONVERTER_POOL_SIZE > 0 and converter.name != "simulated" and not CONVERTER_WORKER_COMMAND:
+    logging.warning("CONVERTER_POOL_SIZE ignored, ConsoleTools has no persistent mode and no CONVERTER_WORKER_COMMAND is set")
+elif CONVERTER_POOL_SIZE > 0:
+    converter = PooledConverterBackend(
+        converter,
+        shlex.split(CONVERTER_WORKER_COMMAND) if CONVERTER_WORKER_COMMAND
+        else default_worker_command(CONVERTER_BACKEND, CONSOLETOOLS_PATH, CONVERTER_VERSION),
+        CONVERTER_POOL_SIZE,
+        max_tasks_per_process=CONVERTER_POOL_MAX_TASKS,
+        health_check_interval=CONVERTER_POOL_HEALTH_CHECK_INTERVAL,
+        cwd=settings.BASE_DIR,
+    )
+task_scheduler = create_scheduler(TASK_SCHEDULER, SCHEDULER_SHORTEST_FIRST, SCHEDULER_PRIORITY_AUTHENTICATED, SCHEDULER_MAX_WAIT)
+eta_model = ConversionTimeModel(ETA_DEFAULT_SECONDS, ETA_DECAY, max_seconds=CONVERSION_TIMEOUT)
+task_queue = ConversionQueue(
+    create_task_store(TASK_STORE_BACKEND, TASK_STORE_PATH, TASK_HISTORY_MAX_ENTRIES, TASK_HISTORY_TTL, task_scheduler),
+    CONVERSION_WORKERS, WORK_DIR, eta_model, SHARED_STORE_POLL_INTERVAL,
+    TASK_HEARTBEAT_INTERVAL, TASK_ORPHAN_TIMEOUT, TASK_MAX_RECOVERIES,
+)
+conversion_cache = ConversionCache(CONVERSION_CACHE_PATH, BASE_DIR, CONVERSION_CACHE_MAX_BYTES)
+storage_janitor = StorageJanitor(
+    conversion_cache, BASE_DIR, task_queue.store, STORAGE_JANITOR_INTERVAL, STORAGE_MAX_AGE, STORAGE_MAX_IDLE, STORAGE_ORPHAN_AGE,
+    STORAGE_RECONCILE_INTERVAL,
+)
+if STORAGE_JANITOR_INTERVAL > 0:
+    storage_janitor.start()
+network_drive = NetworkDriveMonitor(SHARE_NAME, SHARE_PATH, NETWORK_DRIVE_CHECK_INTERVAL, NETWORK_DRIVE_MAX_BACKOFF)
+if NETWORK_DRIVE_MONITOR:
+    network_drive.start()
+metrics_publisher = MetricsPublisher(registry, METRICS_PATH, METRICS_PUBLISH_INTERVAL)
+metrics_publisher.start()
+conversion_recorder = ConversionRecorder(
+    get_db_connection, RECORDER_SPOOL_DIR, RECORDER_BATCH_SIZE, RECORDER_FLUSH_INTERVAL, RECORDER_RETRY_INTERVAL,
+    on_written=conversions_recorded, on_dead_lettered=conversion_dead_lettered,
+)
+span_exporter = None
+if TRACE_EXPORT in ('file', 'zipkin'):
+    span_exporter = SpanExporter(TRACE_EXPORT, TRACE_FILE if TRACE_EXPORT == 'file' else TRACE_ZIPKIN_URL)
+if ETA_HISTORY_ROWS > 0:
+    # One query at startup, in the background so a slow database doesn't hold up the import
+    threading.Thread(
+        target=eta_model.load_history, args=(get_db_connection, ETA_HISTORY_ROWS), name="eta-history", daemon=True
+    ).start()
 
 # ------------------- API Views -------------------
 
+def get_client_ip(request):
+    """Get the client IP address from request header"""
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        ip = x_forwarded_for.split(',')[0].strip()
+    else:
+        ip = request.META.get('REMOTE_ADDR', '')
+    return ip
+
+
+def user_id_from_authorization(auth_header):
+    """user_id of a "Bearer <jwt>" Authorization header, None for anonymous or invalid tokens"""
+    try:
+        if auth_header and auth_header.startswith('Bearer '):
+            token = auth_header[7:]  # Remove 'Bearer ' prefix
+            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+            return payload.get('user_id')
+    except Exception:
+        # If any error occurs during token processing, we just proceed with user_id as None
+        pass
+    return None
+
+
+def enqueue_conversion(hash_dir, input_path, original_filename, digest, client_ip, user_id=None, received_at=None):
+    """
+    Create the task for an upload saved at input_path (inside hash_dir) and queue it, or
+    answer from the conversion cache. Returns the response payload; shared by every
+    upload path (multipart, chunked, streamed). Raises InvalidModArchive when the pre-flight
+    check rejects the file, hash_dir is removed by then.
+
+    received_at: unix time the upload started arriving, the start of the task's timeline.
+    """
+    output_filename = f"dt_{original_filename}".lower()
+    #make sure the extension is ttmp2 even for older files
+    if(output_filename.endswith('ttmp')):
+        output_filename = output_filename.replace('ttmp','ttmp2')
+    output_path = os.path.join(hash_dir, output_filename)
+
+    # Create task
+    task_id = str(uuid4())
+    logging.info(f"Client IP: {client_ip}, Creating task with ID: {task_id}")
+    if user_id is not None:
+        logging.info(f"Authenticated user with ID: {user_id} for task: {task_id}")
+
+    task = ConversionTask(task_id, input_path, output_path, original_filename, client_ip, user_id)
+    task.content_hash = digest.sha256
+    task.fingerprint = digest.fingerprint
+    task.input_size = digest.size
+    task.mark("received", received_at)
+    task.mark("saved")
+    conversion_cache.register_dir(hash_dir, task_id)
+
+    # Identical file already converted by this ConsoleTools version, hand out the existing
+    # output, linked into this upload's directory so it is downloaded under this upload's name
+    cached_output = conversion_cache.lookup(task.content_hash, converter.version)
+    if cached_output:
+        try:
+            link_or_copy(cached_output, output_path)
+            conversion_cache.add_alias(task.content_hash, converter.version, output_path)
+        except OSError as e:
+            logging.warning(f"Could not link the cached output {cached_output}, converting again: {e}")
+            cached_output = None
+    if cached_output:
+        logging.info(f"Conversion cache hit for {original_filename} ({task.content_hash}): {cached_output}")
+        try:
+            os.remove(input_path)
+        except OSError as e:
+            logging.warning(f"Could not delete the input of task {task_id}: {e}")
+        task.file_path = None
+        task.status = "completed"
+        task.completed_at = datetime.now()
+        task.mark("completed", task.completed_at.timestamp())
+        task_queue.add_task(task)
+        record_conversion(task)
+        export_task_trace(task)
+
+        return {
+            "task_id": task_id,
+            "status": "completed",
+            "message": "File was already converted",
+            "check_status_url": f"/task/{task_id}",
+            "download_url": build_download_link(output_path)
+        }
+
+    if MOD_PREFLIGHT:
+        try:
+            mod_info = inspect_mod_archive(input_path)
+        except InvalidModArchive as e:
+            logging.error(f"[{client_ip}] Rejected {original_filename} before queueing: {e}")
+            shutil.rmtree(hash_dir, ignore_errors=True)
+            conversion_cache.unregister_dir(hash_dir)
+            raise
+        logging.info(f"Pre-flight check passed for {original_filename}: {mod_info.format}, {mod_info.file_count} files, {mod_info.uncompressed_size} bytes uncompressed")
+        task.mod_files = mod_info.file_count
+        task.mod_size = mod_info.uncompressed_size
+
+    task.mark("enqueued")
+    task_queue.add_task(task)
+
+    return {
+        "task_id": task_id,
+        "status": "queued",
+        "message": "File conversion has been queued",
+        "check_status_url": f"/task/{task_id}"
+    }
+
+
+def enqueue_request_upload(request, hash_dir, input_path, original_filename, digest, received_at=None):
+    """enqueue_conversion for a Django/DRF request, as a Response"""
+    try:
+        return Response(enqueue_conversion(
+            hash_dir, input_path, original_filename, digest,
+            get_client_ip(request), user_id_from_authorization(request.headers.get('Authorization')), received_at,
+        ))
+    except InvalidModArchive as e:
+        return Response({"error": f"This mod can't be converted: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class ConvertFileView(APIView):
     parser_classes = (MultiPartParser, FormParser)
 
     def post(self, request):
+        # Under WSGI the multipart body is only read from the socket by request.FILES
+        started = time.monotonic()
+        received_at = time.time()
         try:
             file = request.FILES.get('file')
             if not file:
@@ -342,7 +540,7 @@ class ConvertFileView(APIView):
                 return Response({"error": "No file uploaded"}, status=status.HTTP_400_BAD_REQUEST)
             
             suffix = Path(file.name).suffix.lower()
-            if suffix == '' or suffix not in ['.ttmp2', '.pmp', '.ttmp']:
+            if suffix == '' or suffix not in VALID_EXTENSIONS:
                 logging.error(f"The extention {suffix} is not a valid extention")
                 return Response({"error": f"The extention {suffix} is not a valid extention"}, status=status.HTTP_400_BAD_REQUEST)
             
@@ -354,114 +552,349 @@ class ConvertFileView(APIView):
 
             # Generate a unique hash directory
             file_hash_value = hashlib.md5(f"{uuid4().hex}_{original_filename}".encode()).hexdigest()
-            hash_dir = os.path.join(BASE_DIR, file_hash_value)
+            hash_dir = task_dir(BASE_DIR, file_hash_value)
 
             # Creating new directory and saving the original file
             os.makedirs(hash_dir, exist_ok=True)
             input_path = os.path.join(hash_dir, original_filename)
             
-            # Track how much we've written
-            total_bytes = 0
             start_time = time.time()
-            
+
+            def log_progress(total_bytes, chunk_size):
+                # Log progress for large files
+                if file.size > 50 * 1024 * 1024 and total_bytes % (10 * 1024 * 1024) < chunk_size:  # Log every ~10MB
+                    elapsed = time.time() - start_time
+                    percent = (total_bytes / file.size) * 100
+                    speed = total_bytes / (elapsed * 1024 * 1024) if elapsed > 0 else 0
+                    logging.info(
+                        f"Upload progress: {percent:.1f}% ({total_bytes}/{file.size} bytes), speed: {speed:.2f} MB/s",
+                        extra={"sample_key": f"upload:{input_path}"},
+                    )
+
             try:
-                with open(input_path, 'wb') as destination:
-                    for chunk in file.chunks():
-                        chunk_size = len(chunk)
-                        destination.write(chunk)
-                        total_bytes += chunk_size
-                        
-                        # Log progress for large files
-                        if file.size > 50 * 1024 * 1024 and total_bytes % (10 * 1024 * 1024) < chunk_size:  # Log every ~10MB
-                            elapsed = time.time() - start_time
-                            percent = (total_bytes / file.size) * 100
-                            speed = total_bytes / (elapsed * 1024 * 1024) if elapsed > 0 else 0
-                            logging.info(f"Upload progress: {percent:.1f}% ({total_bytes}/{file.size} bytes), speed: {speed:.2f} MB/s")
-                
-                # Verify the file was written correctly
-                actual_size = os.path.getsize(input_path)
-                logging.info(f"File saved successfully, size on disk: {actual_size} bytes")
+                # Content hash is computed while the chunks are written, the file is never read back
+                digest = write_upload(file.chunks(chunk_size=UPLOAD_CHUNK_SIZE), input_path, log_progress)
+                logging.info(f"File saved successfully, size on disk: {digest.size} bytes, sha256: {digest.sha256}")
+                observe_transfer(UPLOAD_THROUGHPUT, UPLOAD_BYTES, digest.size, time.monotonic() - started, path="multipart")
                 
-                if actual_size != file.size:
-                    logging.warning(f"File size mismatch! Expected: {file.size}, got: {actual_size}")
+                if digest.size != file.size:
+                    logging.warning(f"File size mismatch! Expected: {file.size}, got: {digest.size}")
             
             except Exception as e:
                 logging.error(f"Error saving file: {str(e)}")
                 return Response({"error": f"File save error: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            output_filename = f"dt_{original_filename}".lower()
-            #make sure the extension is ttmp2 even for older files
-            if(output_filename.endswith('ttmp')):
-                output_filename = output_filename.replace('ttmp','ttmp2')
-            output_path = os.path.join(hash_dir, output_filename)
-
-            # Create task
-            task_id = str(uuid4())
-            client_ip = self.get_client_ip(request)
-            logging.info(f"Client IP: {client_ip}, Creating task with ID: {task_id}")
+            return enqueue_request_upload(request, hash_dir, input_path, original_filename, digest, received_at)
 
-            # Check if user is authenticated
-            user_id = None
-            try:
-                # Try to get token from Authorization header
-                auth_header = request.headers.get('Authorization')
-                if auth_header and auth_header.startswith('Bearer '):
-                    token = auth_header[7:]  # Remove 'Bearer ' prefix
-                    # Decode token
-                    payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-                    user_id = payload.get('user_id')
-                    logging.info(f"Authenticated user with ID: {user_id} for task: {task_id}")
-            except:
-                # If any error occurs during token processing, we just proceed with user_id as None
-                pass
-
-            task = ConversionTask(task_id, input_path, output_path, original_filename, client_ip, user_id)
-            task_queue.add_task(task)
-
-            return Response({
-                "task_id": task_id,
-                "status": "queued",
-                "message": "File conversion has been queued",
-                "check_status_url": f"/task/{task_id}"
-            })
-            
         except Exception as e:
             logging.error(f"Unhandled exception in file upload: {str(e)}", exc_info=True)
             return Response({"error": f"Server error: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     def get_client_ip(self, request):
-        """Get the client IP address from request header"""
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0].strip()
-        else:
-            ip = request.META.get('REMOTE_ADDR', '')
-        return ip
+        return get_client_ip(request)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class StreamUploadView(APIView):
+    """
+    POST /convert/stream with the raw file as body and ?filename=. Under uvicorn this route
+    is answered by converter_app.stream_uploads before Django sees it; this view is the
+    same endpoint for WSGI servers (gunicorn, runserver).
+    """
+
+    def post(self, request):
+        try:
+            original_filename = os.path.basename(request.query_params.get('filename', request.headers.get('X-Filename', '')).replace('\\', '/'))
+            suffix = Path(original_filename).suffix.lower()
+            if suffix == '' or suffix not in VALID_EXTENSIONS:
+                logging.error(f"The extention {suffix} is not a valid extention")
+                return Response({"error": f"The extention {suffix} is not a valid extention"}, status=status.HTTP_400_BAD_REQUEST)
+            # request.read() isn't covered by DATA_UPLOAD_MAX_MEMORY_SIZE, enforce the limit here
+            content_length = request.META.get('CONTENT_LENGTH', '')
+            if content_length.isdigit() and int(content_length) > UPLOAD_MAX_SIZE:
+                return Response({"error": f"File is larger than {UPLOAD_MAX_SIZE} bytes"}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+            ensure_network_drive()
+            hash_dir = task_dir(BASE_DIR, uuid4().hex)
+            os.makedirs(hash_dir, exist_ok=True)
+            input_path = os.path.join(hash_dir, original_filename)
+
+            def body():
+                while True:
+                    piece = request.read(UPLOAD_CHUNK_SIZE)
+                    if not piece:
+                        break
+                    yield piece
+
+            started = time.monotonic()
+            received_at = time.time()
+            try:
+                # Content-Length may be missing (chunked transfer encoding) or wrong, count too
+                digest = write_upload(body(), input_path, max_size=UPLOAD_MAX_SIZE)
+            except UploadTooLarge as e:
+                shutil.rmtree(hash_dir, ignore_errors=True)
+                return Response({"error": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            if digest.size == 0:
+                shutil.rmtree(hash_dir, ignore_errors=True)
+                return Response({"error": "No file uploaded"}, status=status.HTTP_400_BAD_REQUEST)
+            logging.info(f"File saved successfully, size on disk: {digest.size} bytes, sha256: {digest.sha256}")
+            observe_transfer(UPLOAD_THROUGHPUT, UPLOAD_BYTES, digest.size, time.monotonic() - started, path="stream")
+            return enqueue_request_upload(request, hash_dir, input_path, original_filename, digest, received_at)
+
+        except Exception as e:
+            logging.error(f"Unhandled exception in file upload: {str(e)}", exc_info=True)
+            return Response({"error": f"Server error: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ChunkedUploadView(APIView):
+    """
+    Start a resumable upload: POST {"filename": ..., "size": ...}.
+
+    The client then PUTs every chunk to upload/<upload_id>/ (?index=N or a Content-Range
+    header, optional X-Chunk-SHA256), can GET the same URL to see which chunks are still
+    missing after a dropped connection, and POSTs upload/<upload_id>/finalize/ to queue
+    the conversion.
+    """
+
+    def post(self, request):
+        try:
+            original_filename = os.path.basename(str(request.data.get('filename', '')).replace('\\', '/'))
+            try:
+                size = int(request.data.get('size'))
+            except (TypeError, ValueError):
+                return Response({"error": "size must be the file size in bytes"}, status=status.HTTP_400_BAD_REQUEST)
+
+            suffix = Path(original_filename).suffix.lower()
+            if suffix == '' or suffix not in VALID_EXTENSIONS:
+                logging.error(f"The extention {suffix} is not a valid extention")
+                return Response({"error": f"The extention {suffix} is not a valid extention"}, status=status.HTTP_400_BAD_REQUEST)
+            if size <= 0 or size > UPLOAD_MAX_SIZE:
+                return Response(
+                    {"error": f"File size must be between 1 and {UPLOAD_MAX_SIZE} bytes"},
+                    status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                )
+
+            ensure_network_drive()
+            pruned = prune_chunked_uploads(CHUNKED_UPLOAD_SESSIONS_DIR)
+            if pruned:
+                logging.info(f"Removed {pruned} expired chunked uploads")
+
+            # Not get_client_ip: X-Forwarded-For only counts when it was set by one of our proxies
+            client_ip = upload_client(
+                request.META.get('PEER_ADDR', request.META.get('REMOTE_ADDR', '')), request.META.get('HTTP_X_FORWARDED_FOR'),
+            )
+            if count_chunked_uploads(CHUNKED_UPLOAD_SESSIONS_DIR, client_ip) >= CHUNKED_UPLOAD_MAX_SESSIONS:
+                logging.warning(f"[{client_ip}] Refused a chunked upload, {CHUNKED_UPLOAD_MAX_SESSIONS} are already open")
+                return Response(
+                    {"error": f"You already have {CHUNKED_UPLOAD_MAX_SESSIONS} unfinished uploads, finish or wait for them to expire"},
+                    status=status.HTTP_429_TOO_MANY_REQUESTS,
+                )
+
+            upload_id = uuid4().hex
+            hash_dir = task_dir(BASE_DIR, upload_id)
+            upload = ChunkedUpload.create(
+                CHUNKED_UPLOAD_SESSIONS_DIR, upload_id, os.path.join(hash_dir, f"{original_filename}.part"), original_filename, size,
+                client_ip,
+            )
+            logging.info(f"Chunked upload {upload_id} started: {original_filename}, {size} bytes in {upload.chunk_count} chunks")
+            return Response({**upload.status(), "upload_url": f"/upload/{upload_id}/"}, status=status.HTTP_201_CREATED)
+
+        except Exception as e:
+            logging.error(f"Unhandled exception starting a chunked upload: {str(e)}", exc_info=True)
+            return Response({"error": f"Server error: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ChunkedUploadChunkView(APIView):
+    def get(self, request, upload_id):
+        upload = ChunkedUpload.load(CHUNKED_UPLOAD_SESSIONS_DIR, upload_id)
+        if upload is None:
+            return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(upload.status())
+
+    def put(self, request, upload_id):
+        upload = ChunkedUpload.load(CHUNKED_UPLOAD_SESSIONS_DIR, upload_id)
+        if upload is None:
+            return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        index = request.query_params.get('index')
+        content_range = request.headers.get('Content-Range', '')
+        try:
+            if index is None and content_range.startswith('bytes '):
+                # "bytes <start>-<end>/<total>", the chunk must start on a chunk boundary
+                start = int(content_range[6:].split('-', 1)[0])
+                if start % upload.chunk_size:
+                    raise ValueError
+                index = start // upload.chunk_size
+            index = int(index)
+        except (TypeError, ValueError):
+            return Response(
+                {"error": f"Give the chunk as ?index=N or a Content-Range starting at a multiple of {upload.chunk_size}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        def body():
+            while True:
+                piece = request.read(UPLOAD_CHUNK_SIZE)
+                if not piece:
+                    break
+                yield piece
+
+        started = time.monotonic()
+        try:
+            chunk_sha256 = upload.write_chunk(index, body(), request.headers.get('X-Chunk-SHA256'))
+            observe_transfer(UPLOAD_THROUGHPUT, UPLOAD_BYTES, upload.chunk_length(index), time.monotonic() - started, path="chunked")
+        except ValueError as e:
+            logging.warning(f"Rejected chunk {index} of upload {upload_id}: {e}")
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except UploadFinalizing as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+        except FileNotFoundError:
+            # Finalized or expired while this chunk was in flight
+            return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        received = upload.received()
+        return Response({
+            "upload_id": upload_id,
+            "chunk": index,
+            "sha256": chunk_sha256,
+            "received_chunks": len(received),
+            "chunk_count": upload.chunk_count,
+        })
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ChunkedUploadFinalizeView(APIView):
+    def post(self, request, upload_id):
+        try:
+            upload = ChunkedUpload.load(CHUNKED_UPLOAD_SESSIONS_DIR, upload_id)
+            if upload is None:
+                return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+            try:
+                # From here on chunk PUTs get a 409, the file can't change under the digest
+                upload.begin_finalize()
+            except UploadFinalizing as e:
+                return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+            missing = upload.missing()
+            if missing:
+                upload.cancel_finalize()
+                return Response(
+                    {"error": "Upload is incomplete", "missing_chunks": missing},
+                    status=status.HTTP_409_CONFLICT,
+                )
+
+            original_filename = upload.meta["filename"]
+            hash_dir = os.path.dirname(upload.data_path)
+            input_path = os.path.join(hash_dir, original_filename)
+            try:
+                # Only one finalize can win the rename, a retried request gets a 409
+                os.rename(upload.data_path, input_path)
+            except FileNotFoundError:
+                return Response({"error": "Upload was already finalized"}, status=status.HTTP_409_CONFLICT)
+            upload.discard_session()
+
+            digest = upload.digest(input_path)
+            expected_sha256 = request.data.get('sha256')
+            if expected_sha256 and expected_sha256.lower() != digest.sha256:
+                logging.error(f"Chunked upload {upload_id} checksum mismatch: expected {expected_sha256}, got {digest.sha256}")
+                shutil.rmtree(hash_dir, ignore_errors=True)
+                return Response({"error": "File checksum mismatch, please upload the file again"}, status=status.HTTP_400_BAD_REQUEST)
+
+            logging.info(f"Chunked upload {upload_id} finalized: {original_filename}, {digest.size} bytes, sha256: {digest.sha256}")
+            return enqueue_request_upload(request, hash_dir, input_path, original_filename, digest, upload.meta.get("created_at"))
+
+        except Exception as e:
+            logging.error(f"Unhandled exception finalizing chunked upload {upload_id}: {str(e)}", exc_info=True)
+            return Response({"error": f"Server error: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def task_status_payload(task):
+    response = {
+        "task_id": task.task_id,
+        "status": task.status,
+        "original_filename": task.original_filename,
+        "created_at": task.created_at.isoformat(),
+    }
+
+    if task.status in ("queued", "processing"):
+        position, estimate = task_queue.get_task_estimate(task.task_id)
+        if task.status == "queued":
+            response["queue_position"] = position
+        if estimate:
+            response.update(estimate_payload(*estimate))
+
+    elif task.status == "completed":
+        response["download_url"] = build_download_link(task.output_path)
+        response["completed_at"] = task.completed_at.isoformat()
+
+    elif task.status == "failed":
+        response["error"] = task.error
+        response["completed_at"] = task.completed_at.isoformat()
+
+    return response
+
+
+def recorded_task_status(task_id):
+    """Status of a task that was already evicted from the task store, read from srv_conversions"""
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return None
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT cnv_status, cnv_created_at, cnv_completed_at, cnv_download_link
+                    FROM srv_conversions
+                    WHERE cnv_task_id = %s
+                    """,
+                    (task_id,)
+                )
+                row = cur.fetchone()
+        finally:
+            conn.close()
+    except Exception as db_error:
+        logging.error(f"Database error when looking up task {task_id}: {str(db_error)}")
+        return None
+
+    if not row:
+        return None
+
+    # srv_conversions has neither the uploaded file's name nor the error, so those are left out
+    task_status, created_at, completed_at, download_link = row
+    response = {
+        "task_id": task_id,
+        "status": task_status,
+        "created_at": created_at.isoformat() if created_at else None,
+        "completed_at": completed_at.isoformat() if completed_at else None,
+    }
+    if task_status == "completed":
+        response["download_url"] = download_link
+    return response
+
+def lookup_task_status(task_id):
+    task = task_queue.get_task(task_id)
+    if task:
+        return task_status_payload(task)
+    return recorded_task_status(task_id)
+
+
+def is_admin(request):
+    user_id = user_id_from_authorization(request.headers.get('Authorization'))
+    return user_id is not None and str(user_id) in ADMIN_USER_IDS
 
 
 class TaskStatusView(APIView):
     def get(self, request, task_id):
         task = task_queue.get_task(task_id)
+        response = task_status_payload(task) if task else recorded_task_status(task_id)
 
-        if not task:
+        if not response:
             return Response({"error": "Task not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        response = {
-            "task_id": task.task_id,
-            "status": task.status,
-            "original_filename": task.original_filename,
-            "created_at": task.created_at.isoformat(),
-        }
-
-        if task.status == "completed":
-            file_hash_value = os.path.dirname(task.output_path).split(os.path.sep)[-1]
-            filename = os.path.basename(task.output_path)
-            response["download_url"] = f"https://dl.meikoneko.space/download/{file_hash_value}/{filename}"
-            response["completed_at"] = task.completed_at.isoformat()
-
-        elif task.status == "failed":
-            response["error"] = task.error
-            response["completed_at"] = task.completed_at.isoformat()
+        if task and is_admin(request):
+            response["timeline"] = timeline_payload(task.timeline)
 
         return Response(response)
 
@@ -471,12 +904,135 @@ class QueueStatusView(APIView):
         return Response(task_queue.get_queue_status())
 
 
+# ------------------- Streaming (Server-Sent Events) -------------------
+
+# Other worker processes can't wake our listeners, so with a shared store the state is
+# re-read at least this often. With the in-memory store it only paces the keep-alives.
+STREAM_REFRESH_INTERVAL = float(os.environ.get('STREAM_REFRESH_INTERVAL', 2 if TASK_STORE_BACKEND != 'memory' else 15))
+
+def sse_message(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _event_stream(read_state, is_final=lambda state: False):
+    """Yield an SSE message every time read_state() returns something new"""
+    event = task_queue.add_listener()
+    try:
+        yield "retry: 3000\n\n"
+        last_state = None
+        while True:
+            event.clear()
+            state = await sync_to_async(read_state, thread_sensitive=False)()
+            if state is None:
+                yield sse_message("error", {"error": "Task not found"})
+                return
+            if state != last_state:
+                yield sse_message("status", state)
+                last_state = state
+            if is_final(state):
+                return
+
+            try:
+                await asyncio.wait_for(event.wait(), STREAM_REFRESH_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+    finally:
+        task_queue.remove_listener(event)
+
+def _event_stream_response(request, read_state, is_final=lambda state: False):
+    if not isinstance(request, ASGIRequest):
+        # A WSGI worker collects the whole async stream before sending anything and holds a
+        # thread for as long as the stream lasts. 501 makes the EventSource fail right away,
+        # so the frontend falls back to polling.
+        return JsonResponse({"error": "Event streams need the ASGI server (uvicorn)"}, status=501)
+    response = StreamingHttpResponse(_event_stream(read_state, is_final), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # don't let nginx buffer the stream
+    return response
+
+async def task_events(request, task_id):
+    """Push task status and queue position changes until the task completes or fails"""
+    return _event_stream_response(
+        request,
+        lambda: lookup_task_status(task_id),
+        lambda state: state["status"] in ("completed", "failed"),
+    )
+
+async def queue_events(request):
+    """Push queue status changes, replaces polling /queue-status/"""
+    return _event_stream_response(request, task_queue.get_queue_status)
+
+
+class CacheStatusView(APIView):
+    def get(self, request):
+        return Response({**conversion_cache.stats(), "janitor": storage_janitor.metrics()})
+
+
+class StorageStatusView(APIView):
+    def get(self, request):
+        return Response({"network_drive": {"enabled": NETWORK_DRIVE_MONITOR, **network_drive.status()}})
+
+
+def metrics(request):
+    """Prometheus scrape endpoint, covering every worker process"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return JsonResponse({"error": "Unauthorized"}, status=401)
+
+    snapshot = metrics_publisher.collect()
+    cache_stats = conversion_cache.stats()
+    for name in ("hits", "misses", "evictions", "expired"):
+        snapshot[f"xivdt_conversion_cache_{name}_total"] = {
+            "type": "counter", "help": f"Conversion cache {name}", "samples": {"": cache_stats[name]},
+        }
+
+    pending = task_queue.store.pending()
+    disk = shutil.disk_usage(BASE_DIR)
+    gauges = [
+        ("xivdt_queue_depth", "Tasks waiting for a conversion slot", len(pending["queued"])),
+        ("xivdt_tasks_in_flight", "Tasks being converted", len(pending["processing"])),
+        ("xivdt_storage_used_bytes", "Bytes of converted outputs in BASE_DIR (conversion cache index)", cache_stats["size_bytes"]),
+        ("xivdt_storage_entries", "Converted outputs in BASE_DIR", cache_stats["entries"]),
+        ("xivdt_disk_free_bytes", "Free space on the BASE_DIR filesystem", disk.free),
+        ("xivdt_disk_total_bytes", "Size of the BASE_DIR filesystem", disk.total),
+    ]
+    if isinstance(converter, PooledConverterBackend):
+        pool = converter.metrics()
+        gauges.append(("xivdt_converter_workers", "Warm converter worker processes of this process",
+                       {'state="idle"': pool["idle"], 'state="busy"': pool["busy"]}))
+    return HttpResponse(render(snapshot, gauges), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class EtaStatusView(APIView):
+    def get(self, request):
+        return Response(eta_model.metrics())
+
+
+class DatabasePoolStatusView(APIView):
+    def get(self, request):
+        return Response({**db_pool.metrics(), "recorder": conversion_recorder.metrics()})
+
+
 
 class DownloadFileView(APIView):
     def get(self, request, file_hash, filename):
-        file_path = os.path.join(BASE_DIR, file_hash, filename)
+        # Sharded directory, or the flat one for outputs from before the sharded layout;
+        # download links only carry the directory name so old links keep working
+        hash_dir = resolve_task_dir(BASE_DIR, file_hash)
+        if hash_dir is None:
+            return JsonResponse({"error": "File not found"}, status=404)
+        file_path = os.path.join(hash_dir, filename)
+        # filename comes from the URL, don't let it point outside the task directory
+        if os.path.dirname(os.path.abspath(file_path)) != os.path.abspath(hash_dir):
+            return JsonResponse({"error": "File not found"}, status=404)
         if not os.path.exists(file_path):
             return JsonResponse({"error": "File not found"}, status=404)
 
-        return FileResponse(open(file_path, 'rb'), as_attachment=True, filename=filename)
-    
+        # The output is fully determined by the input content and the converter version
+        etag = None
+        try:
+            entry = conversion_cache.lookup_output(file_path)
+            if entry:
+                etag = f"{entry[0]}-{entry[1]}"
+        except Exception as e:
+            logging.error(f"Conversion cache lookup failed for {file_path}: {e}")
+
+        return serve_file(request, file_path, filename, BASE_DIR, etag)
@@ -1,5 +1,11 @@
 timeout = 600  # 10 minutes
 workers = 4
 threads = 2
+# These sync workers answer the SSE endpoints (/task/<id>/events/, /queue-status/events/)
+# with 501 and the frontend polls instead. For push updates run uvicorn (run.ps1) or use
+# worker_class = "uvicorn.workers.UvicornWorker".
 max_requests = 1000
-max_requests_jitter = 100
\ No newline at end of file
+max_requests_jitter = 100
+
+# Several worker processes need a shared task store to agree on queue state
+raw_env = ["TASK_STORE_BACKEND=sqlite"]
\ No newline at end of file
@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'storefront.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the apps are loaded; streams POST /convert/stream to disk without going through Django
+from converter_app.stream_uploads import StreamUploadApplication  # noqa: E402
+
+application = StreamUploadApplication(django_application)
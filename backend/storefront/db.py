@@ -0,0 +1,200 @@
+import logging
+import os
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+# Database connection settings
+DB_HOST = '192.168.15.168'
+DB_NAME = 'xiv-dt-updater'
+DB_USER = 'postgres'
+DB_PASSWORD = 'postgres'
+
+DB_POOL_MIN_CONNECTIONS = int(os.environ.get('DB_POOL_MIN_CONNECTIONS', 1))
+DB_POOL_MAX_CONNECTIONS = int(os.environ.get('DB_POOL_MAX_CONNECTIONS', 10))
+# How long a request waits for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+# Connections idle for longer than this are pinged before being handed out
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get('DB_POOL_HEALTH_CHECK_INTERVAL', 30))
+
+
+class PooledConnection:
+    """
+    Thin wrapper around a pooled psycopg2 connection.
+
+    Behaves like the connection itself, except close() hands it back to the pool, so
+    code written for psycopg2.connect() (conn.cursor(), conn.commit(), conn.close())
+    works unchanged.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+
+class ConnectionPool:
+    """
+    Thread-safe, size-bounded pool of PostgreSQL connections shared by every view and
+    background thread of the process.
+
+    Callers block for up to `timeout` seconds when all connections are in use. Connections
+    that sat idle for longer than health_check_interval are checked with SELECT 1 before
+    being handed out, and broken ones are replaced.
+    """
+
+    def __init__(self, min_connections, max_connections, timeout, health_check_interval, **connect_kwargs):
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.connect_kwargs = connect_kwargs
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.pool = None
+        self.pid = None
+        self.last_used = {}  # id(conn) -> time it was returned to the pool
+        self.stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "connect_errors": 0,
+            "discarded": 0,
+        }
+
+    def _get_pool(self):
+        with self.lock:
+            # gunicorn forks workers, a pool inherited from another process can't be used
+            if self.pool is None or self.pid != os.getpid():
+                self.pool = psycopg2.pool.ThreadedConnectionPool(
+                    self.min_connections, self.max_connections, **self.connect_kwargs
+                )
+                self.pid = os.getpid()
+                self.last_used = {}
+            return self.pool
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - self.last_used.get(id(conn), 0) < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def acquire(self):
+        """Check a connection out of the pool, returns a PooledConnection"""
+        started = time.monotonic()
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.stats["waits"] += 1
+            if not self.slots.acquire(timeout=self.timeout):
+                with self.lock:
+                    self.stats["timeouts"] += 1
+                raise psycopg2.pool.PoolError(f"No database connection available after {self.timeout}s")
+
+        try:
+            pool = self._get_pool()
+            # One retry is enough: if a fresh connection is broken too, the database is down
+            for _ in range(2):
+                conn = pool.getconn()
+                if self._is_healthy(conn):
+                    break
+                with self.lock:
+                    self.stats["health_check_failures"] += 1
+                    self.stats["discarded"] += 1
+                pool.putconn(conn, close=True)
+            else:
+                raise psycopg2.OperationalError("Database connection failed health check")
+        except Exception:
+            with self.lock:
+                self.stats["connect_errors"] += 1
+            self.slots.release()
+            raise
+
+        with self.lock:
+            self.stats["checkouts"] += 1
+            self.stats["wait_seconds"] += time.monotonic() - started
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        discard = conn.closed != 0
+        if not discard:
+            try:
+                # Never hand out a connection with a half-finished transaction
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        try:
+            with self.lock:
+                pool = self.pool if self.pid == os.getpid() else None
+                self.last_used[id(conn)] = time.monotonic()
+                if discard:
+                    self.stats["discarded"] += 1
+                    self.last_used.pop(id(conn), None)
+            if pool is not None:
+                pool.putconn(conn, close=discard)
+            else:
+                conn.close()
+        except Exception as e:
+            logging.error(f"Error returning database connection to the pool: {e}")
+        finally:
+            self.slots.release()
+
+    def metrics(self):
+        with self.lock:
+            in_use = len(self.pool._used) if self.pool is not None and self.pid == os.getpid() else 0
+            idle = len(self.pool._pool) if self.pool is not None and self.pid == os.getpid() else 0
+            stats = dict(self.stats)
+        stats["wait_seconds"] = round(stats["wait_seconds"], 4)
+        return {
+            "max_connections": self.max_connections,
+            "in_use": in_use,
+            "idle": idle,
+            **stats,
+        }
+
+
+db_pool = ConnectionPool(
+    DB_POOL_MIN_CONNECTIONS,
+    DB_POOL_MAX_CONNECTIONS,
+    DB_POOL_TIMEOUT,
+    DB_POOL_HEALTH_CHECK_INTERVAL,
+    host=DB_HOST,
+    database=DB_NAME,
+    user=DB_USER,
+    password=DB_PASSWORD,
+)
+
+
+def get_db_connection():
+    """Get a pooled connection to the PostgreSQL database, close() returns it to the pool"""
+    try:
+        return db_pool.acquire()
+    except psycopg2.Error as e:
+        print(f"Database connection error: {e}")
+        return None
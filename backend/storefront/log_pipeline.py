@@ -0,0 +1,164 @@
+"""
+Non-blocking log pipeline.
+
+Every logger hands its records to a QueueHandler, which only puts them on an in-memory
+queue; one listener thread per process formats them and writes the log file and console.
+A slow disk (the log sits next to the SMB share) then never holds up a request thread.
+The file is written as JSON lines and rotated by size. Records carrying a sample_key
+(upload progress) are let through at most once per sample_interval per key.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+TEXT_FORMAT = '[%(asctime)s] %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has, everything else was passed with extra= and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample_key"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, plus the extra= fields"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets one record per sample_key through every `interval` seconds; the next one that
+    passes says how many were skipped. Records without a sample_key are never dropped.
+    """
+
+    def __init__(self, interval):
+        super().__init__()
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.keys = {}  # sample_key -> [last time let through, records skipped since]
+
+    def filter(self, record):
+        key = getattr(record, "sample_key", None)
+        if key is None or self.interval <= 0:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            state = self.keys.get(key)
+            if state is not None and now - state[0] < self.interval:
+                state[1] += 1
+                return False
+            if state is not None and state[1]:
+                record.sampled_out = state[1]
+            self.keys[key] = [now, 0]
+            if len(self.keys) > 1000:
+                # Keys are per upload, forget the ones that went quiet
+                self.keys = {k: v for k, v in self.keys.items() if now - v[0] < self.interval}
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never waits: when the queue is full (the disk can't keep up) the
+    record is dropped, and a warning with the count goes out once there is room again.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Merge the arguments here, in the logging thread, but keep the traceback apart
+        # from the message so the JSON formatter can put it in its own field
+        message = record.getMessage()
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+        record = logging.makeLogRecord(vars(record))
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = exc_text
+        return record
+
+    def enqueue(self, record):
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            try:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                    "msg": f"Log queue was full, {dropped} records were dropped",
+                }))
+            except queue.Full:
+                self.dropped += dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class ReopeningRotatingFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler for a file shared by several worker processes: when another
+    process rotated the file, reopen it instead of writing on into the renamed backup.
+    """
+
+    def emit(self, record):
+        if self.stream is not None:
+            try:
+                on_disk = os.stat(self.baseFilename)
+                opened = os.fstat(self.stream.fileno())
+                rotated = (on_disk.st_dev, on_disk.st_ino) != (opened.st_dev, opened.st_ino)
+            except FileNotFoundError:
+                rotated = True
+            except OSError:
+                rotated = False
+            if rotated:
+                self.stream.close()
+                self.stream = None
+        super().emit(record)
+
+
+def queue_handler(filename, max_bytes=50 * 1024 * 1024, backup_count=5, file_format="json",
+                  console_format="text", queue_size=10000, sample_interval=5.0):
+    """
+    Factory for settings.LOGGING: the handler loggers write to, with the file and console
+    handlers behind it on a listener thread (started here, stopped and drained at exit).
+    """
+    file_handler = ReopeningRotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    console_handler = logging.StreamHandler(sys.stdout)
+    if hasattr(console_handler.stream, "reconfigure"):
+        console_handler.stream.reconfigure(encoding="utf-8")
+    for handler, output_format in ((file_handler, file_format), (console_handler, console_format)):
+        handler.setFormatter(JsonFormatter() if output_format == "json" else logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.Queue(queue_size)
+    listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(sample_interval))
+    return handler
@@ -6,6 +6,8 @@ class ForwardedForMiddleware:
 
     def __call__(self, request):
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+        # The socket's address, for the checks that must not trust a client-supplied header
+        request.META.setdefault('PEER_ADDR', request.META.get('REMOTE_ADDR', ''))
         if x_forwarded_for:
             # Take the first IP (original client)
             ip = x_forwarded_for.split(',')[0].strip()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -105,48 +106,40 @@ FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5MB - Force streaming to disk quicker
 WSGI_REQUEST_TIMEOUT = 600  # 10 minutes
 
 # Configure logging
+# Every logger goes through one queue; a background thread writes the rotating JSON log
+# file and the console (storefront/log_pipeline.py)
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
-    'formatters': {
-        'verbose': {
-            'format': '[{asctime}] {levelname} {module} {message}',
-            'style': '{',
-        },
-    },
     'handlers': {
-        'file': {
-            'level': 'INFO',
-            'class': 'logging.FileHandler',
-            'filename': 'django_debug.log',
-            'formatter': 'verbose',
-        },
-        'console': {
-            'level': 'INFO',
-            'class': 'logging.StreamHandler',
-            'formatter': 'verbose',
+        'queue': {
+            '()': 'storefront.log_pipeline.queue_handler',
+            'filename': os.environ.get('LOG_FILE', 'conversion.log'),
+            'max_bytes': int(os.environ.get('LOG_MAX_BYTES', 50 * 1024 * 1024)),
+            'backup_count': int(os.environ.get('LOG_BACKUP_COUNT', 5)),
+            'file_format': os.environ.get('LOG_FILE_FORMAT', 'json'),  # "json" or "text"
+            'console_format': os.environ.get('LOG_CONSOLE_FORMAT', 'text'),
+            # Records beyond this many waiting to be written are dropped, never waited on
+            'queue_size': int(os.environ.get('LOG_QUEUE_SIZE', 10000)),
+            # Upload progress lines: at most one per upload every this many seconds
+            'sample_interval': float(os.environ.get('LOG_SAMPLE_INTERVAL', 5)),
         },
     },
+    'root': {
+        'handlers': ['queue'],
+        'level': os.environ.get('LOG_LEVEL', 'INFO'),
+    },
     'loggers': {
+        # Django's own handlers are replaced, its records go to the root pipeline
         'django': {
-            'handlers': ['file', 'console'],
+            'handlers': [],
             'level': 'INFO',
             'propagate': True,
         },
-        'django.request': {
-            'handlers': ['file', 'console'],
-            'level': 'INFO',
-            'propagate': False,
-        },
         'django.server': {
-            'handlers': ['file', 'console'],
+            'handlers': [],
             'level': 'INFO',
-            'propagate': False,
-        },
-        'converter_app': {  # Add your app name here
-            'handlers': ['file', 'console'],
-            'level': 'INFO',
-            'propagate': False,
+            'propagate': True,
         },
     },
 }
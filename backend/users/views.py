@@ -10,11 +10,7 @@ import os
 import re
 from functools import wraps
 
-# Database connection settings
-DB_HOST = '192.168.15.168'
-DB_NAME = 'xiv-dt-updater'
-DB_USER = 'postgres'
-DB_PASSWORD = 'postgres'
+from storefront.db import get_db_connection
 
 # JWT settings
 JWT_SECRET = os.environ.get('JWT_SECRET', 'lmao1234')  # Better to use environment variable
@@ -25,20 +21,6 @@ JWT_EXPIRATION_DELTA = timedelta(days=1)  # Token valid for 1 day
 MIN_PASSWORD_LENGTH = 6
 PASSWORD_REGEX = re.compile(r'^(?=.*[A-Za-z])(?=.*\d).+$')  # At least one letter and one number
 
-def get_db_connection():
-    """Establish a connection to the PostgreSQL database"""
-    try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        return conn
-    except psycopg2.Error as e:
-        print(f"Database connection error: {e}")
-        return None
-
 def validate_password(password):
     """Validate password strength"""
     errors = []
@@ -101,7 +83,7 @@ def handle_db_connection(func):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         finally:
-            conn.close()
+            conn.close()  # returns the connection to the pool
     
     return wrapper
 
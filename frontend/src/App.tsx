@@ -6,9 +6,27 @@ import Footer from "./components/Footer";
 import Header from "./components/Header";
 import ServerStatus from "./components/ServerStatus";
 import { AuthProvider, useAuth } from "./components/User/AuthContext";
-import { QueueStatus, TaskStatus, ModFile } from "./interfaces/App";
+import {
+  QueueStatus,
+  TaskStatus,
+  ModFile,
+  ChunkedUploadStatus,
+} from "./interfaces/App";
 import { ToastContainer, toast } from "react-toastify";
 
+// Files this big are sent in resumable chunks instead of one multipart request
+const CHUNKED_UPLOAD_THRESHOLD = 64 * 1024 * 1024;
+const CHUNK_RETRIES = 5;
+
+async function sha256Hex(data: ArrayBuffer): Promise<string | null> {
+  // crypto.subtle only exists in secure contexts (https, localhost)
+  if (typeof crypto === "undefined" || !crypto.subtle) return null;
+  const hash = await crypto.subtle.digest("SHA-256", data);
+  return Array.from(new Uint8Array(hash))
+    .map((byte) => byte.toString(16).padStart(2, "0"))
+    .join("");
+}
+
 function AppContent() {
   const { isAuthenticated, token } = useAuth();
   const [modFiles, setModFiles] = useState<ModFile[]>([]);
@@ -20,16 +38,42 @@ function AppContent() {
   const [serverStatus, setServerStatus] = useState<QueueStatus | null>(null);
 
   let tastStatusInterval: NodeJS.Timeout | null = null;
+  let taskEventSource: EventSource | null = null;
 
-  // Fetch server status every 30 seconds
+  // Follow the server status over SSE, falling back to polling every 30 seconds
   useEffect(() => {
     // Fetch immediately on mount
     fetchServerStatus();
 
-    // Then set up the interval
-    const intervalId = setInterval(fetchServerStatus, 30000); // 30 seconds
+    let intervalId: NodeJS.Timeout | null = null;
+    let eventSource: EventSource | null = null;
+
+    const startPolling = () => {
+      if (!intervalId) {
+        intervalId = setInterval(fetchServerStatus, 30000); // 30 seconds
+      }
+    };
+
+    if (typeof EventSource !== "undefined") {
+      eventSource = new EventSource(
+        import.meta.env.VITE_API_URL + "/queue-status/events/"
+      );
+      eventSource.addEventListener("status", (event) => {
+        setServerStatus(JSON.parse((event as MessageEvent).data));
+      });
+      eventSource.onerror = () => {
+        // Stream not available (e.g. behind a buffering proxy), go back to polling
+        eventSource?.close();
+        startPolling();
+      };
+    } else {
+      startPolling();
+    }
 
-    return () => clearInterval(intervalId);
+    return () => {
+      eventSource?.close();
+      if (intervalId) clearInterval(intervalId);
+    };
   }, []);
 
   const fetchServerStatus = async () => {
@@ -60,27 +104,7 @@ function AppContent() {
       }
 
       const taskData: TaskStatus = await response.json();
-
-      // Update the mod status based on task status
-      if (taskData.status === "processing") {
-        updateModStatus(modId, "converting");
-      } else if (taskData.status === "completed" && taskData.download_url) {
-        updateModStatus(modId, "completed", taskData.download_url);
-        // Stop polling once completed
-        return true;
-      } else if (taskData.status === "failed") {
-        updateModStatus(
-          modId,
-          "error",
-          undefined,
-          taskData.error || "Conversion failed"
-        );
-        // Stop polling once failed
-        return true;
-      }
-
-      // Continue polling if not completed or failed
-      return false;
+      return applyTaskStatus(taskData, modId);
     } catch (error) {
       console.error("Error polling task status:", error);
       // Continue polling on error
@@ -88,6 +112,65 @@ function AppContent() {
     }
   }, []);
 
+  // Update the mod status based on task status, returns true once the task is done
+  const applyTaskStatus = (taskData: TaskStatus, modId: string) => {
+    if (taskData.status === "processing") {
+      updateModStatus(modId, "converting");
+    } else if (taskData.status === "completed" && taskData.download_url) {
+      updateModStatus(modId, "completed", taskData.download_url);
+      return true;
+    } else if (taskData.status === "failed") {
+      updateModStatus(
+        modId,
+        "error",
+        undefined,
+        taskData.error || "Conversion failed"
+      );
+      return true;
+    }
+
+    return false;
+  };
+
+  // Follow a task over SSE, falling back to polling if the stream fails
+  const watchTaskStatus = (
+    taskId: string,
+    modId: string,
+    onDone: () => void
+  ) => {
+    const startPolling = () => {
+      tastStatusInterval = setInterval(async () => {
+        const isDone = await pollTaskStatus(taskId, modId);
+        if (isDone) {
+          clearInterval(tastStatusInterval!);
+          onDone();
+        }
+      }, 3000);
+    };
+
+    if (typeof EventSource === "undefined") {
+      startPolling();
+      return;
+    }
+
+    let finished = false;
+    taskEventSource = new EventSource(
+      import.meta.env.VITE_API_URL + `/task/${taskId}/events/`
+    );
+    taskEventSource.addEventListener("status", (event) => {
+      const taskData: TaskStatus = JSON.parse((event as MessageEvent).data);
+      if (applyTaskStatus(taskData, modId)) {
+        finished = true;
+        taskEventSource?.close();
+        onDone();
+      }
+    });
+    taskEventSource.onerror = () => {
+      taskEventSource?.close();
+      if (!finished) startPolling();
+    };
+  };
+
   // Process queue when we're in batch processing mode
   useEffect(() => {
     const processNextInQueue = async () => {
@@ -108,13 +191,84 @@ function AppContent() {
     processNextInQueue();
   }, [isBatchProcessing, isConverting, modFiles]);
 
+  // Upload in chunks; a chunk that fails is retried, and after a dropped connection only
+  // the chunks the server is missing are sent again
+  const submitFileChunked = async (
+    file: File,
+    onUploadProgress?: (progress: number) => void
+    // eslint-disable-next-line @typescript-eslint/no-explicit-any
+  ): Promise<any> => {
+    const apiUrl = import.meta.env.VITE_API_URL;
+    const authHeaders: Record<string, string> =
+      isAuthenticated && token ? { Authorization: `Bearer ${token}` } : {};
+
+    console.log(
+      `Starting chunked upload of ${file.name} (${formatFileSize(file.size)})`
+    );
+    const { data: session } = await axios.post<ChunkedUploadStatus>(
+      apiUrl + "/upload/",
+      { filename: file.name, size: file.size },
+      { headers: authHeaders }
+    );
+
+    let bytesSent = session.bytes_received;
+    let missing = session.missing_chunks;
+
+    for (let attempt = 0; missing.length > 0; attempt++) {
+      for (const index of missing) {
+        const start = index * session.chunk_size;
+        const chunk = await file
+          .slice(start, Math.min(start + session.chunk_size, file.size))
+          .arrayBuffer();
+        const checksum = await sha256Hex(chunk);
+
+        try {
+          await axios.put(`${apiUrl}/upload/${session.upload_id}/`, chunk, {
+            params: { index },
+            headers: {
+              "Content-Type": "application/octet-stream",
+              ...(checksum ? { "X-Chunk-SHA256": checksum } : {}),
+            },
+            timeout: 600000,
+          });
+          bytesSent += chunk.byteLength;
+          onUploadProgress?.(Math.round((bytesSent * 100) / file.size));
+        } catch (error) {
+          console.warn(`Chunk ${index} failed, will retry`, error);
+        }
+      }
+
+      // Ask the server what it actually has before retrying
+      const { data: status } = await axios.get<ChunkedUploadStatus>(
+        `${apiUrl}/upload/${session.upload_id}/`
+      );
+      missing = status.missing_chunks;
+      bytesSent = status.bytes_received;
+      if (missing.length > 0) {
+        if (attempt >= CHUNK_RETRIES) {
+          throw new Error(`Upload failed, ${missing.length} chunks missing`);
+        }
+        await new Promise((resolve) => setTimeout(resolve, 2000 * 2 ** attempt));
+      }
+    }
+
+    const response = await axios.post(
+      `${apiUrl}/upload/${session.upload_id}/finalize/`,
+      {},
+      { headers: authHeaders, timeout: 3600000 }
+    );
+    console.log("Chunked upload completed successfully");
+    return response.data;
+  };
+
   const submitFile = async (
     file: File,
     onUploadProgress?: (progress: number) => void
     // eslint-disable-next-line @typescript-eslint/no-explicit-any
   ): Promise<any> => {
-    const formData = new FormData();
-    formData.append("file", file);
+    if (file.size >= CHUNKED_UPLOAD_THRESHOLD) {
+      return submitFileChunked(file, onUploadProgress);
+    }
 
     try {
       console.log(
@@ -145,12 +299,14 @@ function AppContent() {
         }
       );
 
+      // Raw body instead of multipart: the server streams it straight to disk
       const response = await instance.post(
-        import.meta.env.VITE_API_URL + "/convert",
-        formData,
+        import.meta.env.VITE_API_URL + "/convert/stream",
+        file,
         {
+          params: { filename: file.name },
           headers: {
-            "Content-Type": "multipart/form-data",
+            "Content-Type": "application/octet-stream",
             ...(isAuthenticated && token
               ? { Authorization: `Bearer ${token}` }
               : {}),
@@ -269,15 +425,11 @@ function AppContent() {
         prev.map((m) => (m.id === id ? { ...m, taskId: task_id } : m))
       );
 
-      tastStatusInterval = setInterval(async () => {
-        const isDone = await pollTaskStatus(task_id, id);
-        if (isDone) {
-          clearInterval(tastStatusInterval!);
-          setIsConverting(false);
-          setCurrentlyConverting(null);
-          setIsBatchProcessing(false);
-        }
-      }, 3000);
+      watchTaskStatus(task_id, id, () => {
+        setIsConverting(false);
+        setCurrentlyConverting(null);
+        setIsBatchProcessing(false);
+      });
     } catch (error) {
       let errorMessage = "Conversion failed";
 
@@ -316,6 +468,7 @@ function AppContent() {
     if (!isBatchProcessing) return;
 
     clearInterval(tastStatusInterval!);
+    taskEventSource?.close();
     setIsBatchProcessing(false);
   };
 
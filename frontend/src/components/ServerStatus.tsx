@@ -24,6 +24,9 @@ const ServerStatus: React.FC<ServerStatusProps> = ({ serverStatus }) => {
               <div className="text-blue-300 flex items-center">
                 <div className="w-2 h-2 bg-blue-500 rounded-full mr-2 animate-pulse"></div>
                 Active
+                {serverStatus.processing_tasks && serverStatus.workers
+                  ? ` (${serverStatus.processing_tasks.length}/${serverStatus.workers})`
+                  : ""}
               </div>
             ) : (
               <span className="text-gray-400">Idle</span>
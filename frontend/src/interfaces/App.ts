@@ -2,7 +2,18 @@
 export interface QueueStatus {
   queue_size: number;
   current_task: string | null;
+  processing_tasks?: string[];
   queued_tasks: string[];
+  workers?: number;
+  idle_workers?: number;
+  // Predicted start/completion (ISO) of every processing and queued task
+  estimates?: Record<string, TaskEstimate>;
+  estimated_idle_at?: string | null;
+}
+
+export interface TaskEstimate {
+  estimated_start_at: string;
+  estimated_completion_at: string;
 }
 
 // Define the interface for task status response
@@ -11,9 +22,20 @@ export interface TaskStatus {
   status: "queued" | "processing" | "completed" | "failed" | "uploading";
   original_filename: string;
   created_at: string;
+  queue_position?: number | null;
+  estimated_start_at?: string;
+  estimated_completion_at?: string;
   download_url?: string;
   error?: string;
   completed_at?: string;
+  timeline?: TaskStage[];
+}
+
+// Stage marks of a task, only returned to admins
+export interface TaskStage {
+  stage: string;
+  at: string;
+  ms: number | null;
 }
 
 export interface ModFile {
@@ -25,3 +47,15 @@ export interface ModFile {
   errorMessage?: string;
   taskId?: string;
 }
+
+// Resumable upload session returned by /upload/ and /upload/<id>/
+export interface ChunkedUploadStatus {
+  upload_id: string;
+  filename: string;
+  size: number;
+  chunk_size: number;
+  chunk_count: number;
+  received_chunks: number[];
+  missing_chunks: number[];
+  bytes_received: number;
+}
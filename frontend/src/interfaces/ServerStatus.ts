@@ -1,7 +1,9 @@
 export interface QueueStatus {
   queue_size: number;
   current_task: string | null;
+  processing_tasks?: string[];
   queued_tasks: string[];
+  workers?: number;
 }
 
 export interface ServerStatusProps {